@@ -1,6 +1,48 @@
 import sys
 from gi.repository import GLib, Gio, Gtk
 
+from deck import Deck
+from loader import DeckLoader
+
+# Number of card widgets kept in the stack: the visible one and the next
+# one, rendered off screen
+CARD_POOL_SIZE = 2
+
+
+def load_template(path):
+    """Reads a glade file once so widgets can be built from memory"""
+    try:
+        with open(path, 'r') as template:
+            return template.read()
+    except OSError:
+        print("file not found")
+        sys.exit()
+
+
+class CardPage:
+    """
+    A card widget built from the flippable template and reused for many
+    cards by updating its buffers in place.
+    """
+
+    def __init__(self, template, name):
+        builder = Gtk.Builder.new_from_string(template, -1)
+        self.widget = builder.get_object("card_draw")
+        self.question_buffer = builder.get_object("question_buffer")
+        self.answer_buffer = builder.get_object("answer_buffer")
+        self.name = name
+        self.card = None
+
+    def show(self, card):
+        self.card = card
+        self.question_buffer.set_text(card.question())
+        self.answer_buffer.set_text(card.answer())
+
+    def show_text(self, question, answer=""):
+        self.card = None
+        self.question_buffer.set_text(question)
+        self.answer_buffer.set_text(answer)
+
 
 class AppWindow(Gtk.ApplicationWindow):
     def __init__(self, *args, **kwargs):
@@ -63,9 +105,15 @@ class Application(Gtk.Application):
         )
         self._window = None
         self._deck = None
+        self._card_template = None
+        self._pages = []
+        self._current = None
+        self._loader = None
 
     def do_startup(self):
         Gtk.Application.do_startup(self)
+        # The card template is parsed from memory for each page of the pool
+        self._card_template = load_template("UI/flippable.glade")
 
         action = Gio.SimpleAction.new("about", None)
         action.connect("activate", self.on_about)
@@ -82,25 +130,94 @@ class Application(Gtk.Application):
             # when the last one is closed the application shuts down
             self._window = AppWindow(application=self, title="pfc")
 
-        card = self._deck.draw()
-        # a builder to add the UI designed with Glade to the grid:
-        card_builder = Gtk.Builder()
-        # get the file (if it is there)
-        try:
-            card_builder.add_from_file("UI/flippable.glade")
-        except Exception:
-            print("file not found")
-            sys.exit()
-        # and attach it to the grid
-
-        card_draw = card_builder.get_object("card_draw")
-        card_builder.get_object("question_buffer").set_text(card.question())
-        card_builder.get_object("answer_buffer").set_text(card.answer())
-        self._window.card_area.add_named(card_draw,
-                                         "card_draw")
+        if not self._pages:
+            for i in range(CARD_POOL_SIZE):
+                page = CardPage(self._card_template, "card_%d" % i)
+                self._window.card_area.add_named(page.widget, page.name)
+                self._pages.append(page)
+            # The scoring buttons are ordered from grade 0 to grade 5
+            for grade, button in enumerate(
+                    self._window.scoring.get_children()):
+                button.connect("clicked", self.on_score, grade)
+            self.start_loading()
+            self.show_next_card()
 
         self._window.present()
 
+    def start_loading(self):
+        """
+        Fetches the due cards in a worker thread. The batches are added to
+        the deck from the main loop. A session keeps its overdue order.
+        """
+        order = 'random' if isinstance(self._deck, Deck) else 'overdue'
+        self._loader = DeckLoader(
+            self._deck,
+            lambda batch, loaded, total: GLib.idle_add(
+                self.on_cards_loaded, batch, loaded, total),
+            lambda: GLib.idle_add(self.on_loading_finished),
+            order=order)
+        self._loader.start()
+
+    def _loading(self):
+        return self._loader is not None and self._loader.is_alive()
+
+    def _prepare(self, page):
+        """Renders the next card of the deck in a page, if there is one"""
+        if len(self._deck) > 0:
+            page.show(self._deck.draw())
+        elif self._loading():
+            page.show_text("Loading...")
+        else:
+            page.show_text("Finished!")
+
+    def _fill_empty_pages(self):
+        """Renders cards in the pages that were waiting for them"""
+        page = self._pages[self._current]
+        if page.card is None:
+            self._prepare(page)
+            self._window.scoring.set_sensitive(page.card is not None)
+        following = self._pages[(self._current + 1) % len(self._pages)]
+        if following.card is None:
+            self._prepare(following)
+
+    def on_cards_loaded(self, batch, loaded, total):
+        if self._loader.cancelled:
+            return False
+        for card in batch:
+            self._deck.add(card)
+        self._window.set_title("pfc (loading %d/%d)" % (loaded, total))
+        self._fill_empty_pages()
+        # Run once
+        return False
+
+    def on_loading_finished(self):
+        self._loader.join()
+        self._window.set_title("pfc")
+        self._fill_empty_pages()
+        return False
+
+    def show_next_card(self):
+        """
+        Shows the card rendered in the hidden page and renders the one
+        after it in the page that was visible.
+        """
+        if self._current is None:
+            self._current = 0
+            self._prepare(self._pages[0])
+        else:
+            self._current = (self._current + 1) % len(self._pages)
+        page = self._pages[self._current]
+        self._window.card_area.set_visible_child_name(page.name)
+        self._window.scoring.set_sensitive(page.card is not None)
+        following = self._pages[(self._current + 1) % len(self._pages)]
+        self._prepare(following)
+
+    def on_score(self, button, grade):
+        card = self._pages[self._current].card
+        if card is not None:
+            self._deck.review(card, grade)
+        self.show_next_card()
+
     def do_command_line(self, command_line):
         options = command_line.get_options_dict()
         # convert GVariantDict -> GVariant -> dict
@@ -120,6 +237,17 @@ class Application(Gtk.Application):
     def on_quit(self, action, param):
         self.quit()
 
+    def do_shutdown(self):
+        # Closing the window mid-load stops the worker, which must be done
+        # with the database before the deck closes it
+        if self._loader is not None:
+            self._loader.cancel()
+            self._loader.join()
+        # Writes the pending reviews back to the table
+        if self._deck is not None:
+            self._deck.close()
+        Gtk.Application.do_shutdown(self)
+
     @property
     def deck(self):
         return self._deck
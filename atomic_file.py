@@ -0,0 +1,22 @@
+"""
+Atomic replacement of small files
+"""
+import os
+
+
+def atomic_write(path, data):
+    """
+    Replaces the content of a file in one step.
+
+    The data is written to a temporary file next to the target, which is
+    then renamed over it, so readers and crashes see either the old or
+    the new content, never a partial write.
+    Args:
+        path (str): The path of the file.
+        data (str or bytes): The new content.
+    """
+    temp_path = path + '.tmp'
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    with open(temp_path, mode) as temp_file:
+        temp_file.write(data)
+    os.replace(temp_path, path)
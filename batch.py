@@ -0,0 +1,196 @@
+"""
+Vectorized scheduling of whole decks with NumPy
+"""
+import math
+
+import numpy as np
+
+from scheduler import MAX_INTERVAL
+
+
+def _exact_pow(base, exponent):
+    """Python's pow, giving inf where update() catches the overflow"""
+    try:
+        return pow(base, exponent)
+    except OverflowError:
+        return math.inf
+
+
+# NumPy's SIMD power is not always rounded like the C library's pow used
+# by Python floats, it is off by one unit in the last place for a few
+# percent of sm2 states. The exact power calls Python's pow once per
+# element, about 0.2s per million cards against a few milliseconds for
+# np.power, a fifth of the time of sm2_batch(), see
+# benchmarks/sm2_batch.py
+_pow = np.frompyfunc(_exact_pow, 2, 1)
+
+
+def pad_histories(values, offsets):
+    """
+    Converts ragged histories to a padded matrix.
+    Args:
+        values (array of int): All the answers, one history after another.
+        offsets (array of int): Where each history starts in values, plus
+            the total length at the end.
+    Returns:
+        (tuple of array): The (cards, longest history) matrix of answers
+        and the length of each history.
+    """
+    values = np.asarray(values)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    width = int(lengths.max()) if len(lengths) else 0
+    padded = np.zeros((len(lengths), width), dtype=values.dtype)
+    # The flat position of an answer in the matrix is its position in
+    # values shifted by the padding of the rows before it
+    shifts = np.repeat(np.arange(len(lengths)) * width
+                       - (offsets[:-1] - offsets[0]), lengths)
+    padded.reshape(-1)[np.arange(offsets[-1] - offsets[0]) + shifts] = \
+        values[offsets[0]:offsets[-1]]
+    return padded, lengths
+
+
+def state_batch(histories, lengths=None, offsets=None, b=-0.8, c=0.28,
+                d=0.02):
+    """
+    Returns the scheduler state of many histories in one vectorized pass.
+
+    The running score is accumulated left to right like update() does, so
+    the results are identical to calling state_from_history() on each
+    history. Ragged histories take memory in the number of answers, not
+    cards times the longest history.
+    Args:
+        histories (array of int): Either a (cards, longest history) matrix
+            of answers padded at the end, or the flat answers of all the
+            cards when offsets is given.
+        lengths (array of int, optional): The length of each padded row,
+            by default every row is full.
+        offsets (array of int, optional): The start of each history in the
+            flat answers, plus the total length at the end.
+    Returns:
+        (tuple of array): The score and the streak of each card, see
+        scheduler.SM2State.
+    """
+    if offsets is None:
+        padded = np.asarray(histories)
+        if padded.ndim != 2:
+            raise ValueError("Padded histories must be a 2-D array")
+        if lengths is None:
+            lengths = np.full(padded.shape[0], padded.shape[1])
+        lengths = np.asarray(lengths, dtype=np.int64)
+        values = padded[np.arange(padded.shape[1]) < lengths[:, None]]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+    else:
+        offsets = np.asarray(offsets, dtype=np.int64)
+        values = np.asarray(histories)[offsets[0]:offsets[-1]]
+        offsets = offsets - offsets[0]
+        lengths = np.diff(offsets)
+    assert len(values) == 0 or 0 <= values.min() and values.max() <= 5
+
+    # The term of each grade is computed like update() does and added left
+    # to right one answer position at a time, so the sums round like the
+    # running score. With the cards sorted longest first, the cards that
+    # still have an answer at a position are a prefix, and no (cards,
+    # longest history) matrix is needed. Once fewer cards remain than
+    # positions, the rest of each of their histories is summed on its own,
+    # cumsum adds in order too
+    grades = np.arange(6, dtype=np.float64)
+    terms = (b+c*grades+d*grades*grades)[values]
+    order = np.argsort(-lengths, kind='stable')
+    starts = offsets[:-1][order]
+    ends = offsets[1:][order]
+    width = int(lengths.max()) if len(lengths) else 0
+    remaining = np.searchsorted(-lengths[order], -np.arange(width),
+                                side='left')
+    sorted_score = np.zeros(len(lengths))
+    position = 0
+    while position < width and remaining[position] > width - position:
+        count = remaining[position]
+        sorted_score[:count] += terms[starts[:count] + position]
+        position += 1
+    for i in range(remaining[position] if position < width else 0):
+        tail = terms[starts[i] + position:ends[i]]
+        sorted_score[i] = np.cumsum(np.concatenate(([sorted_score[i]],
+                                                    tail)))[-1]
+    score = np.empty(len(lengths))
+    score[order] = sorted_score
+
+    # The streak ends at the latest incorrect answer. The running maximum
+    # of the positions of the incorrect answers gives the latest one
+    # before the end of every history
+    incorrect = np.where(values < 3, np.arange(len(values)), -1)
+    latest = np.concatenate(([-1], np.maximum.accumulate(incorrect)))
+    last_incorrect = latest[offsets[1:]]
+    streak = np.where(last_incorrect >= offsets[:-1],
+                      offsets[1:] - 1 - last_incorrect, lengths)
+    return score, streak
+
+
+def interval_batch(score, streak, a=6.0, assumed_score=2.5, min_score=1.3,
+                   theta=1.0, exact=False):
+    """
+    Returns the interval update() gives many scheduler states.
+    Args:
+        score (array of float): The score of each state.
+        streak (array of int): The streak of each state.
+        exact (bool, optional): True takes the power with Python's pow
+            one element at a time, so the results are bitwise equal to
+            update(), False uses np.power, within two units in the last
+            place of the interval and about 50 times faster for the
+            power.
+    Returns:
+        (array of float): The number of days until the next review, 1.0
+        without a streak and at most scheduler.MAX_INTERVAL.
+    """
+    score = np.asarray(score, dtype=np.float64)
+    streak = np.asarray(streak)
+    intervals = np.ones(len(score))
+    correct = streak > 0
+    base = np.maximum(min_score, assumed_score + score[correct])
+    exponent = theta*streak[correct]
+    # Long streaks overflow to inf, capped like update() does
+    with np.errstate(over='ignore'):
+        if exact:
+            powers = _pow(base, exponent).astype(np.float64)
+        else:
+            powers = np.power(base, exponent)
+        intervals[correct] = a*powers
+    return np.minimum(intervals, MAX_INTERVAL)
+
+
+def sm2_batch(histories, lengths=None, offsets=None, a=6.0, b=-0.8, c=0.28,
+              d=0.02, assumed_score=2.5, min_score=1.3, theta=1.0,
+              exact=True):
+    """
+    Returns sm2() for many histories in one vectorized pass.
+
+    By default the results are identical to calling sm2() on each history.
+    Args:
+        histories (array of int): The histories, see state_batch().
+        lengths (array of int, optional): See state_batch().
+        offsets (array of int, optional): See state_batch().
+        exact (bool, optional): False trades bitwise equality for speed,
+            see interval_batch().
+    Returns:
+        (array of float): The number of days until the next review of each
+        card. Empty histories get 1.0.
+    """
+    score, streak = state_batch(histories, lengths, offsets, b, c, d)
+    return interval_batch(score, streak, a, assumed_score, min_score, theta,
+                          exact)
+
+
+def histories_from_documents(documents):
+    """
+    Packs the histories of card documents for sm2_batch().
+    Args:
+        documents (iterable of dict): The card documents.
+    Returns:
+        (tuple of array): The flat answers and their offsets.
+    """
+    values = []
+    offsets = [0]
+    for document in documents:
+        values.extend(document.get('history', []))
+        offsets.append(len(values))
+    return np.array(values, dtype=np.int8), np.array(offsets, dtype=np.int64)
@@ -0,0 +1,60 @@
+"""
+Compares sm2() called per card with sm2_batch() on whole decks, exact and
+with np.power.
+
+Usage: python benchmarks/sm2_batch.py [cards ...]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import sm2_batch  # noqa: E402
+from scheduler import sm2  # noqa: E402
+
+# Deck sizes used when none are given
+SIZES = [100000, 1000000]
+
+
+def synthetic_histories(cards, seed=0):
+    """Returns random flat histories and offsets of 1 to 30 answers"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 31, cards)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    values = rng.integers(0, 6, offsets[-1]).astype(np.int8)
+    return values, offsets
+
+
+def run(cards):
+    values, offsets = synthetic_histories(cards)
+    histories = [values[start:end].tolist()
+                 for start, end in zip(offsets[:-1], offsets[1:])]
+
+    start = time.perf_counter()
+    expected = [sm2(history) for history in histories]
+    scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    intervals = sm2_batch(values, offsets=offsets)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = sm2_batch(values, offsets=offsets, exact=False)
+    inexact = time.perf_counter() - start
+
+    assert np.array_equal(intervals, expected)
+    # np.power is off by one unit in the last place, two once scaled
+    assert np.all(np.abs(fast - intervals)
+                  <= 2 * np.spacing(np.maximum(fast, intervals)))
+    print("%9d cards: sm2 %7.2fs  sm2_batch %6.2fs  speedup %5.1fx  "
+          "inexact %6.3fs  speedup %6.1fx  %4.1f%% differ"
+          % (cards, scalar, vectorized, scalar / vectorized, inexact,
+             scalar / inexact, 100 * np.mean(fast != intervals)))
+
+
+if __name__ == '__main__':
+    for size in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        run(size)
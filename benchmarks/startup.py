@@ -0,0 +1,85 @@
+"""
+Measures the cold start of the terminal review mode.
+
+Usage: python benchmarks/startup.py [max_import_ms] [max_start_ms]
+
+Runs 'python -X importtime' on main.py and a full 'main.py --tui' session
+on a small SQLite deck in fresh interpreters. Exits with status 1 when a
+budget is exceeded or when a heavy module is imported on this path.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlite_storage import SQLiteDatabase  # noqa: E402
+
+# Budgets in milliseconds, for main.py's own imports and for a session
+MAX_IMPORT_MS = 50
+MAX_START_MS = 250
+# Modules that must not be imported by the terminal mode
+FORBIDDEN = ('gi', 'tinydb', 'numpy')
+RUNS = 5
+
+
+def import_times():
+    """Returns the microseconds spent importing each top level module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import main'], cwd=ROOT, capture_output=True,
+                            text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        times[name] = times.get(name, 0) + int(own)
+    return times
+
+
+def session_time(source):
+    """Returns the best wall time of a terminal session that exits at once"""
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'main.py', '--tui', source, 'bench'],
+                       cwd=ROOT, input='exit\n', capture_output=True,
+                       text=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    max_import_ms = float(sys.argv[1]) if len(sys.argv) > 1 \
+        else MAX_IMPORT_MS
+    max_start_ms = float(sys.argv[2]) if len(sys.argv) > 2 else MAX_START_MS
+    failed = False
+
+    times = import_times()
+    import_ms = sum(times.values()) / 1000
+    heavy = [name for name in times if name.split('.')[0] in FORBIDDEN]
+    print("import main: %.1f ms (budget %.0f ms)" % (import_ms, max_import_ms))
+    if heavy:
+        print("heavy modules imported: %s" % ', '.join(sorted(heavy)))
+        failed = True
+    failed |= import_ms > max_import_ms
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'bench.sqlite')
+        db = SQLiteDatabase(source)
+        db.table('bench').insert_multiple(
+            {'next_time': datetime(2020, 1, 1), 'question': 'q%d' % i,
+             'answer': 'a%d' % i, 'hint': ''} for i in range(1000))
+        db.close()
+        start_ms = session_time(source) * 1000
+    print("main.py --tui session: %.1f ms (budget %.0f ms)"
+          % (start_ms, max_start_ms))
+    failed |= start_ms > max_start_ms
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,219 @@
+"""
+Times the main deck operations on synthetic TinyDB decks.
+
+Usage: python benchmarks/suite.py [--output results.json]
+                                  [--compare baseline.json] [cards ...]
+
+Every operation is run REPEAT times and the best time is kept. The results
+are printed and, with --output, saved as JSON along with the commit they
+were measured on. With --compare, each operation is compared with a
+previous results file and the script exits with status 1 when one got
+slower than TOLERANCE times its baseline.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from card import Card  # noqa: E402
+from deck import Deck  # noqa: E402
+from scheduler import sm2  # noqa: E402
+from storage import open_or_create_db  # noqa: E402
+from synthetic import write_deck  # noqa: E402
+from tinydb_storage import DateTimeSerializer  # noqa: E402
+
+# Deck sizes used when none are given
+SIZES = [1000, 100000, 1000000]
+TABLE = 'bench'
+REPEAT = 3
+# The number of cards Card.check is timed on
+CHECK_CARDS = 10000
+# A slowdown above this ratio is reported as a regression
+TOLERANCE = 1.25
+# Runs shorter than this in seconds are too noisy to be flagged
+NOISE_FLOOR = 0.01
+
+
+def best(function, setup=None):
+    """
+    Returns the best time of REPEAT runs of a function.
+    Args:
+        function (callable): Called with the result of setup, if any.
+        setup (callable, optional): Prepares each run, it is not timed.
+    Returns:
+        (float): The shortest run in seconds.
+    """
+    times = []
+    for _ in range(REPEAT):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        function(argument) if setup else function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def open_table(path, cold):
+    """Opens the deck table and looks up its due cards"""
+    if cold:
+        # Drops the due index so it is rebuilt from the file
+        index_path = '%s.%s.due' % (path, TABLE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+    db = open_or_create_db(path)
+    db.table(TABLE).due_ids(datetime.now())
+    db.close()
+
+
+def loaded_deck(path):
+    deck = Deck(path, TABLE)
+    deck.load()
+    return deck
+
+
+def draw_add(deck):
+    """Draws every card of the deck once, putting each one back"""
+    for _ in range(len(deck)):
+        deck.add(deck.draw())
+
+
+def check_cards(cards):
+    """Checks a right, a wrong and a mistyped answer for each card"""
+    for card, answer in cards:
+        card.check(answer)
+        card.check('wrong answer')
+        card.check(answer[:-1] + '#', max_typos=1)
+
+
+def run(path, cards):
+    """
+    Times the operations on a deck.
+    Args:
+        path (str): The path of the TinyDB deck.
+        cards (int): The number of cards of the deck.
+    Returns:
+        (dict): The seconds and number of operations of each benchmark.
+    """
+    results = {}
+
+    def record(name, seconds, operations):
+        results[name] = {'seconds': seconds, 'operations': operations}
+        print("%9d cards  %-28s %9.4fs  %10.0f ops/s"
+              % (cards, name, seconds, operations / seconds if seconds
+                 else float('inf')))
+
+    record('open_or_create_db (cold)',
+           best(lambda: open_table(path, cold=True)), cards)
+    record('open_or_create_db (indexed)',
+           best(lambda: open_table(path, cold=False)), cards)
+
+    due = Deck(path, TABLE).due_count()
+    record('Deck.fetch', best(lambda deck: list(deck.fetch()),
+                              lambda: Deck(path, TABLE)), due)
+    record('Deck.load', best(lambda deck: deck.load(),
+                             lambda: Deck(path, TABLE)), due)
+
+    deck = loaded_deck(path)
+    record('Deck.shuffle', best(deck.shuffle), due)
+    record('Deck.draw/add', best(lambda: draw_add(deck)), due)
+
+    checked = [(Card(card.answer(), card.question(), card.hint()),
+                card.answer().split(',')[0].strip())
+               for card in Deck(path, TABLE).fetch(limit=CHECK_CARDS)]
+    record('Card.check', best(lambda: check_cards(checked)),
+           3 * len(checked))
+
+    db = open_or_create_db(path)
+    table = db.table(TABLE)
+    documents = list(table)
+    db.close()
+    histories = [document['history'] for document in documents]
+    record('sm2', best(lambda: [sm2(history) for history in histories]),
+           len(histories))
+
+    serializer = DateTimeSerializer()
+    next_times = [document['next_time'] for document in documents]
+    record('DateTimeSerializer', best(
+        lambda: [serializer.decode(serializer.encode(next_time))
+                 for next_time in next_times]), len(next_times))
+    return results
+
+
+def current_commit():
+    """Returns the commit of the working tree, None outside of git"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Prints the time ratio of each operation measured in both runs.
+    Args:
+        results (dict): The results of this run, by deck size.
+        baseline (dict): The results of a previous run, by deck size.
+    Returns:
+        (list of str): The operations slower than TOLERANCE times their
+            baseline, ignoring runs shorter than NOISE_FLOOR.
+    """
+    regressions = []
+    for size, operations in results.items():
+        for name, result in operations.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous is None or not previous['seconds']:
+                continue
+            ratio = result['seconds'] / previous['seconds']
+            slower = (ratio > TOLERANCE
+                      and result['seconds'] >= NOISE_FLOOR)
+            flag = '  REGRESSION' if slower else ''
+            print("%9s cards  %-28s %6.2fx%s" % (size, name, ratio, flag))
+            if slower:
+                regressions.append('%s cards %s' % (size, name))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for option in ('--output', '--compare'):
+        if option in args:
+            position = args.index(option)
+            if position + 1 >= len(args):
+                print(__doc__.strip().splitlines()[2])
+                sys.exit(1)
+            options[option] = args[position + 1]
+            del args[position:position + 2]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in [int(arg) for arg in args] or SIZES:
+            path = os.path.join(directory, 'deck_%d.json' % size)
+            start = time.perf_counter()
+            write_deck(path, size, TABLE)
+            print("%9d cards  generated in %.1fs"
+                  % (size, time.perf_counter() - start))
+            results[str(size)] = run(path, size)
+
+    if '--output' in options:
+        with open(options['--output'], 'w') as output_file:
+            json.dump({'commit': current_commit(),
+                       'date': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'repeat': REPEAT,
+                       'results': results}, output_file, indent=2)
+
+    if '--compare' in options:
+        with open(options['--compare'], 'r') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        if compare(results, baseline):
+            sys.exit(1)
@@ -0,0 +1,83 @@
+"""
+Generates synthetic TinyDB decks for the benchmarks.
+
+Usage: python benchmarks/synthetic.py <target.json> <table> <cards> [seed]
+
+About a fifth of the cards are new and due now. The others have a review
+history of mostly passing grades, were last reviewed in the past month
+and come back after a log-normal number of days, so a realistic share of
+the deck is due.
+"""
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import DATE_TAG, time_key  # noqa: E402
+
+WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+         'hotel', 'india', 'juliett', 'kilo', 'lima', 'mike', 'november',
+         'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform',
+         'victor', 'whiskey', 'xray', 'yankee', 'zulu', 'café', 'niño')
+# Grades 0 to 5 and how often they are given
+GRADE_WEIGHTS = (5, 5, 10, 25, 30, 25)
+NEW_CARDS = 0.2
+
+
+def synthetic_document(rng, now):
+    """Returns a random card document"""
+    question = ' '.join(rng.choices(WORDS, k=rng.randint(3, 8))) + '?'
+    answer = ', '.join(' '.join(rng.choices(WORDS, k=rng.randint(1, 3)))
+                       for _ in range(rng.randint(1, 3)))
+    hint = rng.choice(WORDS) if rng.random() < 0.5 else None
+    if rng.random() < NEW_CARDS:
+        history = []
+        next_time = now
+    else:
+        reviews = min(int(rng.expovariate(1 / 8)) + 1, 60)
+        history = rng.choices(range(6), GRADE_WEIGHTS, k=reviews)
+        reviewed = now - timedelta(days=rng.uniform(0, 30))
+        next_time = reviewed + timedelta(days=rng.lognormvariate(1.5, 1.0))
+    return {'next_time': next_time.replace(microsecond=0),
+            'question': question, 'answer': answer, 'hint': hint,
+            'history': history}
+
+
+def write_deck(path, cards, table='bench', seed=0, now=None):
+    """
+    Writes a TinyDB file holding one table of synthetic cards.
+
+    The JSON is written one document at a time, in the format of the
+    TinyDB backend, so large decks never have to fit in memory.
+    Args:
+        path (str): The path of the TinyDB file.
+        cards (int): The number of cards.
+        table (str, optional): The name of the table.
+        seed (int, optional): The seed of the random generator.
+        now (datetime, optional): The reference time, defaults to now.
+    Returns:
+        (str): The path of the file.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    with open(path, 'w', encoding='utf-8') as deck_file:
+        deck_file.write('{%s: {' % json.dumps(table))
+        for doc_id in range(1, cards + 1):
+            document = synthetic_document(rng, now)
+            document['next_time'] = DATE_TAG + time_key(document['next_time'])
+            if doc_id > 1:
+                deck_file.write(', ')
+            deck_file.write('"%d": %s' % (doc_id, json.dumps(document)))
+        deck_file.write('}}')
+    return path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (4, 5):
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+    seed = int(sys.argv[4]) if len(sys.argv) == 5 else 0
+    write_deck(sys.argv[1], int(sys.argv[3]), sys.argv[2], seed)
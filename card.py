@@ -1,3 +1,57 @@
+import unicodedata
+
+from metrics import timed
+
+
+def normalize(text):
+    """
+    Returns the form of a text used to compare answers.
+
+    The text is casefolded, stripped of accents and its whitespace is
+    collapsed, so "  Éclair " and "eclair" compare equal.
+    Args:
+        text (str): The text to normalize.
+    Returns:
+        (str): The normalized text.
+    """
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    stripped = ''.join(char for char in decomposed
+                       if not unicodedata.combining(char))
+    return ' '.join(stripped.split())
+
+
+def within_distance(first, second, max_distance):
+    """
+    Determines if the edit distance of two texts is at most max_distance.
+
+    Only a band of 2*max_distance+1 cells around the diagonal is computed
+    and the computation stops as soon as the band exceeds max_distance.
+    Args:
+        first (str): A text.
+        second (str): Another text.
+        max_distance (int): The number of edits allowed.
+    Returns:
+        (bool): True if the texts are close enough.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return False
+    beyond = max_distance + 1
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        low = max(1, i - max_distance)
+        high = min(len(second), i + max_distance)
+        current = [beyond] * (len(second) + 1)
+        if low == 1:
+            current[0] = i
+        for j in range(low, high + 1):
+            cost = previous[j - 1] + (first_char != second[j - 1])
+            current[j] = min(cost, previous[j] + 1, current[j - 1] + 1,
+                             beyond)
+        if min(current[max(0, low - 1):high + 1]) > max_distance:
+            return False
+        previous = current
+    return previous[len(second)] <= max_distance
+
 
 class Card:
     """
@@ -8,46 +62,118 @@ class Card:
         __answer (list of str): A list of possible answers for the card.
         __question (str):      The question for the card.
         __hint (str, optional):  The hint associated with the definition.
+        __answers (frozenset of str): The normalized answers, built on the
+                                      first check.
+        __by_length (dict):           The normalized answers by length, for
+                                      typo tolerant checks.
+        __store (CardStore):     The store the card is a view into, if any.
+        __index (int):           The position of the card in the store.
+        __doc_id (int):          The id of the card in its table, if known.
     """
+    __slots__ = ('__answer', '__question', '__hint', '__answers',
+                 '__by_length', '__store', '__index', '__doc_id')
 
-    def __init__(self, answer, question, hint=None):
+    def __init__(self, answer, question, hint=None, doc_id=None):
         """
         Constructor.
         Args:
             answer (list of str): A list of possible answers for the card.
             question (str):      The question/definition for the card.
             hint (str, optional):  The hint associated with the definition.
+            doc_id (int, optional): The id of the card in its table.
         """
         self.__answer = answer
         self.__question = question
         self.__hint = hint
+        self.__doc_id = doc_id
+        self.__answers = None
+        self.__by_length = None
+        self.__store = None
+        self.__index = None
+
+    @classmethod
+    def view(cls, store, index):
+        """
+        Creates a card whose texts are read from a CardStore when needed.
+        Args:
+            store (CardStore): The store holding the card.
+            index (int): The position of the card in the store.
+        Returns:
+            (Card): The card.
+        """
+        card = cls(None, None)
+        card.__store = store
+        card.__index = index
+        return card
+
+    @property
+    def store(self):
+        return self.__store
+
+    @property
+    def index(self):
+        return self.__index
+
+    @property
+    def doc_id(self):
+        if self.__store is not None:
+            return self.__store.doc_id(self.__index)
+        return self.__doc_id
+
+    def __build_answers(self):
+        """Builds the normalized answer index"""
+        self.__answers = frozenset(normalize(ans)
+                                   for ans in self.answer().split(','))
+        self.__by_length = {}
+        for ans in self.__answers:
+            self.__by_length.setdefault(len(ans), []).append(ans)
 
-    def check(self, attempt):
+    @timed('card.check')
+    def check(self, attempt, max_typos=0):
         """
         Determines if the given answer is correct.
         Args:
             answer (str): The answer to check.
+            max_typos (int, optional): The number of edits, such as a
+                missing or swapped letter, still accepted.
         Returns:
             (bool): True if the answer is correct and false otherwise.
         """
-        for ans in self.__answer.split(','):
-            if attempt.lower() == ans.lower():
-                return True
+        if self.__answers is None:
+            self.__build_answers()
+        attempt = normalize(attempt)
+        if attempt in self.__answers:
+            return True
+        if max_typos == 0:
+            return False
+        # Only answers of a close enough length can be within max_typos
+        for length in range(len(attempt) - max_typos,
+                            len(attempt) + max_typos + 1):
+            for ans in self.__by_length.get(length, ()):
+                if within_distance(attempt, ans, max_typos):
+                    return True
+        return False
 
     def answer(self):
         """
             Displays the answer(s) of the card.
         """
+        if self.__store is not None:
+            return self.__store.answer(self.__index)
         return self.__answer
 
     def question(self):
         """
             Displays the card question.
         """
+        if self.__store is not None:
+            return self.__store.question(self.__index)
         return self.__question
 
     def hint(self):
         """
             Displays the card hint, if available.
         """
+        if self.__store is not None:
+            return self.__store.hint(self.__index)
         return self.__hint
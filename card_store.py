@@ -0,0 +1,159 @@
+"""
+Columnar storage for large numbers of cards
+"""
+from array import array
+from datetime import datetime, timedelta
+
+from card import Card
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(when):
+    """Returns a datetime as whole seconds since the epoch"""
+    return (when - EPOCH) // timedelta(seconds=1)
+
+
+def from_epoch(seconds):
+    """Returns the datetime of a number of seconds since the epoch"""
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class Document(dict):
+    """
+    A document of a table not stored with TinyDB, mirroring TinyDB's
+    Document.
+
+    Attributes:
+        doc_id (int): The id of the document in its table.
+    """
+
+    def __init__(self, value, doc_id):
+        super().__init__(value)
+        self.doc_id = doc_id
+
+
+class TextColumn:
+    """
+    Many strings stored as one UTF-8 buffer and an array of end offsets.
+
+    Attributes:
+        __data (bytearray):  The encoded strings, one after another.
+        __ends (array):      The offset where each string ends.
+    """
+
+    def __init__(self):
+        self.__data = bytearray()
+        self.__ends = array('q')
+
+    def __len__(self):
+        return len(self.__ends)
+
+    def __getitem__(self, index):
+        start = self.__ends[index - 1] if index else 0
+        return self.__data[start:self.__ends[index]].decode('utf-8')
+
+    def append(self, text):
+        self.__data += text.encode('utf-8')
+        self.__ends.append(len(self.__data))
+
+    def nbytes(self):
+        """Returns the memory used by the buffers"""
+        return len(self.__data) + self.__ends.itemsize * len(self.__ends)
+
+
+class CardStore:
+    """
+    Questions, answers and hints of many cards in shared text buffers.
+
+    A card only costs its encoded text plus a few fixed size array slots,
+    instead of a Python object with three string objects. Cards are handed
+    out as lightweight Card views that decode their texts when asked.
+
+    Attributes:
+        __questions (TextColumn): The questions.
+        __answers (TextColumn):   The answers.
+        __hints (TextColumn):     The hints, '' for cards without one.
+        __no_hint (set of int):   The cards whose hint is None.
+        __next_times (array):     The next_time of each card, in seconds
+                                  since the epoch.
+        __doc_ids (array):        The id of each card in its table.
+    """
+
+    def __init__(self):
+        self.__questions = TextColumn()
+        self.__answers = TextColumn()
+        self.__hints = TextColumn()
+        self.__no_hint = set()
+        self.__next_times = array('q')
+        self.__doc_ids = array('q')
+
+    def __len__(self):
+        return len(self.__doc_ids)
+
+    def append(self, document):
+        """
+        Adds a card document to the store.
+        Args:
+            document (Document): The card document.
+        Returns:
+            (int): The index of the card in the store.
+        """
+        index = len(self)
+        hint = document.get('hint')
+        if hint is None:
+            self.__no_hint.add(index)
+            hint = ''
+        self.__questions.append(document['question'])
+        self.__answers.append(document['answer'])
+        self.__hints.append(hint)
+        self.__next_times.append(to_epoch(document.get('next_time', EPOCH)))
+        self.__doc_ids.append(getattr(document, 'doc_id', -1))
+        return index
+
+    def extend(self, documents):
+        """
+        Adds card documents to the store.
+        Returns:
+            (range): The indexes of the added cards.
+        """
+        start = len(self)
+        for document in documents:
+            self.append(document)
+        return range(start, len(self))
+
+    def card(self, index):
+        """
+        Returns a Card view of the card at the given index.
+        """
+        return Card.view(self, index)
+
+    def question(self, index):
+        return self.__questions[index]
+
+    def answer(self, index):
+        return self.__answers[index]
+
+    def hint(self, index):
+        if index in self.__no_hint:
+            return None
+        return self.__hints[index]
+
+    def doc_id(self, index):
+        return self.__doc_ids[index]
+
+    def next_times(self):
+        """
+        Returns a copy of the next_time column as a NumPy datetime64 array.
+        """
+        import numpy as np
+        return np.frombuffer(self.__next_times, dtype='datetime64[s]').copy()
+
+    def nbytes(self):
+        """
+        Returns the memory used by the columns.
+        """
+        return (self.__questions.nbytes() + self.__answers.nbytes()
+                + self.__hints.nbytes()
+                + self.__next_times.itemsize * len(self.__next_times)
+                + self.__doc_ids.itemsize * len(self.__doc_ids))
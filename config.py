@@ -1,13 +1,36 @@
 """
 Configuration file-related functions
 """
+import copy
 import os
 import shlex
 import shutil
 import stat
 import tempfile
+import threading
 import configparser
 
+# Parsed config files shared by all the Config objects of the process,
+# keyed by (conf_type, path). Each entry is a (signature, config) tuple,
+# the signature being the (mtime, size) of the file that was read.
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _signature(file_stat):
+    """Returns the (mtime, size) signature of a stat result"""
+    return (file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def file_signature(filepath):
+    """
+    Returns the (mtime, size) signature of a file, None if it is missing.
+    """
+    try:
+        return _signature(os.stat(filepath))
+    except FileNotFoundError:
+        return None
+
 
 class Config(object):
     def __init__(self, conf_type, conf_dir='/etc/pfc'):
@@ -30,19 +53,59 @@ class Config(object):
         """
         Reads the file and returns a
         config[section][attribute]=property object
+
+        The file is parsed again only when it changed, each call returns
+        its own copy of the cached object.
         """
 
         filepath = self.CONF_DIR + '/' + filename
         self.input_file = filepath
+        return copy.deepcopy(self._load(filepath)[1])
+
+    def changed(self, filename):
+        """
+        Determines if the file changed since it was last read, for hot
+        reloading. It only costs a stat call.
+        """
+        filepath = self.CONF_DIR + '/' + filename
+        with _cache_lock:
+            entry = _cache.get((self.conf_type, filepath))
+        return entry is None or entry[0] != file_signature(filepath)
+
+    def _load(self, filepath):
+        """
+        Returns the (signature, config) cache entry of a file,
+        reading and parsing it again only if it changed.
+        """
+        key = (self.conf_type, filepath)
+        with _cache_lock:
+            entry = _cache.get(key)
+        if entry is not None and entry[0] == file_signature(filepath):
+            return entry
+        try:
+            with open(filepath, 'r') as conf_file:
+                # The signature of the open file matches the lines read even
+                # if the file is replaced meanwhile
+                signature = _signature(os.fstat(conf_file.fileno()))
+                lines = conf_file.readlines()
+        except FileNotFoundError:
+            # A missing ini file reads as an empty config, as with
+            # ConfigParser.read
+            if self.conf_type != 'ini':
+                raise
+            signature, lines = None, []
         if self.conf_type == 'shell':
-            config = self.read_shell(filepath)
+            config = self.parse_shell(lines)
         elif self.conf_type == 'ini':
             config = configparser.ConfigParser()
             # Set the option form to string
             # prevents forced conversion to lowercase
             config.optionxform = str
-            config.read(filepath)
-        return config
+            config.read_string(''.join(lines), source=filepath)
+        entry = (signature, config)
+        with _cache_lock:
+            _cache[key] = entry
+        return entry
 
     def write_config(self, filename, config):
         """Writes the given config to the specified file"""
@@ -69,6 +132,8 @@ class Config(object):
         else:
             # Replace the target config file with the temporary file
             os.rename(config_file.name, filepath)
+            with _cache_lock:
+                _cache.pop((self.conf_type, filepath), None)
 
     def find_first_file(self, file_list):
         """Returns name of first matching file None otherwise"""
@@ -95,20 +160,27 @@ class Config(object):
         Reads the shell type conf files and
         returns config[''][option]=value
         """
-        config = {'': dict()}
         with open(filepath, 'r') as conf_file:
-            for line in conf_file:
-                result = shlex.split(line, True)
-                # If not a comment of empty line
-                if result:
-                    # option="value" or option=value type
-                    if '=' in result[0]:
-                        option, value = result[0].split('=')
-                    # option type
-                    else:
-                        option = result[0]
-                        value = None
-                    config[''][option] = value
+            return self.parse_shell(conf_file)
+
+    def parse_shell(self, lines):
+        """
+        Parses the lines of a shell type conf file and
+        returns config[''][option]=value
+        """
+        config = {'': dict()}
+        for line in lines:
+            result = shlex.split(line, True)
+            # If not a comment of empty line
+            if result:
+                # option="value" or option=value type
+                if '=' in result[0]:
+                    option, value = result[0].split('=')
+                # option type
+                else:
+                    option = result[0]
+                    value = None
+                config[''][option] = value
         return config
 
     def write_shell(self, filepath, f_out, config):
@@ -117,7 +189,7 @@ class Config(object):
         options = [key for key in config[''].keys()]
         # If a previous file exists modify it keeping the comments
         if os.path.exists(self.input_file):
-            with open(self.input_file, 'w') as f_in:
+            with open(self.input_file, 'r') as f_in:
                 for line in f_in:
                     result = shlex.split(line, True)
                     # If line is not empty or comment
@@ -185,7 +257,7 @@ class Config(object):
         options = []
         # If a previous file exists modify it keeping the comments
         if os.path.exists(self.input_file):
-            with open(self.input_file, 'w') as f_in:
+            with open(self.input_file, 'r') as f_in:
                 for line in f_in:
                     # If its a section
                     if line.lstrip().startswith('['):
@@ -1,14 +1,32 @@
+"""
+Interactive creation of cards.
+
+Usage: python create_deck.py [--duplicates reject|merge|upsert]
+
+Cards whose question and answer are already in the table are handled
+with the given dedup.POLICIES, rejected by default.
+"""
 import sys
 from datetime import datetime
+from dedup import POLICIES, DuplicateCard, insert_unique
 from deck import open_or_create_db
 
 
 if __name__ == '__main__':
 
+    args = sys.argv[1:]
+    policy = 'reject'
+    if args[:1] == ['--duplicates'] and len(args) == 2:
+        policy = args[1]
+    if args and (len(args) != 2 or args[0] != '--duplicates'
+                 or policy not in POLICIES):
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+
     source = input("Database source path:")
     db = open_or_create_db(source)
     table_name = input("Table name:")
-    table = db.table('test')
+    table = db.table(table_name)
 
     print("""
     Type \"exit\" or \"quit\" to exit
@@ -28,7 +46,14 @@ if __name__ == '__main__':
             card = {'next_time': datetime.now(),
                     'question': question, 'answer': answer, 'hint': hint}
 
-            table.insert(card)
+            try:
+                doc_id, inserted = insert_unique(table, card, policy)
+            except DuplicateCard as error:
+                print(error)
+            else:
+                if not inserted:
+                    print("Duplicate of card %d, %s" % (
+                        doc_id, 'merged' if policy == 'merge' else 'updated'))
         else:
             print("Type a valid command")
 
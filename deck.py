@@ -1,66 +1,15 @@
-from queue import Queue
+import heapq
 import random
-# import os
 
+import metrics
 from card import Card
+from card_store import CardStore
 from datetime import datetime
-
-from tinydb import TinyDB, Query
-from tinydb_serialization import Serializer, SerializationMiddleware
-
-
-class DateTimeSerializer(Serializer):
-    OBJ_CLASS = datetime  # The class this serializer handles
-
-    def encode(self, obj):
-        return obj.strftime('%Y-%m-%dT%H:%M:%S')
-
-    def decode(self, s):
-        return datetime.strptime(s, '%Y-%m-%dT%H:%M:%S')
-
-
-def open_or_create_db(path):
-    """Get a TinyDB database object for the recipy database.
-        This opens the DB, creating it if it doesn't exist.
-    """
-    serialization = SerializationMiddleware()
-    serialization.register_serializer(DateTimeSerializer(), 'TinyDate')
-    # if not os.path.exists(os.path.dirname(path)):
-    #     os.mkdir(os.path.dirname(path))
-    db = TinyDB(path, storage=serialization)
-    return db
-
-
-def sm2(x: [int], a=6.0, b=-0.8, c=0.28, d=0.02,
-        assumed_score=2.5, min_score=1.3, theta=1.0) -> float:
-    """
-    Returns the number of days until seeing a problem again based on the
-    history of answers x to the problem, where the meaning of x is:
-    x == 0: Incorrect, Hardest
-    x == 1: Incorrect, Hard
-    x == 2: Incorrect, Medium
-    x == 3: Correct, Medium
-    x == 4: Correct, Easy
-    x == 5: Correct, Easiest
-    @param x The history of answers in the above scoring.
-    @param theta When larger, the delays for correct answers will increase.
-    """
-    assert all(0 <= x_i <= 5 for x_i in x)
-    correct = [x_i >= 3 for x_i in x]
-    # If you got the last question incorrect, just return 1
-    if not correct[-1]:
-        return 1.0
-
-    # Calculate the latest consecutive answer streak
-    r = 0
-    for c_i in reversed(correct):
-        if c_i:
-            r += 1
-        else:
-            break
-
-    return a*(max(min_score,
-              assumed_score + sum(b+c*x_i+d*x_i*x_i for x_i in x)))**(theta*r)
+from journal import JournalApplier, ReviewJournal
+from metrics import timed
+from review_queue import ReviewQueue
+from scheduler import load_params, sm2  # noqa: F401
+from storage import open_or_create_db  # noqa: F401
 
 
 class Deck:
@@ -68,66 +17,258 @@ class Deck:
     A deck contains one or more cards.
 
     Attributes:
-        __cards (list of Card): The cards in the deck.
+        __cards (ReviewQueue): The cards in the deck, either Card objects
+                               or indexes of cards in __store.
+        __store (CardStore):   The texts of the cards added by load. Tables
+                               that are card stores themselves, like packs,
+                               are used directly.
+        __journal (ReviewJournal): The journal of the reviews, opened by
+                               the first review.
+        __applier (JournalApplier): Applies the journal to the table.
+        __owns_db (bool):      False if the database is shared with other
+                               decks and left open by close.
+        __params (dict):       The fitted scheduler parameters of the
+                               table, see fit.py.
     """
 
-    def __init__(self, source, table):
+    def __init__(self, source, table, db=None):
         """
         Constructor.
 
         Args:
             source (str): The path to the deck source file.
+            table (str): The name of the table of the cards.
+            db (optional): The database of the source, if it is already
+                open, e.g. for decks of several tables of one file.
         """
         # Create cards from source file
-        self.__db = open_or_create_db(source)
+        self.__owns_db = db is None
+        self.__db = open_or_create_db(source) if db is None else db
         self.__table = self.__db.table(table)
+        self.__cards = ReviewQueue()
+        if hasattr(self.__table, 'card'):
+            self.__store = self.__table
+        else:
+            self.__store = CardStore()
+        self.__journal_path = '%s.%s.journal' % (source, table)
+        self.__params = load_params(source, table)
+        self.__journal = None
+        self.__applier = None
 
     def __len__(self):
-        return self.__cards.qsize()
+        return len(self.__cards)
+
+    @property
+    def name(self):
+        """The name of the table of the deck"""
+        return self.__table.name
 
-    def fetch(self):
-        db_query = Query()
-        self.__cards = Queue()
-        for cdict in self.__table.search(db_query.next_time <= datetime.now()):
+    @property
+    def params(self):
+        """The scheduler parameters of the table, see fit.py"""
+        return dict(self.__params)
+
+    def __due_ids(self, limit, order):
+        """Returns the ids of the due cards to use, see fetch"""
+        doc_ids = self.__table.due_ids(datetime.now())
+        if order == 'overdue':
+            # The ids already come in next_time order
+            return doc_ids[:limit]
+        elif order == 'random':
+            if limit is None or limit > len(doc_ids):
+                limit = len(doc_ids)
+            return random.sample(doc_ids, limit)
+        elif order == 'insertion':
+            if limit is None:
+                return sorted(doc_ids)
+            # A bounded heap keeps only the limit smallest ids
+            return heapq.nsmallest(limit, doc_ids)
+        raise ValueError("Unknown order %r" % order)
+
+    def due_count(self):
+        """
+        Returns the number of due cards in the table.
+        """
+        return len(self.__table.due_ids(datetime.now()))
+
+    def select(self, limit=None, order='overdue'):
+        """
+        Returns the ids of the cards fetch would yield.
+
+        Args:
+            limit (int, optional): The maximum number of cards.
+            order (str, optional): The order of the cards, see fetch.
+        Returns:
+            (list of int): The ids, which fetch takes back, e.g. once they
+            were counted.
+        """
+        return self.__due_ids(limit, order)
+
+    @timed('deck.fetch', per_table=True)
+    def fetch(self, limit=None, order='overdue', selected=None):
+        """
+        Yields the due cards of the table.
+
+        Only the ids of the due cards are looked up front, each card is
+        read when it is yielded.
+
+        Args:
+            limit (int, optional): The maximum number of cards to yield.
+            order (str, optional): 'overdue' yields the most overdue cards
+                first, 'random' a random selection in random order and
+                'insertion' the order the cards were added in.
+            selected (list, optional): The result of select, to yield
+                instead of looking the due cards up again.
+        Returns:
+            (generator of Card): The due cards.
+        """
+        if selected is None:
+            doc_ids = self.__due_ids(limit, order)
+        else:
+            doc_ids = selected
+        if self.__store is self.__table:
+            for doc_id in doc_ids:
+                yield self.__store.card(doc_id)
+            return
+        for cdict in self.__table.documents(doc_ids):
             # Extract definitions, answers, and hints from the given line
             if cdict:
-                self.__cards.put(Card(cdict['question'],
-                                      cdict['answer'],
-                                      cdict['hint']))
-        return self.__cards
+                yield Card(cdict['answer'], cdict['question'], cdict['hint'],
+                           getattr(cdict, 'doc_id', None))
+
+    def due_cards(self, limit=None, order='overdue'):
+        """
+        Returns the due cards of the table with their next_time.
+
+        The texts are kept in the store of the deck like load does, but the
+        cards are not added to the deck.
+
+        Args:
+            limit (int, optional): The maximum number of cards to return.
+            order (str, optional): The order of the cards, see fetch.
+        Returns:
+            (list of tuple): The (next_time, card) pairs of the due cards.
+        """
+        doc_ids = self.__due_ids(limit, order)
+        documents = self.__table.documents(doc_ids)
+        if self.__store is self.__table:
+            return [(document['next_time'], self.__store.card(row))
+                    for row, document in zip(doc_ids, documents)]
+        return [(document['next_time'],
+                 self.__store.card(self.__store.append(document)))
+                for document in documents]
+
+    def owns(self, card):
+        """
+        Determines if a card was drawn from the deck.
+        """
+        return card.store is not None and card.store is self.__store
 
-    def add(self, card):
+    @timed('deck.load', per_table=True)
+    def load(self, limit=None, order='overdue'):
+        """
+        Adds the due cards of the table to the deck.
+
+        The cards are kept in a compact CardStore and only become Card
+        objects when drawn.
+
+        Args:
+            limit (int, optional): The maximum number of cards to add.
+            order (str, optional): The order of the cards, see fetch.
+        Returns:
+            (int): The number of cards added.
+        """
+        doc_ids = self.__due_ids(limit, order)
+        if self.__store is self.__table:
+            # The texts are decoded from the table when a card is drawn
+            indexes = doc_ids
+        else:
+            indexes = self.__store.extend(self.__table.documents(doc_ids))
+        for index in indexes:
+            self.__cards.append(index)
+        if metrics.ENABLED:
+            metrics.increment('deck.cards_loaded', self.name, len(indexes))
+        return len(indexes)
+
+    def add(self, card, offset=None):
         """
         Adds a card onto the bottom of the deck.
 
         Args:
             card (Card): The card to add to the deck.
+            offset (int, optional): Puts the card back after this number
+                of draws instead, e.g. to retry a failed card soon.
         """
-        self.__cards.put(card)
+        if card.store is self.__store:
+            # Views of our own store are kept as plain indexes
+            card = card.index
+        if offset is None:
+            self.__cards.append(card)
+        else:
+            self.__cards.requeue(card, offset)
 
+    @timed('deck.draw', per_table=True)
     def draw(self):
         """
         Draws a card from the deck.
 
-        The card will be removed once drawn unless manually added back in
+        The card will be removed once drawn unless manually added back in.
+        Drawing from an empty deck used to block forever, it now raises,
+        callers check len(deck) first.
 
         Returns:
             (Card): The card from the top of the deck.
+        Raises:
+            IndexError: If the deck is empty.
         """
-        return self.__cards.get()
+        card = self.__cards.popleft()
+        if isinstance(card, int):
+            return self.__store.card(card)
+        return card
 
+    @timed('deck.shuffle', per_table=True)
     def shuffle(self):
         """
         Shuffles the cards in the deck.
         """
-        # Extract cards from queue
-        card_list = []
-        while not self.__cards.empty():
-            card_list.append(self.__cards.get())
+        self.__cards.shuffle()
+
+    def review(self, card, grade, when=None):
+        """
+        Records the answer given to a card.
 
-        # Shuffle extracted cards
-        random.shuffle(card_list)
+        The review is appended to the journal of the deck and applied to
+        the table in the background, see journal.JournalApplier.
 
-        # Reinsert cards into queue
-        for card in card_list:
-            self.__cards.put(card)
+        Args:
+            card (Card): A card drawn from the deck.
+            grade (int): The answer, scored as in scheduler.sm2.
+            when (datetime, optional): The time of the answer.
+        Returns:
+            (int): The sequence number of the review in the journal.
+        """
+        if card.store is self.__table:
+            # Tables that are card stores address cards by position
+            doc_id = card.index
+        else:
+            doc_id = card.doc_id
+        if doc_id is None or doc_id < 0:
+            raise ValueError("The card does not come from the deck table")
+        if self.__journal is None:
+            self.__journal = ReviewJournal(self.__journal_path)
+            self.__applier = JournalApplier(
+                self.__journal, self.__table,
+                getattr(self.__db, 'flush', None), **self.__params)
+            self.__applier.start()
+        return self.__journal.append(doc_id, grade, when)
+
+    def close(self):
+        """
+        Applies the pending reviews and closes the table.
+        """
+        if self.__applier is not None:
+            self.__applier.close()
+            self.__journal.close()
+            self.__applier = self.__journal = None
+        if self.__owns_db:
+            self.__db.close()
@@ -0,0 +1,156 @@
+"""
+Duplicate detection for the cards of a table.
+
+Usage: python dedup.py <source> <table>
+    Lists the groups of cards sharing a question and answer, and builds
+    the content index of the table so later inserts are checked in O(1).
+
+Two cards are duplicates when their questions and answers are equal once
+normalized, see card.normalize. Inserts handle duplicates with one of the
+POLICIES:
+    reject  keeps the existing card and drops the new one
+    merge   keeps the existing card and fills its empty fields from the
+            new one
+    upsert  replaces the fields of the existing card with the new ones,
+            except its review state
+"""
+import sys
+from collections import namedtuple
+
+from index import content_key
+
+POLICIES = ('reject', 'merge', 'upsert')
+# Fields an upsert never overwrites, so reviews are not lost
+REVIEW_FIELDS = ('next_time', 'history', 'sm2')
+
+DedupResult = namedtuple('DedupResult', ['inserted', 'duplicates'])
+
+
+class DuplicateCard(ValueError):
+    """
+    Raised when a card is inserted with the reject policy and a card with
+    the same content exists.
+
+    Attributes:
+        doc_id (int): The id of the existing card.
+    """
+
+    def __init__(self, doc_id):
+        super().__init__("Duplicate of card %d" % doc_id)
+        self.doc_id = doc_id
+
+
+def document_key(document):
+    """Returns the content key of a document"""
+    return content_key(document.get('question'), document.get('answer'))
+
+
+def _changes(existing, document, policy):
+    """Returns the fields to update an existing card with"""
+    if policy == 'merge':
+        return {field: value for field, value in document.items()
+                if value not in (None, '') and not existing.get(field)}
+    return {field: value for field, value in document.items()
+            if field not in REVIEW_FIELDS and existing.get(field) != value}
+
+
+def insert_unique(table, document, policy='reject'):
+    """
+    Inserts a card unless the table already holds one with its content.
+    Args:
+        table (Table): A table with a content index, see content_ids.
+        document (dict): The card to insert.
+        policy (str, optional): What to do with a duplicate, see POLICIES.
+    Returns:
+        (tuple): The id of the inserted or existing card and True if the
+            card was inserted.
+    Raises:
+        DuplicateCard: If the card is a duplicate and policy is 'reject'.
+    """
+    if policy not in POLICIES:
+        raise ValueError("Unknown policy %r" % policy)
+    doc_ids = table.content_ids(document_key(document))
+    if not doc_ids:
+        return table.insert(document), True
+    doc_id = doc_ids[0]
+    if policy == 'reject':
+        raise DuplicateCard(doc_id)
+    changes = _changes(table.get(doc_id=doc_id), document, policy)
+    if changes:
+        table.update(changes, doc_ids=[doc_id])
+    return doc_id, False
+
+
+def insert_multiple_unique(table, documents, policy='reject'):
+    """
+    Inserts the cards that are not in the table yet in one batch.
+
+    Duplicates inside the batch are handled like duplicates of existing
+    cards, the first one being kept.
+    Args:
+        table (Table): A table with a content index, see content_ids.
+        documents (iterable of dict): The cards to insert.
+        policy (str, optional): What to do with duplicates, see POLICIES.
+    Returns:
+        (DedupResult): The ids of the inserted cards and the
+            (document, doc_id) pairs of the duplicates, doc_id being None
+            for duplicates of a card of the batch.
+    """
+    if policy not in POLICIES:
+        raise ValueError("Unknown policy %r" % policy)
+    new = {}
+    duplicates = []
+    for document in documents:
+        key = document_key(document)
+        if key in new:
+            duplicates.append((document, None))
+            if policy != 'reject':
+                first = new[key]
+                first.update(_changes(first, document, policy))
+            continue
+        doc_ids = table.content_ids(key)
+        if not doc_ids:
+            new[key] = dict(document)
+            continue
+        duplicates.append((document, doc_ids[0]))
+        if policy != 'reject':
+            changes = _changes(table.get(doc_id=doc_ids[0]), document, policy)
+            if changes:
+                table.update(changes, doc_ids=[doc_ids[0]])
+    inserted = table.insert_multiple(list(new.values())) if new else []
+    return DedupResult(inserted, duplicates)
+
+
+def find_duplicates(table):
+    """
+    Finds the cards of a table that share their content.
+    Args:
+        table (Table): The table to scan.
+    Returns:
+        (list of list of int): The ids of each group of duplicates.
+    """
+    groups = {}
+    for document in table:
+        groups.setdefault(document_key(document), []).append(document.doc_id)
+    return [doc_ids for doc_ids in groups.values() if len(doc_ids) > 1]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+
+    from storage import open_or_create_db
+    db = open_or_create_db(sys.argv[1])
+    table = db.table(sys.argv[2])
+    groups = find_duplicates(table)
+    for doc_ids in groups:
+        document = table.get(doc_id=doc_ids[0])
+        print("%s -> %s: cards %s" % (document['question'],
+                                      document['answer'],
+                                      ', '.join(map(str, doc_ids))))
+    print("%d groups of duplicates, %d extra cards"
+          % (len(groups), sum(len(doc_ids) - 1 for doc_ids in groups)))
+    # Builds the content index for the next inserts
+    table.content_ids('')
+    db.close()
@@ -0,0 +1,274 @@
+"""
+Fitting of the scheduler parameters to the recorded answers.
+
+Usage: python fit.py <source> [table ...] [--workers N]
+    Fits the sm2 parameters of each table, all of them by default, and
+    writes them to "<source>.<table>.sm2", where Deck loads them from.
+    The scheduler state of the cards is then recomputed with them.
+
+The answers of a history were given after the delays the parameters of
+the table scheduled, those of an earlier fit or the defaults. A candidate
+set of parameters is scored by how well its own delay predicts those
+answers: a card is expected to be recalled with probability
+RETENTION ** (delay / interval), interval being the delay the candidate
+would have used, so recall is RETENTION when a card is shown on the
+candidate's schedule. The loss is the log loss of these predictions
+against the correct (3 and above) and incorrect answers.
+
+The search evaluates rounds of random candidates, each round closer to
+the best one so far. A round is split between the processes of a pool,
+and every candidate is evaluated on all the answers at once.
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from batch import interval_batch
+from forecast import read_columns
+from scheduler import backfill, load_params, save_params
+
+# The fitted parameters and the range they are searched in
+BOUNDS = {'a': (1.0, 20.0), 'b': (-2.0, 0.5), 'c': (0.0, 1.0),
+          'd': (-0.1, 0.1), 'theta': (0.3, 2.0)}
+# The parameters of the scheduler when none were fitted
+DEFAULTS = {'a': 6.0, 'b': -0.8, 'c': 0.28, 'd': 0.02, 'theta': 1.0,
+            'assumed_score': 2.5, 'min_score': 1.3}
+# The recall expected when a card is shown on schedule
+RETENTION = 0.9
+ROUNDS = 8
+CANDIDATES = 64
+# How much the search range shrinks after each round
+SHRINK = 0.6
+# Tables with fewer predicted answers keep the default parameters
+MIN_REVIEWS = 100
+# Keeps the log loss finite for certain wrong predictions
+EPSILON = 1e-6
+
+# The answers evaluated by the worker processes, see _set_reviews
+_reviews = None
+
+
+class Reviews:
+    """
+    The answers of a table that follow an earlier answer, with the
+    history before each of them reduced to what the loss needs.
+
+    The score of update() is linear in b, c and d, so it is computed for
+    any candidate from the number, sum and sum of squares of the grades
+    before an answer.
+
+    Attributes:
+        count (array):   The number of grades before each answer.
+        total (array):   Their sum.
+        squares (array): The sum of their squares.
+        streak (array):  The number of correct grades ending the history
+                         before each answer.
+        correct (array): True for the answers graded 3 and above.
+        delay (array):   The delay in days before each answer, as
+                         scheduled by the parameters the table used.
+    """
+
+    def __init__(self, values, offsets, scheduled=None):
+        """
+        Constructor.
+        Args:
+            values (array of int): The flat answers of the histories.
+            offsets (array of int): The start of each history in values,
+                plus the total length at the end.
+            scheduled (dict, optional): The parameters the answers were
+                scheduled with, on top of the DEFAULTS.
+        """
+        values = np.asarray(values)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        positions = np.arange(offsets[0], offsets[-1])
+        starts = np.repeat(offsets[:-1], lengths)
+        # The first answer of a history has nothing to be predicted from
+        answers = positions > starts
+        positions, starts = positions[answers], starts[answers]
+        grades = values[offsets[0]:offsets[-1]].astype(np.int64)
+        # Sums of the grades up to any position, the grades before an
+        # answer are the difference with the start of its history
+        sums = np.concatenate(([0], np.cumsum(grades)))
+        square_sums = np.concatenate(([0], np.cumsum(grades * grades)))
+        base = offsets[0]
+        self.count = (positions - starts).astype(np.int32)
+        self.total = (sums[positions - base]
+                      - sums[starts - base]).astype(np.int32)
+        self.squares = (square_sums[positions - base]
+                        - square_sums[starts - base]).astype(np.int32)
+        # The latest incorrect grade before every position
+        incorrect = np.where(grades < 3, np.arange(len(grades)), -1)
+        latest = np.concatenate(([-1], np.maximum.accumulate(incorrect)))
+        last_incorrect = latest[positions - base] + base
+        self.streak = np.where(last_incorrect >= starts,
+                               positions - 1 - last_incorrect,
+                               positions - starts).astype(np.int32)
+        self.correct = grades[positions - base] >= 3
+        self.delay = self.intervals(**dict(DEFAULTS, **(scheduled or {})))
+
+    def __len__(self):
+        return len(self.correct)
+
+    def intervals(self, a, b, c, d, theta, assumed_score=2.5,
+                  min_score=1.3):
+        """
+        Returns the delay update() schedules before every answer.
+        """
+        score = b*self.count + c*self.total + d*self.squares
+        return interval_batch(score, self.streak, a, assumed_score,
+                              min_score, theta)
+
+    def loss(self, **params):
+        """
+        Returns the mean log loss of the recall predicted by a candidate.
+        """
+        recall = RETENTION ** (self.delay / self.intervals(**params))
+        recall = np.clip(recall, EPSILON, 1 - EPSILON)
+        return float(-np.mean(np.where(self.correct, np.log(recall),
+                                       np.log1p(-recall))))
+
+
+def _set_reviews(reviews):
+    """Initializer of the worker processes"""
+    global _reviews
+    _reviews = reviews
+
+
+def _losses(candidates):
+    """Returns the loss of each candidate dict, in a worker process"""
+    return [_reviews.loss(**candidate) for candidate in candidates]
+
+
+def _candidates(rng, center, spread, count):
+    """Draws candidates around a center, within the BOUNDS"""
+    candidates = []
+    for _ in range(count):
+        candidate = {}
+        for name, (low, high) in BOUNDS.items():
+            value = rng.normal(center[name], spread * (high - low))
+            candidate[name] = float(np.clip(value, low, high))
+        candidates.append(candidate)
+    return candidates
+
+
+def fit(values, offsets, workers=None, rounds=ROUNDS,
+        candidates=CANDIDATES, seed=0, scheduled=None):
+    """
+    Fits the scheduler parameters to histories of answers.
+    Args:
+        values (array of int): The flat answers of the histories.
+        offsets (array of int): The start of each history in values, see
+            batch.pad_histories.
+        workers (int, optional): The number of processes, by default the
+            number of cores. 1 evaluates in the calling process.
+        rounds (int, optional): The number of search rounds.
+        candidates (int, optional): The candidates evaluated per round.
+        seed (int, optional): The seed of the search.
+        scheduled (dict, optional): The parameters the answers were
+            scheduled with, where the search starts from, see Reviews.
+    Returns:
+        (tuple): The best parameters, their loss, the loss of the
+        scheduled parameters and the number of answers fitted, or None
+        for the parameters if there are fewer than MIN_REVIEWS answers.
+    """
+    reviews = Reviews(values, offsets, scheduled)
+    if len(reviews) < MIN_REVIEWS:
+        return None, None, None, len(reviews)
+    workers = workers or os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+    current = dict(DEFAULTS, **(scheduled or {}))
+    best = {name: current[name] for name in BOUNDS}
+    best_loss = scheduled_loss = reviews.loss(**best)
+    if workers == 1:
+        _set_reviews(reviews)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(workers, initializer=_set_reviews,
+                                   initargs=(reviews,))
+    try:
+        spread = 0.5
+        for _ in range(rounds):
+            batch = _candidates(rng, best, spread, candidates)
+            if pool is None:
+                losses = _losses(batch)
+            else:
+                chunks = [batch[i::workers] for i in range(workers)]
+                results = list(pool.map(_losses, chunks))
+                # Puts the losses back in the order of the batch
+                losses = [None] * len(batch)
+                for i, chunk_losses in enumerate(results):
+                    losses[i::workers] = chunk_losses
+            index = int(np.argmin(losses))
+            if losses[index] < best_loss:
+                best, best_loss = batch[index], losses[index]
+            spread *= SHRINK
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return best, best_loss, scheduled_loss, len(reviews)
+
+
+def fit_table(source, table, workers=None, **options):
+    """
+    Fits the parameters of a table and saves them for Deck.
+
+    The answers are taken as scheduled with the parameters the table had,
+    and the scheduler state of every card is recomputed with the new ones,
+    so that later reviews do not mix the two.
+    Args:
+        source (str): The path to the deck source file.
+        table (str): The name of the table.
+        workers (int, optional): The number of processes, see fit.
+        options: The search options of fit.
+    Returns:
+        (tuple): The result of fit.
+    """
+    from storage import open_or_create_db
+    db = open_or_create_db(source)
+    _, values, offsets = read_columns(db.table(table), histories=True)
+    db.close()
+    result = fit(values, offsets, workers,
+                 scheduled=load_params(source, table), **options)
+    params, loss, scheduled_loss, reviews = result
+    if params is not None:
+        save_params(source, table, params, loss=loss,
+                    scheduled_loss=scheduled_loss, reviews=reviews,
+                    fitted=datetime.now().isoformat(timespec='seconds'))
+        db = open_or_create_db(source)
+        backfill(db.table(table), **params)
+        db.close()
+    return result
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    workers = None
+    if '--workers' in args:
+        position = args.index('--workers')
+        value = args[position + 1] if position + 1 < len(args) else ''
+        del args[position:position + 2]
+        workers = int(value) if value.isdigit() and int(value) else -1
+    if not args or workers == -1:
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+    source, tables = args[0], args[1:]
+    if not tables:
+        from storage import open_or_create_db
+        db = open_or_create_db(source)
+        tables = sorted(db.tables())
+        db.close()
+
+    for table in tables:
+        params, loss, scheduled_loss, reviews = fit_table(source, table,
+                                                          workers)
+        if params is None:
+            print("%s: %d answers, too few to fit" % (table, reviews))
+            continue
+        print("%s: %d answers, loss %.4f (was %.4f)"
+              % (table, reviews, loss, scheduled_loss))
+        print("    " + ', '.join('%s=%.4g' % item
+                                 for item in sorted(params.items())))
@@ -0,0 +1,179 @@
+"""
+Forecast of the number of reviews per day.
+
+Usage: python forecast.py <source> <table> [days] [--grade G]
+    Prints how many cards of the table come due on each of the next days,
+    30 by default. Overdue cards are counted today. With --grade, every
+    review is assumed to be answered with grade G and the cards it brings
+    back within the period are counted again, with the parameters fitted
+    to the table by fit.py if there are any.
+
+The next_time column and the histories are read into NumPy arrays once
+and the forecast is computed on whole arrays, see batch.py.
+"""
+import sys
+from datetime import datetime, time
+
+import numpy as np
+
+from batch import interval_batch, state_batch
+from card_store import to_epoch
+from scheduler import load_params
+
+DAYS = 30
+ONE_DAY = np.timedelta64(1, 'D')
+
+
+def read_columns(table, histories=False):
+    """
+    Reads the next_time of every card of a table, and their histories.
+
+    Tables with a next_times method, like SQLite tables and packs, hand out
+    the column without decoding the documents when no history is needed.
+    Packs do not hold histories, their cards get empty ones.
+    Args:
+        table (Table): The card table.
+        histories (bool, optional): True also reads the histories.
+    Returns:
+        (tuple): The next_times as a datetime64 array, and the flat answers
+        and offsets of the histories, see batch.pad_histories, or None for
+        both when histories is False.
+    """
+    if not histories and hasattr(table, 'next_times'):
+        return table.next_times(), None, None
+    if not hasattr(table, '__iter__'):
+        # Packs only hold the next_time column
+        next_times = table.next_times()
+        return (next_times, np.zeros(0, dtype=np.int8),
+                np.zeros(len(next_times) + 1, dtype=np.int64))
+    seconds = []
+    values = []
+    offsets = [0]
+    for document in table:
+        if document.get('next_time') is None:
+            continue
+        seconds.append(to_epoch(document['next_time']))
+        if histories:
+            values.extend(document.get('history', []))
+            offsets.append(len(values))
+    next_times = np.array(seconds, dtype=np.int64).astype('datetime64[s]')
+    if not histories:
+        return next_times, None, None
+    return (next_times, np.array(values, dtype=np.int8),
+            np.array(offsets, dtype=np.int64))
+
+
+def due_days(next_times, now=None):
+    """
+    Returns the day each card comes due on, 0 being today.
+    Args:
+        next_times (array of datetime64): The next_time of each card.
+        now (datetime, optional): The time of the forecast.
+    Returns:
+        (array of int): The days, overdue cards being due today.
+    """
+    now = now or datetime.now()
+    today = np.datetime64(datetime.combine(now.date(), time()), 's')
+    next_times = next_times[~np.isnat(next_times)]
+    return np.maximum((next_times - today) // ONE_DAY, 0)
+
+
+def forecast(next_times, days=DAYS, now=None):
+    """
+    Returns the number of cards coming due on each of the next days.
+    Args:
+        next_times (array of datetime64): The next_time of each card.
+        days (int, optional): The number of days, today included.
+        now (datetime, optional): The time of the forecast.
+    Returns:
+        (array of int): The number of due cards per day.
+    """
+    due = due_days(next_times, now)
+    return np.bincount(due[due < days], minlength=days)
+
+
+def simulate(next_times, values, offsets, grades, days=DAYS, now=None,
+             seed=None, a=6.0, b=-0.8, c=0.28, d=0.02, assumed_score=2.5,
+             min_score=1.3, theta=1.0):
+    """
+    Returns the number of reviews on each of the next days, counting the
+    cards every review reschedules within the period.
+
+    Each round reviews all the cards still due within the period at once,
+    with the update() rule of the scheduler, so the number of rounds is
+    bounded by the number of days and not by the number of cards.
+    Args:
+        next_times (array of datetime64): The next_time of each card.
+        values (array of int): The flat answers of the histories.
+        offsets (array of int): The start of each history in values.
+        grades (int or sequence of float): The grade of every review, or
+            the weights of the grades 0 to 5 reviews are drawn from.
+        days (int, optional): The number of days, today included.
+        now (datetime, optional): The time of the forecast.
+        seed (int, optional): The seed of the random grades.
+    Returns:
+        (array of int): The number of reviews per day.
+    """
+    score, streak = state_batch(values, offsets=offsets, b=b, c=c, d=d)
+    valid = ~np.isnat(next_times)
+    score, streak = score[valid], streak[valid]
+    due = due_days(next_times, now)
+    weights = None
+    if not isinstance(grades, (int, np.integer)):
+        weights = np.asarray(grades, dtype=np.float64)
+        if weights.shape != (6,) or weights.sum() <= 0:
+            raise ValueError("Expected the weights of the grades 0 to 5")
+        weights = weights / weights.sum()
+    elif not 0 <= grades <= 5:
+        raise ValueError("Grades are between 0 and 5")
+    rng = np.random.default_rng(seed)
+
+    counts = np.zeros(days, dtype=np.int64)
+    active = due < days
+    due, score, streak = due[active], score[active], streak[active]
+    while len(due):
+        counts += np.bincount(due, minlength=days)
+        if weights is None:
+            x = np.full(len(due), float(grades))
+        else:
+            x = rng.choice(6, size=len(due), p=weights).astype(np.float64)
+        score = score + (b+c*x+d*x*x)
+        streak = np.where(x >= 3, streak + 1, 0)
+        interval = interval_batch(score, streak, a, assumed_score, min_score,
+                                  theta)
+        due = due + np.maximum(np.floor(interval), 1).astype(np.int64)
+        active = due < days
+        due, score, streak = due[active], score[active], streak[active]
+    return counts
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    grade = None
+    if '--grade' in args:
+        position = args.index('--grade')
+        value = args[position + 1] if position + 1 < len(args) else ''
+        del args[position:position + 2]
+        grade = int(value) if value.isdigit() and int(value) <= 5 else -1
+    if len(args) not in (2, 3) or (len(args) == 3 and not args[2].isdigit())\
+            or grade == -1:
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+    days = int(args[2]) if len(args) == 3 else DAYS
+
+    from storage import open_or_create_db
+    db = open_or_create_db(args[0])
+    table = db.table(args[1])
+    now = datetime.now()
+    next_times, values, offsets = read_columns(table, grade is not None)
+    db.close()
+    if grade is None:
+        counts = forecast(next_times, days, now)
+    else:
+        counts = simulate(next_times, values, offsets, grade, days, now,
+                          **load_params(args[0], args[1]))
+    scale = max(1, counts.max(initial=0)) / 50
+    for day, count in enumerate(counts):
+        date = np.datetime64(now.date()) + day
+        print("%s %7d %s" % (date, count, '#' * int(round(count / scale))))
+    print("%d reviews in %d days" % (counts.sum(), days))
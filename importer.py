@@ -0,0 +1,280 @@
+"""
+Bulk import of cards from CSV, TSV and Anki text exports.
+
+Usage: python importer.py <source> <table> <file> [csv|tsv|anki]
+                          [--duplicates reject|merge|upsert]
+
+The format is guessed from the file extension when it is not given: .csv
+is read as CSV, .tsv and .tab as TSV and anything else as an Anki "Notes
+in Plain Text" export. CSV and TSV files either start with a header
+naming the question, answer and hint columns, or hold those columns in
+that order. Anki exports hold the front, back and optional tags of each
+note, with optional #key:value header lines.
+
+With --duplicates, cards whose question and answer are already in the
+table are handled with the given dedup.POLICIES.
+"""
+import csv
+import html
+import re
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain, islice
+
+from dedup import POLICIES, insert_multiple_unique
+
+# The number of cards written by each insert_multiple call
+CHUNK_SIZE = 1000
+# The number of rejected rows whose reason is kept for the report
+MAX_REPORTED = 20
+# Longest accepted question, answer or hint
+MAX_FIELD_SIZE = 10000
+FIELDS = ('question', 'answer', 'hint')
+# Separators of the Anki #separator header
+ANKI_SEPARATORS = {'tab': '\t', 'comma': ',', 'semicolon': ';',
+                   'pipe': '|', 'space': ' ', 'colon': ':'}
+TAG = re.compile(r'<[^>]*>')
+
+ImportResult = namedtuple('ImportResult', ['imported', 'rejected',
+                                           'duplicates', 'errors', 'seconds'])
+
+
+class RejectedRow(ValueError):
+    """
+    Raised for a row that can not be turned into a card.
+    """
+
+
+def guess_format(path):
+    """Returns the format of a file from its extension"""
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        return 'csv'
+    if lower.endswith(('.tsv', '.tab')):
+        return 'tsv'
+    return 'anki'
+
+
+def _html_to_text(value):
+    """Turns the HTML of an Anki field into plain text"""
+    value = re.sub(r'<br\s*/?>', '\n', value, flags=re.IGNORECASE)
+    return html.unescape(TAG.sub('', value))
+
+
+def _parsed_rows(reader):
+    """
+    Yields the rows of a csv reader, or a RejectedRow for the rows it can
+    not parse, e.g. with a field over csv.field_size_limit().
+    """
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            yield RejectedRow(str(error))
+            continue
+        yield row
+
+
+def _anki_rows(lines):
+    """
+    Yields the (line, fields) of an Anki text export.
+
+    The #separator and #html header lines are honoured, other header
+    lines are skipped.
+    """
+    lines = iter(lines)
+    separator = '\t'
+    strip_html = False
+    headers = 0
+    for line in lines:
+        if not line.startswith('#'):
+            lines = chain([line], lines)
+            break
+        headers += 1
+        key, _, value = line[1:].strip().partition(':')
+        if key == 'separator':
+            separator = ANKI_SEPARATORS.get(value.lower(), value)
+        elif key == 'html':
+            strip_html = value.lower() == 'true'
+    # A single reader keeps quoted fields spanning several lines together
+    reader = csv.reader(lines, delimiter=separator)
+    for row in _parsed_rows(reader):
+        if isinstance(row, RejectedRow):
+            yield headers + reader.line_num, row
+            continue
+        if not any(field.strip() for field in row):
+            continue
+        if strip_html:
+            row = [_html_to_text(field) for field in row]
+        # Anki exports hold the front, back and tags of each note
+        yield headers + reader.line_num, dict(zip(('question', 'answer',
+                                                   'tags'), row))
+
+
+def _table_rows(lines, delimiter):
+    """
+    Yields the (line, fields) of a CSV or TSV file.
+
+    A first row naming a question and an answer column is a header,
+    otherwise the columns are the question, answer and hint.
+    """
+    reader = csv.reader(lines, delimiter=delimiter)
+    columns = FIELDS
+    for row in _parsed_rows(reader):
+        if isinstance(row, RejectedRow):
+            yield reader.line_num, row
+            continue
+        names = [name.strip().lower() for name in row]
+        if reader.line_num == 1 and 'question' in names and 'answer' in names:
+            columns = names
+            continue
+        if not any(field.strip() for field in row):
+            continue
+        if len(row) > len(columns):
+            yield reader.line_num, RejectedRow(
+                "%d fields, expected at most %d" % (len(row), len(columns)))
+            continue
+        yield reader.line_num, dict(zip(columns, row))
+
+
+def read_rows(lines, file_format):
+    """
+    Yields the (line, fields) of every row of an import file.
+    Args:
+        lines (iterable of str): The lines of the file.
+        file_format (str): 'csv', 'tsv' or 'anki'.
+    Returns:
+        (generator of tuple): The line number and the field dict of each
+            row, or the RejectedRow for rows that could not be split.
+    """
+    if file_format == 'csv':
+        return _table_rows(lines, ',')
+    if file_format == 'tsv':
+        return _table_rows(lines, '\t')
+    if file_format == 'anki':
+        return _anki_rows(lines)
+    raise ValueError("Unknown format %r" % file_format)
+
+
+def card_document(fields, now):
+    """
+    Validates the fields of a row and returns the card document.
+    Args:
+        fields (dict): The fields of the row.
+        now (datetime): The next_time of the new card.
+    Returns:
+        (dict): The card document.
+    Raises:
+        RejectedRow: If the row is not a valid card.
+    """
+    document = {}
+    for field in FIELDS:
+        value = (fields.get(field) or '').strip()
+        if len(value) > MAX_FIELD_SIZE:
+            raise RejectedRow("%s longer than %d characters"
+                              % (field, MAX_FIELD_SIZE))
+        document[field] = value
+    for field in ('question', 'answer'):
+        if not document[field]:
+            raise RejectedRow("empty %s" % field)
+    document['next_time'] = now
+    document['history'] = []
+    return document
+
+
+def import_cards(table, lines, file_format, chunk_size=CHUNK_SIZE,
+                 progress=None, duplicates=None):
+    """
+    Streams the rows of an import file into a table.
+
+    Only one chunk of cards is held at a time, so the memory used does
+    not grow with the size of the file.
+    Args:
+        table (Table): The table the cards are added to.
+        lines (iterable of str): The lines of the file.
+        file_format (str): 'csv', 'tsv' or 'anki'.
+        chunk_size (int, optional): The cards written per insert_multiple.
+        progress (callable, optional): Called with the number of cards
+            imported so far after each chunk.
+        duplicates (str, optional): The dedup policy for cards already in
+            the table, None imports them all.
+    Returns:
+        (ImportResult): The imported, rejected and duplicate row counts,
+            the first MAX_REPORTED (line, reason) rejections and the
+            elapsed time.
+    """
+    start = time.perf_counter()
+    now = datetime.now().replace(microsecond=0)
+    imported = 0
+    rejected = 0
+    duplicated = 0
+    errors = []
+
+    def documents():
+        nonlocal rejected
+        for number, fields in read_rows(lines, file_format):
+            try:
+                if isinstance(fields, RejectedRow):
+                    raise fields
+                yield card_document(fields, now)
+            except RejectedRow as error:
+                rejected += 1
+                if len(errors) < MAX_REPORTED:
+                    errors.append((number, str(error)))
+
+    cards = documents()
+    while True:
+        chunk = list(islice(cards, chunk_size))
+        if not chunk:
+            break
+        if duplicates is None:
+            imported += len(table.insert_multiple(chunk))
+        else:
+            result = insert_multiple_unique(table, chunk, duplicates)
+            imported += len(result.inserted)
+            duplicated += len(result.duplicates)
+        if progress is not None:
+            progress(imported)
+    return ImportResult(imported, rejected, duplicated, errors,
+                        time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    policy = None
+    if '--duplicates' in args:
+        position = args.index('--duplicates')
+        policy = args[position + 1] if position + 1 < len(args) else None
+        del args[position:position + 2]
+        if policy not in POLICIES:
+            args = []
+    if len(args) not in (3, 4):
+        print('\n'.join(__doc__.strip().splitlines()[2:4]))
+        sys.exit(1)
+    path = args[2]
+    file_format = args[3] if len(args) == 4 else guess_format(path)
+
+    from storage import open_or_create_db
+    db = open_or_create_db(args[0])
+    table = db.table(args[1])
+    # utf-8-sig drops the byte order mark spreadsheets like to add
+    with open(path, 'r', encoding='utf-8-sig', newline='') as import_file:
+        result = import_cards(
+            table, import_file, file_format,
+            progress=lambda count: print("\r%d cards" % count, end=''),
+            duplicates=policy)
+    db.close()
+
+    rate = result.imported / result.seconds if result.seconds else 0
+    print("\rImported %d cards in %.2fs (%.0f cards/s), rejected %d rows"
+          % (result.imported, result.seconds, rate, result.rejected))
+    if policy is not None:
+        print("%d duplicates handled with %s" % (result.duplicates, policy))
+    for number, reason in result.errors:
+        print("  line %d: %s" % (number, reason))
+    if result.rejected > len(result.errors):
+        print("  ... and %d more" % (result.rejected - len(result.errors)))
@@ -0,0 +1,421 @@
+"""
+Secondary indexes kept next to the card tables
+"""
+import hashlib
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+
+from atomic_file import atomic_write
+from card import normalize
+
+# The weight of a word found in each field of a card
+TEXT_WEIGHTS = {'question': 3.0, 'answer': 2.0, 'hint': 1.0}
+WORD = re.compile(r'\w+')
+# The name the TinyDB datetime serializer is registered under, and the tag
+# it puts before the time_key of a datetime. The SQLite backend tags its
+# datetimes the same way, so documents look the same in both backends
+DATE_SERIALIZER = 'TinyDate'
+DATE_TAG = '{%s}:' % DATE_SERIALIZER
+
+
+def time_key(when):
+    """
+    Returns the sort key used by the due index for a datetime.
+
+    ISO 8601 strings with a fixed format sort in chronological order, so
+    comparing keys never needs to parse a date back.
+    Args:
+        when (datetime): The time to convert.
+    Returns:
+        (str): The key for the given time.
+    """
+    return when.isoformat(timespec='seconds')
+
+
+def content_key(question, answer):
+    """
+    Returns the key of a card content in the content index.
+
+    Cards whose question and answer only differ in case, accents or
+    whitespace have the same key.
+    Args:
+        question (str): The question of the card.
+        answer (str): The answer of the card.
+    Returns:
+        (str): A hash of the normalized question and answer.
+    """
+    text = normalize(question or '') + '\0' + normalize(answer or '')
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def tokenize(text):
+    """
+    Splits a text into the words used by the text index.
+    Args:
+        text (str): The text to split.
+    Returns:
+        (list of str): The normalized words, see card.normalize.
+    """
+    return WORD.findall(normalize(text or ''))
+
+
+def text_weights(document):
+    """
+    Returns the weight of each word of a card in the text index.
+    Args:
+        document (dict): The card, with its question, answer and hint.
+    Returns:
+        (dict): The summed TEXT_WEIGHTS of the occurrences of each word.
+    """
+    weights = {}
+    for field, weight in TEXT_WEIGHTS.items():
+        for word in tokenize(document.get(field)):
+            weights[word] = weights.get(word, 0.0) + weight
+    return weights
+
+
+class SidecarIndex(ABC):
+    """
+    The base of the indexes of one table persisted in a sidecar JSON file.
+
+    The file also holds the signature (mtime and size) of the database
+    file the index was built from, so a stale index is detected with a
+    single stat call. Subclasses keep the entries and convert them with
+    _clear, _load_entries and _dump_entries.
+
+    Attributes:
+        __path (str):        The path of the sidecar file, None if in memory.
+        __signature (list):  The database signature the index belongs to.
+    """
+
+    def __init__(self, path=None):
+        """
+        Constructor.
+        Args:
+            path (str, optional): The path of the sidecar file.
+        """
+        self.__path = path
+        self.__signature = None
+        self._clear()
+        self.load()
+
+    @property
+    def signature(self):
+        return self.__signature
+
+    @abstractmethod
+    def _clear(self):
+        """Empties the index"""
+
+    @abstractmethod
+    def _load_entries(self, entries):
+        """Fills the index with the entries read from the sidecar file"""
+
+    @abstractmethod
+    def _dump_entries(self):
+        """Returns the entries of the index for the sidecar file"""
+
+    def load(self):
+        """
+            Loads the index from its sidecar file, if available.
+        """
+        if self.__path is None or not os.path.exists(self.__path):
+            return
+        try:
+            with open(self.__path, 'r') as index_file:
+                data = json.load(index_file)
+            signature = data['signature']
+            self._load_entries(data['entries'])
+        except (ValueError, KeyError, TypeError):
+            # A corrupt index is treated as a missing one
+            self._clear()
+            return
+        self.__signature = signature
+
+    def save(self, signature, write=True):
+        """
+        Writes the index to its sidecar file.
+        Args:
+            signature (list): The signature of the database file.
+            write (bool, optional): False only records the signature, for
+                changes that have not reached the database file yet.
+        """
+        self.__signature = signature
+        if self.__path is None or not write:
+            return
+        atomic_write(self.__path, json.dumps(
+            {'signature': signature, 'entries': self._dump_entries()}))
+
+    def valid(self, signature):
+        """
+        Determines if the index matches the given database signature.
+        Args:
+            signature (list): The current signature of the database file.
+        Returns:
+            (bool): True if the index is in sync with the database.
+        """
+        return signature is not None and self.__signature == signature
+
+    def invalidate(self):
+        """
+            Marks the index as out of sync with the table.
+        """
+        self.__signature = None
+
+
+class DueIndex(SidecarIndex):
+    """
+    A sorted index of (next_time, doc_id) pairs for one table.
+
+    Attributes:
+        __entries (list):    The (key, doc_id) pairs sorted by key.
+        __keys (dict):       The key of each indexed doc_id.
+    """
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.__keys
+
+    def _clear(self):
+        self.__entries = []
+        self.__keys = {}
+
+    def _load_entries(self, entries):
+        entries = [(key, doc_id) for key, doc_id in entries]
+        self.__entries = entries
+        self.__keys = {doc_id: key for key, doc_id in entries}
+
+    def _dump_entries(self):
+        return self.__entries
+
+    def rebuild(self, documents):
+        """
+        Rebuilds the index from scratch.
+        Args:
+            documents (iterable of Document): All the documents of the table.
+        """
+        self.__entries = sorted((time_key(doc['next_time']), doc.doc_id)
+                                for doc in documents if 'next_time' in doc)
+        self.__keys = {doc_id: key for key, doc_id in self.__entries}
+
+    def add(self, doc_id, when):
+        """
+        Adds or moves a document in the index.
+        Args:
+            doc_id (int): The id of the document.
+            when (datetime): The next_time of the document.
+        """
+        self.remove(doc_id)
+        key = time_key(when)
+        insort(self.__entries, (key, doc_id))
+        self.__keys[doc_id] = key
+
+    def remove(self, doc_id):
+        """
+        Removes a document from the index, if present.
+        Args:
+            doc_id (int): The id of the document.
+        """
+        key = self.__keys.pop(doc_id, None)
+        if key is not None:
+            position = bisect_right(self.__entries, (key, doc_id)) - 1
+            del self.__entries[position]
+
+    def due(self, now):
+        """
+        Returns the ids of the documents due at the given time.
+        Args:
+            now (datetime): The reference time.
+        Returns:
+            (list of int): The ids in next_time order.
+        """
+        end = bisect_right(self.__entries, (time_key(now), float('inf')))
+        return [doc_id for _, doc_id in self.__entries[:end]]
+
+
+class ContentIndex(SidecarIndex):
+    """
+    A hash index of the question and answer of the cards of one table.
+
+    Tables made before the index existed may hold duplicates, so a key
+    maps to a list of ids.
+
+    Attributes:
+        __ids (dict):        The ids of the documents of each key.
+        __keys (dict):       The key of each indexed doc_id.
+    """
+
+    # The fields whose changes affect the index
+    FIELDS = ('question', 'answer')
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def _clear(self):
+        self.__ids = {}
+        self.__keys = {}
+
+    def _load_entries(self, entries):
+        keys = {doc_id: key for doc_id, key in entries}
+        self._clear()
+        for doc_id, key in keys.items():
+            self.__set(doc_id, key)
+
+    def _dump_entries(self):
+        return list(self.__keys.items())
+
+    def rebuild(self, documents):
+        """
+        Rebuilds the index from scratch.
+        Args:
+            documents (iterable of Document): All the documents of the table.
+        """
+        self._clear()
+        for document in documents:
+            self.add(document.doc_id, document)
+
+    def __set(self, doc_id, key):
+        self.__keys[doc_id] = key
+        self.__ids.setdefault(key, []).append(doc_id)
+
+    def add(self, doc_id, document):
+        """
+        Adds or moves a document in the index.
+        Args:
+            doc_id (int): The id of the document.
+            document (dict): The document, with its question and answer.
+        """
+        self.remove(doc_id)
+        self.__set(doc_id, content_key(document.get('question'),
+                                       document.get('answer')))
+
+    def remove(self, doc_id):
+        """
+        Removes a document from the index, if present.
+        Args:
+            doc_id (int): The id of the document.
+        """
+        key = self.__keys.pop(doc_id, None)
+        if key is not None:
+            doc_ids = self.__ids[key]
+            doc_ids.remove(doc_id)
+            if not doc_ids:
+                del self.__ids[key]
+
+    def find(self, key):
+        """
+        Returns the ids of the documents with the given content key.
+        Args:
+            key (str): The key, see content_key.
+        Returns:
+            (list of int): The ids, in the order they were indexed.
+        """
+        return list(self.__ids.get(key, ()))
+
+
+class TextIndex(SidecarIndex):
+    """
+    An inverted index of the words of the question, answer and hint of the
+    cards of one table.
+
+    The words are also kept sorted, so the words starting with a prefix
+    are found with a binary search.
+
+    Attributes:
+        __postings (dict):   The weight of a word in each document, by word.
+        __weights (dict):    The word weights of each indexed doc_id.
+        __words (list):      The indexed words, sorted.
+    """
+
+    # The fields whose changes affect the index
+    FIELDS = tuple(TEXT_WEIGHTS)
+
+    def __len__(self):
+        return len(self.__weights)
+
+    def _clear(self):
+        self.__postings = {}
+        self.__weights = {}
+        self.__words = []
+
+    def _load_entries(self, entries):
+        entries = [(doc_id, dict(weights)) for doc_id, weights in entries]
+        self._clear()
+        for doc_id, weights in entries:
+            self.__set(doc_id, weights)
+        self.__words = sorted(self.__postings)
+
+    def _dump_entries(self):
+        return list(self.__weights.items())
+
+    def rebuild(self, documents):
+        """
+        Rebuilds the index from scratch.
+        Args:
+            documents (iterable of Document): All the documents of the table.
+        """
+        self._clear()
+        for document in documents:
+            self.__set(document.doc_id, text_weights(document))
+        self.__words = sorted(self.__postings)
+
+    def __set(self, doc_id, weights):
+        """Adds the postings of a document, new words are left unsorted"""
+        self.__weights[doc_id] = weights
+        for word, weight in weights.items():
+            self.__postings.setdefault(word, {})[doc_id] = weight
+
+    def add(self, doc_id, document):
+        """
+        Adds or updates a document in the index.
+        Args:
+            doc_id (int): The id of the document.
+            document (dict): The document, with its question, answer and
+                hint.
+        """
+        self.remove(doc_id)
+        weights = text_weights(document)
+        for word in weights:
+            if word not in self.__postings:
+                insort(self.__words, word)
+        self.__set(doc_id, weights)
+
+    def remove(self, doc_id):
+        """
+        Removes a document from the index, if present.
+        Args:
+            doc_id (int): The id of the document.
+        """
+        for word in self.__weights.pop(doc_id, ()):
+            postings = self.__postings[word]
+            del postings[doc_id]
+            if not postings:
+                del self.__postings[word]
+                del self.__words[bisect_left(self.__words, word)]
+
+    def postings(self, word, prefix=False):
+        """
+        Returns the weight of a word in the documents holding it.
+        Args:
+            word (str): A normalized word, see tokenize.
+            prefix (bool, optional): True also matches the words starting
+                with word, adding up their weights.
+        Returns:
+            (dict): The weight of the word by doc_id.
+        """
+        if not prefix:
+            return dict(self.__postings.get(word, {}))
+        matches = {}
+        start = bisect_left(self.__words, word)
+        for position in range(start, len(self.__words)):
+            match = self.__words[position]
+            if not match.startswith(word):
+                break
+            for doc_id, weight in self.__postings[match].items():
+                matches[doc_id] = matches.get(doc_id, 0.0) + weight
+        return matches
@@ -0,0 +1,292 @@
+"""
+Append-only journal of the reviews, applied to the card table in batches.
+
+Answering a card appends one line to the journal, which never rewrites
+anything. A JournalApplier thread then folds the new lines into the
+history, scheduler state and next_time of the cards, flushes the
+database, and records how far the journal was applied in a checkpoint
+file. Once the applied part of the journal grows past a size it is
+compacted away.
+
+Every line has a sequence number that is also stored in the cards it
+was applied to, so lines applied before a crash but not checkpointed are
+not applied twice. Sequence numbers start over in a new journal, e.g.
+for a copy of the deck, so each journal also has a random epoch stored
+next to them, and only the numbers of the same epoch are compared.
+"""
+import atexit
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from atomic_file import atomic_write
+from index import time_key
+from scheduler import review_fields
+
+# The size in bytes of applied journal lines that triggers a compaction
+COMPACT_SIZE = 1 << 20
+# The card field holding the sequence number of the last applied review
+SEQ_FIELD = 'review_seq'
+# The card field holding the epoch of the journal of that review
+EPOCH_FIELD = 'review_epoch'
+
+
+class ReviewJournal:
+    """
+    An append-only file of (epoch, seq, doc_id, grade, time) review
+    records.
+
+    Attributes:
+        path (str):           The path of the journal file.
+        checkpoint_path (str): The file holding the epoch and the applied
+                              (seq, offset).
+        epoch (str):          The id of the journal, that its sequence
+                              numbers are unique in.
+        lock (RLock):         Held while the journal is appended to or
+                              rewritten.
+        __file (file):        The journal opened for appending.
+        __seq (int):          The sequence number of the last record.
+        __applied (tuple):    The (seq, offset) of the applied part.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+        Args:
+            path (str): The path of the journal file, created if needed.
+        """
+        self.path = path
+        self.checkpoint_path = path + '.applied'
+        self.lock = threading.RLock()
+        self.__applied = (0, 0)
+        self.epoch = None
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            self.__applied = (checkpoint['seq'], checkpoint['offset'])
+            self.epoch = checkpoint.get('epoch')
+        self.__file = open(path, 'ab')
+        if self.__applied[1] > self.__file.tell():
+            # The journal is older than the checkpoint, the sequence
+            # numbers still tell which records were applied
+            self.__applied = (self.__applied[0], 0)
+        records, _ = self.read(self.__applied[1])
+        self.__seq = max([self.__applied[0]]
+                         + [record['seq'] for record in records])
+        if self.epoch is None and records:
+            # The checkpoint was lost, the records still carry the epoch
+            self.epoch = records[0].get('epoch')
+        if self.epoch is None:
+            # A new journal, whatever sequence numbers the cards hold
+            # come from another one
+            self.epoch = uuid.uuid4().hex
+            self.__write_checkpoint()
+
+    @property
+    def applied(self):
+        return self.__applied
+
+    @property
+    def size(self):
+        with self.lock:
+            return self.__file.tell()
+
+    def append(self, doc_id, grade, when=None):
+        """
+        Appends a review to the journal.
+        Args:
+            doc_id (int): The id of the card in its table.
+            grade (int): The answer, scored as in scheduler.sm2.
+            when (datetime, optional): The time of the answer, now by
+                default.
+        Returns:
+            (int): The sequence number of the record.
+        """
+        when = when or datetime.now()
+        with self.lock:
+            self.__seq += 1
+            line = json.dumps({'epoch': self.epoch, 'seq': self.__seq,
+                               'doc_id': doc_id, 'grade': grade,
+                               'time': time_key(when)})
+            self.__file.write(line.encode('utf-8') + b'\n')
+            self.__file.flush()
+            return self.__seq
+
+    def read(self, offset):
+        """
+        Reads the complete records written after an offset.
+        Args:
+            offset (int): Where to start reading, in bytes.
+        Returns:
+            (tuple): The records and the offset after the last one.
+        """
+        with self.lock:
+            self.__file.flush()
+        # Appends may go on while reading, a line still being written is
+        # left for the next read
+        records = []
+        with open(self.path, 'rb') as journal_file:
+            journal_file.seek(offset)
+            for line in journal_file:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if line.strip():
+                    records.append(json.loads(line))
+        return records, offset
+
+    def pending(self):
+        """
+        Returns the records that were not applied yet.
+        Returns:
+            (tuple): The records and the offset after the last one.
+        """
+        seq, offset = self.__applied
+        records, end = self.read(offset)
+        return [record for record in records if record['seq'] > seq], end
+
+    def mark_applied(self, seq, offset):
+        """
+        Records that the journal was applied up to a record.
+        Args:
+            seq (int): The sequence number of the last applied record.
+            offset (int): The offset after that record.
+        """
+        with self.lock:
+            self.__applied = (seq, offset)
+            self.__write_checkpoint()
+
+    def __write_checkpoint(self):
+        seq, offset = self.__applied
+        atomic_write(self.checkpoint_path, json.dumps(
+            {'epoch': self.epoch, 'seq': seq, 'offset': offset}))
+
+    def compact(self):
+        """
+            Drops the applied records from the journal.
+        """
+        with self.lock:
+            seq, offset = self.__applied
+            self.__file.flush()
+            with open(self.path, 'rb') as journal_file:
+                journal_file.seek(offset)
+                tail = journal_file.read()
+            # The checkpoint is moved first, a crash before the journal is
+            # replaced only rereads records the sequence numbers skip
+            self.__applied = (seq, 0)
+            self.__write_checkpoint()
+            self.__file.close()
+            atomic_write(self.path, tail)
+            self.__file = open(self.path, 'ab')
+
+    def close(self):
+        with self.lock:
+            self.__file.close()
+
+
+class JournalApplier(threading.Thread):
+    """
+    Applies the records of a review journal to a card table in batches.
+
+    The thread wakes up every interval seconds, or sooner when woken, and
+    applies all the pending records with one read and one write of the
+    reviewed cards, see update_documents of the tables.
+
+    Attributes:
+        journal (ReviewJournal): The journal to apply.
+        table (Table):           The card table.
+        flush (callable):        Makes the table updates durable, if the
+                                 table does not write through.
+        interval (float):        The longest time in seconds between two
+                                 batches.
+        compact_size (int):      The applied journal size that triggers a
+                                 compaction.
+    """
+
+    def __init__(self, journal, table, flush=None, interval=1.0,
+                 compact_size=COMPACT_SIZE, **params):
+        """
+        Constructor.
+        Args:
+            params: The scheduler parameters, see scheduler.update.
+        """
+        super().__init__(daemon=True)
+        self.journal = journal
+        self.table = table
+        self.flush = flush
+        self.interval = interval
+        self.compact_size = compact_size
+        self.__params = params
+        self.__wake = threading.Event()
+        self.__stopped = threading.Event()
+        self.__lock = threading.Lock()
+        atexit.register(self.close)
+
+    def wake(self):
+        """
+            Applies the pending records without waiting for the interval.
+        """
+        self.__wake.set()
+
+    def run(self):
+        while not self.__stopped.is_set():
+            self.__wake.wait(self.interval)
+            self.__wake.clear()
+            self.apply()
+
+    def apply(self):
+        """
+        Applies the pending records of the journal to the table.
+        Returns:
+            (int): The number of records applied.
+        """
+        with self.__lock:
+            records, offset = self.journal.pending()
+            if not records:
+                return 0
+            reviews = {}
+            for record in records:
+                reviews.setdefault(record['doc_id'], []).append(record)
+            updates = {}
+            # Cards removed since they were reviewed are skipped
+            for document in self.table.documents(list(reviews)):
+                fields = self.__fold(document, reviews[document.doc_id])
+                if fields:
+                    updates[document.doc_id] = fields
+            if updates:
+                self.table.update_documents(updates)
+            if self.flush is not None:
+                self.flush()
+            self.journal.mark_applied(records[-1]['seq'], offset)
+            if self.journal.applied[1] >= self.compact_size:
+                self.journal.compact()
+            return len(records)
+
+    def __fold(self, document, card_reviews):
+        """Returns the fields updated by the reviews of one card"""
+        document = dict(document)
+        fields = {}
+        for record in card_reviews:
+            if document.get(EPOCH_FIELD) == record.get('epoch') \
+                    and document.get(SEQ_FIELD, 0) >= record['seq']:
+                continue
+            when = datetime.fromisoformat(record['time'])
+            fields.update(review_fields(document, record['grade'], when,
+                                        **self.__params))
+            fields[SEQ_FIELD] = record['seq']
+            fields[EPOCH_FIELD] = record.get('epoch')
+            document.update(fields)
+        return fields
+
+    def close(self):
+        """
+            Stops the thread and applies the last pending records.
+        """
+        self.__stopped.set()
+        self.__wake.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.apply()
+        atexit.unregister(self.close)
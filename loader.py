@@ -0,0 +1,70 @@
+"""
+Loading of due cards in a background thread
+"""
+import threading
+
+
+class DeckLoader(threading.Thread):
+    """
+    Fetches the due cards of a deck in a worker thread.
+
+    The cards are handed to a callback in batches, so the caller can start
+    reviewing as soon as the first batch arrives. The callbacks run in the
+    worker thread, a GUI has to move them to its main loop itself.
+
+    Attributes:
+        deck (Deck):           The deck to fetch the cards of.
+        deliver (callable):    Called with each batch of cards, the number
+                               of cards loaded so far and the total.
+        finished (callable):   Called without arguments once all the cards
+                               were delivered, unless cancelled.
+        batch_size (int):      The number of cards per batch.
+    """
+
+    def __init__(self, deck, deliver, finished=None, batch_size=100,
+                 limit=None, order='random'):
+        """
+        Constructor.
+        Args:
+            limit (int, optional): The maximum number of cards, see
+                Deck.fetch.
+            order (str, optional): The order of the cards, see Deck.fetch.
+        """
+        super().__init__(daemon=True)
+        self.deck = deck
+        self.deliver = deliver
+        self.finished = finished
+        self.batch_size = batch_size
+        self.__limit = limit
+        self.__order = order
+        self.__cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.__cancelled.is_set()
+
+    def cancel(self):
+        """
+            Stops the loading after the current card.
+        """
+        self.__cancelled.set()
+
+    def run(self):
+        # The due cards are only looked up once, for the total and the cards
+        selected = self.deck.select(self.__limit, self.__order)
+        total = len(selected)
+        batch = []
+        loaded = 0
+        for card in self.deck.fetch(selected=selected):
+            if self.cancelled:
+                return
+            batch.append(card)
+            if len(batch) >= self.batch_size:
+                loaded += len(batch)
+                self.deliver(batch, loaded, total)
+                batch = []
+        if batch and not self.cancelled:
+            loaded += len(batch)
+            self.deliver(batch, loaded, total)
+        if self.finished is not None and not self.cancelled:
+            self.finished()
@@ -1,24 +1,29 @@
+"""
+Usage: python main.py [--tui] [--quota N] <source> <table>
+                      [<source> <table> ...]
+
+Reviews the due cards of a table in a GTK window, or in the terminal with
+--tui. The terminal mode never imports GTK. The answers are written back
+to the table through the review journal of the deck.
+
+Several tables, of one or more sources, are reviewed in a single session
+that interleaves their cards, most overdue first. --quota caps the number
+of cards reviewed from each table.
+"""
 import sys
 from deck import Deck
-from UI.ui import Application
 
-if __name__ == '__main__':
-    source = sys.argv[1]
-    table = sys.argv[2]
+# The sm2 grades of the answers typed in the terminal
+CORRECT_GRADE = 4
+INCORRECT_GRADE = 1
 
-    flash_cards = []
 
-    # Create deck
-    deck = Deck(source, table)
-    # Fetch
-    deck.fetch()
-    # Start quizzing
-    deck.shuffle()
-
-    app = Application()
-    app.deck = deck
-    exit_status = app.run(sys.argv)
-    sys.exit(exit_status)
+def review_in_terminal(deck, shuffle=True):
+    """Quizzes the due cards of the deck on the terminal"""
+    deck.load()
+    # Start quizzing, a session keeps its overdue order
+    if shuffle:
+        deck.shuffle()
 
     print("""
     Type \"exit\" or \"quit\" to exit,
@@ -34,6 +39,7 @@ if __name__ == '__main__':
 
         # Check if the answer is a command or actually an answer
         if answer.lower() == "exit" or answer.lower() == "quit":
+            deck.close()
             sys.exit()
         elif answer.lower() == "hint":
             print(card.hint())
@@ -43,12 +49,47 @@ if __name__ == '__main__':
         else:
             if card.check(answer):
                 print("Correct!")
-                for ans in card.answer():
-                    print(ans)
+                deck.review(card, CORRECT_GRADE)
             else:
                 print("Incorrect!")
-                for ans in card.answer():
-                    print(ans)
+                deck.review(card, INCORRECT_GRADE)
                 deck.add(card)
+            for ans in card.answer().split(','):
+                print(ans.strip())
 
+    deck.close()
     print("Finished!")
+
+
+if __name__ == '__main__':
+    tui = '--tui' in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != '--tui']
+    quota = None
+    if '--quota' in args:
+        position = args.index('--quota')
+        value = args[position + 1] if position + 1 < len(args) else ''
+        del args[position:position + 2]
+        quota = int(value) if value.isdigit() else -1
+    if not args or len(args) % 2 or (quota is not None and quota < 0):
+        print('\n'.join(__doc__.strip().splitlines()[0:2]))
+        sys.exit(1)
+    tables = list(zip(args[::2], args[1::2]))
+
+    # Create deck, the window loads its cards in the background
+    if len(tables) == 1 and quota is None:
+        deck = Deck(*tables[0])
+    else:
+        # Only sessions need the thread pool
+        from session import Session
+        deck = Session(tables, quota)
+
+    if tui:
+        review_in_terminal(deck, shuffle=isinstance(deck, Deck))
+        sys.exit()
+
+    # GTK is only imported for the window
+    from UI.ui import Application
+    app = Application()
+    app.deck = deck
+    exit_status = app.run(sys.argv)
+    sys.exit(exit_status)
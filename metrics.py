@@ -0,0 +1,240 @@
+"""
+Optional counters and latency histograms of the pfc operations.
+
+Metrics are off unless the PFC_METRICS environment variable names the
+file they are dumped to, or enable() is called, before the instrumented
+modules are imported. While they are off the timed decorator returns the
+functions unchanged, so instrumentation costs nothing.
+
+    PFC_METRICS=/tmp/pfc.json python main.py --tui deck.json cards
+
+The dump is written at exit and, if PFC_METRICS_SIGNAL names a signal
+like USR1, every time the process receives it. Files ending in .json get
+JSON, any other file gets the Prometheus text format.
+"""
+import atexit
+import functools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from atomic_file import atomic_write
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = tuple(base * 10.0 ** exponent for exponent in range(-6, 2)
+                for base in (1, 2.5, 5))
+PREFIX = 'pfc'
+
+ENABLED = False
+_histograms = {}
+_counters = {}
+# Reentrant so a signal handler dumping the metrics cannot deadlock
+_lock = threading.RLock()
+
+
+class Histogram:
+    """
+    Latency histogram of one operation on one table.
+
+    Attributes:
+        count (int):    The number of observations.
+        total (float):  The sum of the observations in seconds.
+        buckets (list): The number of observations in each of the BUCKETS,
+                        plus the ones above the last bucket.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+
+def observe(operation, seconds, table=''):
+    """
+    Records the latency of an operation.
+    Args:
+        operation (str): The name of the operation, like 'deck.fetch'.
+        seconds (float): How long it took.
+        table (str, optional): The table it ran on.
+    """
+    with _lock:
+        key = (operation, table)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def increment(counter, table='', amount=1):
+    """
+    Adds to a counter. Callers on hot paths check ENABLED first.
+    Args:
+        counter (str): The name of the counter, like 'deck.cards_loaded'.
+        table (str, optional): The table it counts for.
+        amount (int, optional): The amount to add.
+    """
+    with _lock:
+        key = (counter, table)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def timed(operation, per_table=False):
+    """
+    Decorator recording the latency of each call of a function.
+
+    Generator functions are timed over their whole iteration, leaving out
+    the time spent by the consumer between items. When metrics are off
+    the function is returned unchanged.
+    Args:
+        operation (str): The name of the operation.
+        per_table (bool, optional): True labels the calls with the name
+            attribute of their first argument, a table or a deck.
+    Returns:
+        (callable): The decorator.
+    """
+    def decorator(function):
+        if not ENABLED:
+            return function
+        # Only needed with metrics on, inspect is slow to import
+        import inspect
+
+        def table_of(args):
+            return str(getattr(args[0], 'name', '')) if per_table else ''
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                elapsed = 0.0
+                items = function(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(items)
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                except StopIteration:
+                    return
+                finally:
+                    observe(operation, elapsed, table_of(args))
+            return wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(operation, time.perf_counter() - start,
+                        table_of(args))
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Returns the metrics recorded so far.
+    Returns:
+        (dict): The histograms and counters, as lists of dicts.
+    """
+    with _lock:
+        return {
+            'buckets': list(BUCKETS),
+            'histograms': [
+                {'operation': operation, 'table': table,
+                 'count': histogram.count, 'sum': histogram.total,
+                 'buckets': list(histogram.buckets)}
+                for (operation, table), histogram
+                in sorted(_histograms.items())],
+            'counters': [
+                {'counter': counter, 'table': table, 'value': value}
+                for (counter, table), value in sorted(_counters.items())],
+        }
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                 .replace('"', '\\"'))
+                    for name, value in labels.items())
+
+
+def to_json():
+    """Returns the metrics as a JSON document"""
+    return json.dumps(snapshot(), indent=2)
+
+
+def to_prometheus():
+    """Returns the metrics in the Prometheus text exposition format"""
+    data = snapshot()
+    name = PREFIX + '_operation_seconds'
+    lines = ['# HELP %s Latency of the pfc operations.' % name,
+             '# TYPE %s histogram' % name]
+    for histogram in data['histograms']:
+        labels = _labels(operation=histogram['operation'],
+                         table=histogram['table'])
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),),
+                                histogram['buckets']):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (
+                name, labels, '+Inf' if bound == float('inf') else
+                '%g' % bound, cumulative))
+        lines.append('%s_sum{%s} %r' % (name, labels, histogram['sum']))
+        lines.append('%s_count{%s} %d' % (name, labels, histogram['count']))
+    name = PREFIX + '_events_total'
+    lines += ['# HELP %s Counters of the pfc operations.' % name,
+              '# TYPE %s counter' % name]
+    for counter in data['counters']:
+        lines.append('%s{%s} %d' % (name, _labels(
+            counter=counter['counter'], table=counter['table']),
+            counter['value']))
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path=None):
+    """
+    Writes the metrics to a file, or to stderr.
+    Args:
+        path (str, optional): The file, JSON if it ends with .json and
+            Prometheus text otherwise.
+    """
+    if path is None:
+        sys.stderr.write(to_prometheus())
+        return
+    atomic_write(path, to_json() if path.endswith('.json')
+                 else to_prometheus())
+
+
+def enable(path=None, signum=None):
+    """
+    Turns metrics on for the modules imported from now on.
+    Args:
+        path (str, optional): Where the metrics are dumped at exit, see
+            dump.
+        signum (int, optional): A signal that also dumps the metrics.
+    """
+    global ENABLED
+    if ENABLED:
+        return
+    ENABLED = True
+    atexit.register(dump, path)
+    if signum is not None:
+        signal.signal(signum, lambda *_: dump(path))
+
+
+if os.environ.get('PFC_METRICS'):
+    _signal = os.environ.get('PFC_METRICS_SIGNAL', '').upper()
+    if _signal and not _signal.startswith('SIG'):
+        _signal = 'SIG' + _signal
+    enable(os.environ['PFC_METRICS'],
+           getattr(signal, _signal) if _signal else None)
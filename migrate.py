@@ -0,0 +1,148 @@
+"""
+Migrates a TinyDB JSON database into a SQLite database.
+
+Usage: python migrate.py <source.json> <target.sqlite> [table ...]
+
+The JSON file is streamed one document at a time, so databases larger
+than the available memory can be migrated.
+"""
+import json
+import sys
+
+from sqlite_storage import SQLiteDatabase, Document, decode_value
+
+# Number of bytes read from the source file at a time
+READ_SIZE = 1 << 16
+# Number of documents written per transaction
+BATCH_SIZE = 1000
+
+
+class JSONStream:
+    """
+    An incremental reader for the {"table": {"id": {...}}} TinyDB layout.
+
+    Attributes:
+        __file (file): The source file.
+        __buffer (str): The text read but not consumed yet.
+        __pos (int):    The position of the next character in the buffer.
+    """
+
+    def __init__(self, source_file):
+        self.__file = source_file
+        self.__buffer = ''
+        self.__pos = 0
+        self.__decoder = json.JSONDecoder()
+
+    def __fill(self):
+        """Reads more text, returns False at the end of the file"""
+        chunk = self.__file.read(READ_SIZE)
+        if not chunk:
+            return False
+        self.__buffer = self.__buffer[self.__pos:] + chunk
+        self.__pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next non blank character, '' at the end"""
+        while True:
+            while (self.__pos < len(self.__buffer)
+                   and self.__buffer[self.__pos].isspace()):
+                self.__pos += 1
+            if self.__pos < len(self.__buffer) or not self.__fill():
+                break
+        return self.__buffer[self.__pos:self.__pos + 1]
+
+    def expect(self, chars):
+        """Consumes the next character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected one of %r, found %r" % (chars, char))
+        self.__pos += 1
+        return char
+
+    def value(self):
+        """Decodes the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buffer,
+                                                       self.__pos)
+            except json.JSONDecodeError:
+                # The value may continue past the end of the buffer
+                if not self.__fill():
+                    raise
+            else:
+                self.__pos = end
+                return value
+
+    def members(self):
+        """Yields the (key, value) pairs of the object starting here"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.__pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self
+            if self.expect(',}') == '}':
+                return
+
+
+def iter_tinydb(path):
+    """
+    Yields the documents of a TinyDB JSON file without loading it whole.
+    Args:
+        path (str): The path to the TinyDB file.
+    Returns:
+        (generator of (str, Document)): The table name and each document,
+        with tagged datetimes already decoded.
+    """
+    with open(path, 'r', encoding='utf-8') as source_file:
+        stream = JSONStream(source_file)
+        if not stream.peek():
+            return
+        for table_name, table_stream in stream.members():
+            for doc_id, doc_stream in table_stream.members():
+                fields = {key: decode_value(value)
+                          for key, value in doc_stream.value().items()}
+                yield table_name, Document(fields, int(doc_id))
+
+
+def migrate(source, target, tables=None):
+    """
+    Copies the tables of a TinyDB file into a SQLite database.
+    Args:
+        source (str): The path to the TinyDB JSON file.
+        target (str): The path to the SQLite file.
+        tables (list of str, optional): The tables to copy, all by default.
+    Returns:
+        (dict): The number of documents copied per table.
+    """
+    db = SQLiteDatabase(target)
+    counts = {}
+    batch = []
+    batch_table = None
+    for table_name, document in iter_tinydb(source):
+        if tables and table_name not in tables:
+            continue
+        if batch and (table_name != batch_table or len(batch) >= BATCH_SIZE):
+            db.table(batch_table).insert_multiple(batch)
+            batch = []
+        batch_table = table_name
+        batch.append(document)
+        counts[table_name] = counts.get(table_name, 0) + 1
+    if batch:
+        db.table(batch_table).insert_multiple(batch)
+    db.close()
+    return counts
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+
+    for name, count in migrate(sys.argv[1], sys.argv[2],
+                               sys.argv[3:]).items():
+        print("%s: %d cards" % (name, count))
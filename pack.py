@@ -0,0 +1,407 @@
+"""
+Compiled read-only deck packs opened with mmap.
+
+Usage: python pack.py <source> <table> <target.pfcpack>
+    Builds a pack from a table. Reviews recorded in the overlay of an
+    existing pack are written back to the table first. The fitted
+    parameters of the table, if any, are copied for the pack.
+
+A pack is laid out as follows, all integers being little endian:
+    header      magic, version, name length, card count, text size and
+                build time, padded to HEADER_SIZE bytes
+    name        the UTF-8 table name, padded to a multiple of 8 bytes
+    next_times  int64 seconds since the epoch per card, sorted
+    doc_ids     int64 id of each card in its source table
+    reviews     int64 number of answers of each card, see scheduler.SM2State
+    streaks     int64 latest consecutive correct answers of each card
+    scores      float64 scheduler score of each card
+    intervals   float64 scheduler interval of each card
+    hintless    uint8 1 for each card whose hint is None, padded to a
+                multiple of 8 bytes
+    starts      int64 start of the question, answer and hint of each card
+                in the text, plus the total text size
+    text        the UTF-8 questions, answers and hints
+Opening a pack only reads the header, the rest is paged in on demand.
+Full-text searches build a "<pack>.<table>.words" text index on first use.
+"""
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from heapq import merge
+
+from card import Card
+from card_store import Document, to_epoch, from_epoch
+from index import TextIndex
+from metrics import timed
+from scheduler import card_state, load_params, save_params
+
+MAGIC = b'PFCPACK1'
+VERSION = 3
+HEADER = struct.Struct('<8sIIQQq')
+HEADER_SIZE = 64
+
+
+def _padded(size):
+    """Rounds a size up to a multiple of 8"""
+    return (size + 7) & ~7
+
+
+class PackTable:
+    """
+    A read-only card table stored in a pack file.
+
+    The rows of the pack are sorted by next_time and the ids handed out
+    by due_ids are row positions. The table is also its own card store,
+    so drawn cards are views whose texts are decoded from the mapped file.
+    Reviews are recorded in an append-only overlay file next to the pack,
+    each line holding the next_time, scheduler state and the answers
+    given since the pack was built of a reviewed row.
+
+    Attributes:
+        __file (file):          The pack file.
+        __map (mmap):           The mapping of the pack file.
+        __next_times (memoryview): The next_time column.
+        __doc_ids (memoryview): The source doc_id column.
+        __states (tuple):       The reviews, streak, score and interval
+                                columns of the scheduler state.
+        __hintless (memoryview): The column flagging the None hints.
+        __starts (memoryview):  The text offset column.
+        __text_start (int):     Where the text starts in the file.
+        __overlay (dict):       The latest overlay fields of each reviewed
+                                row, next_time in epoch seconds.
+        __signature (list):     The mtime and size of the pack file.
+        __text_index (TextIndex): The text index, None until searched.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+        Args:
+            path (str): The path to the pack file.
+        """
+        self.__file = open(path, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        magic, version, name_size, count, text_size, built = \
+            HEADER.unpack_from(self.__map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a pfc pack" % path)
+        if version != VERSION:
+            raise ValueError("%s is a version %d pack, rebuild it with "
+                             "pack.py" % (path, version))
+        self.name = self.__map[HEADER_SIZE:HEADER_SIZE + name_size] \
+            .decode('utf-8')
+        self.built = from_epoch(built)
+        view = memoryview(self.__map)
+        position = HEADER_SIZE + _padded(name_size)
+        columns = []
+        for size, code in ((8 * count, 'q'), (8 * count, 'q'),
+                           (8 * count, 'q'), (8 * count, 'q'),
+                           (8 * count, 'd'), (8 * count, 'd'),
+                           (count, 'B'), (8 * (3 * count + 1), 'q')):
+            columns.append(view[position:position + size].cast(code))
+            position += _padded(size)
+        self.__next_times, self.__doc_ids = columns[:2]
+        self.__states = tuple(columns[2:6])
+        self.__hintless = columns[6]
+        self.__starts = columns[7]
+        self.__text_start = position
+        self.overlay_path = path + '.overlay'
+        self.words_path = '%s.%s.words' % (path, self.name)
+        file_stat = os.fstat(self.__file.fileno())
+        self.__signature = [file_stat.st_mtime_ns, file_stat.st_size]
+        self.__text_index = None
+        self.__overlay = {}
+        if os.path.exists(self.overlay_path):
+            with open(self.overlay_path, 'r') as overlay_file:
+                for line in overlay_file:
+                    if line.strip():
+                        review = json.loads(line)
+                        self.__overlay[review.pop('row')] = review
+
+    def __len__(self):
+        return len(self.__doc_ids)
+
+    def __text(self, index, field):
+        """Decodes one of the texts of a row"""
+        position = 3 * index + field
+        start = self.__text_start + self.__starts[position]
+        end = self.__text_start + self.__starts[position + 1]
+        return self.__map[start:end].decode('utf-8')
+
+    def question(self, index):
+        return self.__text(index, 0)
+
+    def answer(self, index):
+        return self.__text(index, 1)
+
+    def hint(self, index):
+        if self.__hintless[index]:
+            return None
+        return self.__text(index, 2)
+
+    def doc_id(self, index):
+        return self.__doc_ids[index]
+
+    def card(self, index):
+        """
+        Returns a Card view of the given row.
+        """
+        return Card.view(self, index)
+
+    @timed('table.due_ids', per_table=True)
+    def due_ids(self, now):
+        """
+        Returns the rows due at the given time, in next_time order.
+        """
+        now = to_epoch(now)
+        end = bisect_right(self.__next_times, now)
+        packed = (row for row in range(end) if row not in self.__overlay)
+        reviewed = sorted((review['next_time'], row)
+                          for row, review in self.__overlay.items()
+                          if review['next_time'] <= now)
+        return list(merge(packed, (row for _, row in reviewed),
+                          key=self.__next_time))
+
+    def __next_time(self, row):
+        """Returns the current next_time of a row, in epoch seconds"""
+        if row in self.__overlay:
+            return self.__overlay[row]['next_time']
+        return self.__next_times[row]
+
+    def __state(self, row):
+        """Returns the scheduler state of a row as it was packed"""
+        reviews, streak, score, interval = (column[row]
+                                            for column in self.__states)
+        return {'reviews': reviews, 'score': score, 'streak': streak,
+                'interval': interval}
+
+    def next_times(self):
+        """
+        Returns the next_time of every row as a NumPy datetime64 array.
+        """
+        import numpy as np
+        next_times = np.frombuffer(self.__next_times,
+                                   dtype='datetime64[s]').copy()
+        for row, review in self.__overlay.items():
+            next_times[row] = np.datetime64(review['next_time'], 's')
+        return next_times
+
+    @timed('table.documents', per_table=True)
+    def documents(self, doc_ids):
+        """
+        Yields the rows with the given positions as documents.
+
+        The doc_id of a document is its row, its 'doc_id' field the id of
+        the card in the table the pack was built from. The history of a
+        document only holds the answers given since the pack was built,
+        its sm2 state accounts for the earlier ones.
+        """
+        for row in doc_ids:
+            document = Document({'question': self.question(row),
+                                 'answer': self.answer(row),
+                                 'hint': self.hint(row),
+                                 'history': [],
+                                 'sm2': self.__state(row),
+                                 'doc_id': self.doc_id(row)}, row)
+            document.update(self.__overlay.get(row, {}))
+            document['next_time'] = from_epoch(self.__next_time(row))
+            yield document
+
+    def update(self, fields, cond=None, doc_ids=None):
+        """
+        Records new fields of rows in the overlay, e.g. the history,
+        scheduler state and next_time of a review.
+        Args:
+            fields (dict): The new fields, the texts cannot be changed.
+            cond (Query, optional): Not supported by packs.
+            doc_ids (list of int): The rows to update.
+        Returns:
+            (list of int): The updated rows.
+        """
+        if cond is not None or doc_ids is None:
+            raise ValueError("Packs can only be updated by row")
+        return self.update_documents({row: fields for row in doc_ids})
+
+    @timed('table.write', per_table=True)
+    def update_documents(self, updates):
+        """
+        Records different new fields of several rows in the overlay with
+        one write.
+        Args:
+            updates (dict): The new fields by row, see update().
+        Returns:
+            (list of int): The updated rows.
+        """
+        lines = []
+        for row, fields in updates.items():
+            fields = dict(fields)
+            if 'next_time' in fields:
+                fields['next_time'] = to_epoch(fields['next_time'])
+            review = dict(self.__overlay.get(row, {}), **fields)
+            review.setdefault('next_time', self.__next_times[row])
+            review['doc_id'] = self.doc_id(row)
+            self.__overlay[row] = review
+            lines.append(json.dumps(dict(review, row=row)) + '\n')
+        with open(self.overlay_path, 'a') as overlay_file:
+            overlay_file.writelines(lines)
+        return list(updates)
+
+    def text_postings(self, word, prefix=False):
+        """
+        Returns the weight of a word in the rows holding it, see
+        IndexedTable.text_postings.
+
+        The first call builds the text index, or loads it from words_path
+        when it was built from this very pack file.
+        """
+        if self.__text_index is None:
+            text_index = TextIndex(self.words_path)
+            if not text_index.valid(self.__signature):
+                text_index.rebuild(self.documents(range(len(self))))
+                text_index.save(self.__signature)
+            self.__text_index = text_index
+        return self.__text_index.postings(word, prefix)
+
+    def close(self):
+        columns = (self.__next_times, self.__doc_ids, self.__hintless,
+                   self.__starts)
+        for column in columns + self.__states:
+            column.release()
+        self.__map.close()
+        self.__file.close()
+
+
+class PackDatabase:
+    """
+    A pack file opened as a database holding a single table.
+    """
+
+    def __init__(self, path):
+        self._table = PackTable(path)
+
+    def table(self, name):
+        if name != self._table.name:
+            raise KeyError("The pack holds table %r, not %r"
+                           % (self._table.name, name))
+        return self._table
+
+    def tables(self):
+        return {self._table.name}
+
+    def close(self):
+        self._table.close()
+
+
+def apply_overlay(pack_path, table):
+    """
+    Writes the reviews recorded in a pack overlay back to its source table.
+
+    The answers given to each card are appended to its history, and its
+    scheduler state and next_time are replaced, so the overlay must only
+    be applied once, before the pack is rebuilt.
+    Args:
+        pack_path (str): The path to the pack file.
+        table (Table): The table the pack was built from.
+    Returns:
+        (int): The number of reviews applied.
+    """
+    overlay_path = pack_path + '.overlay'
+    if not os.path.exists(overlay_path):
+        return 0
+    # Each line holds the whole overlay of its row, the last one wins
+    reviews = {}
+    with open(overlay_path, 'r') as overlay_file:
+        for line in overlay_file:
+            if line.strip():
+                review = json.loads(line)
+                reviews[review['doc_id']] = review
+    count = 0
+    for document in table.documents(list(reviews)):
+        review = dict(reviews[document.doc_id])
+        del review['row'], review['doc_id']
+        review['next_time'] = from_epoch(review['next_time'])
+        answers = review.pop('history', [])
+        review['history'] = document.get('history', []) + answers
+        table.update(review, doc_ids=[document.doc_id])
+        count += len(answers)
+    return count
+
+
+def build(table, target, **params):
+    """
+    Writes a pack holding the cards of a table.
+    Args:
+        table (Table): The source table.
+        target (str): The path of the pack file.
+        params: The scheduler parameters of the table, for the cards
+            without a stored scheduler state.
+    Returns:
+        (int): The number of cards in the pack.
+    """
+    doc_ids = table.due_ids(datetime.max)
+    next_times = array('q')
+    pack_ids = array('q')
+    states = (array('q'), array('q'), array('d'), array('d'))
+    hintless = bytearray()
+    starts = array('q', [0])
+    with tempfile.TemporaryFile() as text_file:
+        for document in table.documents(doc_ids):
+            next_times.append(to_epoch(document['next_time']))
+            pack_ids.append(document.doc_id)
+            state = card_state(document, **params)
+            for column, value in zip(states, (state.reviews, state.streak,
+                                              state.score, state.interval)):
+                column.append(value)
+            hintless.append(document.get('hint') is None)
+            for field in ('question', 'answer', 'hint'):
+                text = (document.get(field) or '').encode('utf-8')
+                text_file.write(text)
+                starts.append(starts[-1] + len(text))
+        name = table.name.encode('utf-8')
+        header = HEADER.pack(MAGIC, VERSION, len(name), len(pack_ids),
+                             starts[-1], to_epoch(datetime.now()))
+        temp_path = target + '.tmp'
+        with open(temp_path, 'wb') as pack_file:
+            pack_file.write(header.ljust(HEADER_SIZE, b'\0'))
+            pack_file.write(name.ljust(_padded(len(name)), b'\0'))
+            for column in (next_times, pack_ids) + states:
+                # The format is little endian
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                column.tofile(pack_file)
+            pack_file.write(hintless.ljust(_padded(len(hintless)), b'\0'))
+            if sys.byteorder == 'big':
+                starts.byteswap()
+            starts.tofile(pack_file)
+            text_file.seek(0)
+            shutil.copyfileobj(text_file, pack_file)
+    os.replace(temp_path, target)
+    if os.path.exists(target + '.overlay'):
+        os.remove(target + '.overlay')
+    return len(pack_ids)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+
+    from storage import open_or_create_db
+    db = open_or_create_db(sys.argv[1])
+    table = db.table(sys.argv[2])
+    params = load_params(sys.argv[1], sys.argv[2])
+    if os.path.exists(sys.argv[3]):
+        print("Applied %d reviews" % apply_overlay(sys.argv[3], table))
+    print("Packed %d cards" % build(table, sys.argv[3], **params))
+    db.close()
+    if params:
+        # Reviews of the pack are scheduled like those of the table
+        save_params(sys.argv[3], sys.argv[2], params)
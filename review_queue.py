@@ -0,0 +1,87 @@
+"""
+Single-threaded queue of the cards left to review
+"""
+import heapq
+import random
+from collections import deque
+from itertools import count
+
+
+class ReviewQueue:
+    """
+    A queue of cards drawn from the front and added at the back.
+
+    Cards can also be requeued to come back after a given number of draws.
+    Those wait in a heap ordered by the draw they are due at, so requeueing
+    does not depend on the number of cards in the queue.
+
+    Attributes:
+        __cards (deque of Card):  The cards in draw order.
+        __scheduled (list):       A heap of (draw, sequence, card) entries.
+        __draws (int):            The number of cards drawn so far.
+    """
+
+    def __init__(self, cards=()):
+        """
+        Constructor.
+        Args:
+            cards (iterable of Card, optional): The initial cards.
+        """
+        self.__cards = deque(cards)
+        self.__scheduled = []
+        self.__draws = 0
+        # Keeps the heap stable for cards due at the same draw
+        self.__sequence = count()
+
+    def __len__(self):
+        return len(self.__cards) + len(self.__scheduled)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def append(self, card):
+        """
+        Adds a card at the back of the queue.
+        """
+        self.__cards.append(card)
+
+    def requeue(self, card, offset):
+        """
+        Adds a card to be drawn again after offset other draws.
+        Args:
+            card (Card): The card to requeue.
+            offset (int): The number of draws before the card comes back,
+                0 makes it the next card.
+        """
+        heapq.heappush(self.__scheduled, (self.__draws + offset,
+                                          next(self.__sequence), card))
+
+    def popleft(self):
+        """
+        Removes and returns the next card.
+
+        Unlike queue.Queue.get, an empty queue does not block, nothing
+        could ever add a card to a single-threaded queue meanwhile.
+        Raises:
+            IndexError: If the queue is empty.
+        """
+        if self.__scheduled and (self.__scheduled[0][0] <= self.__draws
+                                 or not self.__cards):
+            card = heapq.heappop(self.__scheduled)[2]
+        else:
+            card = self.__cards.popleft()
+        self.__draws += 1
+        return card
+
+    def shuffle(self):
+        """
+        Shuffles the cards waiting at the back of the queue.
+
+        The cards are copied to a list, shuffled and put back. Indexing the
+        middle of a deque is not O(1), so a Fisher-Yates shuffle of the
+        deque itself is about ten times slower than the copy.
+        """
+        cards = list(self.__cards)
+        random.shuffle(cards)
+        self.__cards.clear()
+        self.__cards.extend(cards)
@@ -0,0 +1,198 @@
+"""
+Spaced repetition scheduling.
+
+Usage: python scheduler.py <source> <table>
+    Backfills the scheduler state of every card in the table from its
+    answer history, with the parameters fitted to the table if any.
+
+The parameters of the scheduler can be fitted to the answers of a table
+with fit.py, they are then stored in a "<source>.<table>.sm2" file.
+"""
+import json
+import sys
+from collections import namedtuple
+from datetime import timedelta
+
+from atomic_file import atomic_write
+from metrics import timed
+
+# The parameters of update() and sm2() a params file may set
+PARAMETERS = ('a', 'b', 'c', 'd', 'assumed_score', 'min_score', 'theta')
+# The longest delay in days until a review, long streaks grow the sm2
+# interval past the dates datetime can hold, and past the largest float
+MAX_INTERVAL = 36500.0
+
+
+class SM2State(namedtuple('SM2State', ['reviews', 'score', 'streak',
+                                       'interval'])):
+    """
+    The scheduler state of a card, stored in its 'sm2' field.
+
+    Folding a history through update() gives the same interval as sm2() on
+    that history, but each new answer only costs a constant amount of work.
+
+    Attributes:
+        reviews (int):    The number of answers so far.
+        score (float):    The running sum of b+c*x+d*x*x over the answers.
+        streak (int):     The number of latest consecutive correct answers.
+        interval (float): The number of days until the next review, at
+                          most MAX_INTERVAL.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, fields):
+        return cls(**fields)
+
+    def to_dict(self):
+        return dict(self._asdict())
+
+
+INITIAL_STATE = SM2State(reviews=0, score=0, streak=0, interval=1.0)
+
+
+def update(state, grade, a=6.0, b=-0.8, c=0.28, d=0.02,
+           assumed_score=2.5, min_score=1.3, theta=1.0):
+    """
+    Returns the scheduler state after one more answer.
+    Args:
+        state (SM2State): The state before the answer.
+        grade (int): The answer, scored as in sm2().
+    Returns:
+        (SM2State): The new state, its interval is the sm2() result.
+    """
+    assert 0 <= grade <= 5
+    score = state.score + (b+c*grade+d*grade*grade)
+    # Any incorrect answer breaks the streak
+    streak = state.streak + 1 if grade >= 3 else 0
+    if streak == 0:
+        interval = 1.0
+    else:
+        try:
+            interval = min(a*(max(min_score, assumed_score + score))
+                           ** (theta*streak), MAX_INTERVAL)
+        except OverflowError:
+            interval = MAX_INTERVAL
+    return SM2State(state.reviews + 1, score, streak, interval)
+
+
+def state_from_history(x, **params):
+    """
+    Returns the scheduler state for a whole history of answers.
+    """
+    state = INITIAL_STATE
+    for x_i in x:
+        state = update(state, x_i, **params)
+    return state
+
+
+@timed('scheduler.sm2')
+def sm2(x: [int], a=6.0, b=-0.8, c=0.28, d=0.02,
+        assumed_score=2.5, min_score=1.3, theta=1.0) -> float:
+    """
+    Returns the number of days until seeing a problem again based on the
+    history of answers x to the problem, where the meaning of x is:
+    x == 0: Incorrect, Hardest
+    x == 1: Incorrect, Hard
+    x == 2: Incorrect, Medium
+    x == 3: Correct, Medium
+    x == 4: Correct, Easy
+    x == 5: Correct, Easiest
+    The delay is at most MAX_INTERVAL.
+    @param x The history of answers in the above scoring.
+    @param theta When larger, the delays for correct answers will increase.
+    """
+    return state_from_history(x, a=a, b=b, c=c, d=d,
+                              assumed_score=assumed_score,
+                              min_score=min_score, theta=theta).interval
+
+
+def card_state(document, **params):
+    """
+    Returns the scheduler state of a card document.
+
+    Cards without a stored state get one computed from their history.
+    """
+    if 'sm2' in document:
+        return SM2State.from_dict(document['sm2'])
+    return state_from_history(document.get('history', []), **params)
+
+
+def review_fields(document, grade, now, **params):
+    """
+    Returns the fields to update on a card after it was answered.
+    Args:
+        document (dict): The card document.
+        grade (int): The answer, scored as in sm2().
+        now (datetime): The time of the answer.
+    Returns:
+        (dict): The new history, scheduler state and next_time.
+    """
+    state = update(card_state(document, **params), grade, **params)
+    return {'history': document.get('history', []) + [grade],
+            'sm2': state.to_dict(),
+            'next_time': now + timedelta(days=state.interval)}
+
+
+def params_path(source, table):
+    """Returns the path of the fitted parameters of a table"""
+    return '%s.%s.sm2' % (source, table)
+
+
+def load_params(source, table):
+    """
+    Reads the fitted scheduler parameters of a table.
+    Args:
+        source (str): The path to the deck source file.
+        table (str): The name of the table.
+    Returns:
+        (dict): The parameters to pass to update(), empty if the table has
+        none or its file is corrupt.
+    """
+    try:
+        with open(params_path(source, table), 'r') as params_file:
+            params = json.load(params_file)['params']
+        return {name: float(params[name]) for name in PARAMETERS
+                if name in params}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def save_params(source, table, params, **info):
+    """
+    Writes the fitted scheduler parameters of a table.
+    Args:
+        source (str): The path to the deck source file.
+        table (str): The name of the table.
+        params (dict): The parameters, see PARAMETERS.
+        info: Details of the fit stored next to the parameters.
+    """
+    atomic_write(params_path(source, table),
+                 json.dumps(dict(info, params=params), indent=2))
+
+
+def backfill(table, **params):
+    """
+    Stores the scheduler state of every card, computed from its history.
+    Args:
+        table (Table): The card table.
+    Returns:
+        (list of int): The ids of the updated cards.
+    """
+    def fill(document):
+        state = state_from_history(document.get('history', []), **params)
+        document['sm2'] = state.to_dict()
+
+    return table.update(fill)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+
+    from storage import open_or_create_db
+    db = open_or_create_db(sys.argv[1])
+    updated = backfill(db.table(sys.argv[2]),
+                       **load_params(sys.argv[1], sys.argv[2]))
+    print("Backfilled %d cards" % len(updated))
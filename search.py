@@ -0,0 +1,112 @@
+"""
+Ranked full-text search over the cards of a table.
+
+Usage: python search.py <source> <table> <words ...>
+
+Every word of the query must appear in the question, answer or hint of a
+card. Words ending with '*' also match the longer words starting with
+them, and so does the last word of the query, so results show up while
+it is typed. Cards are ranked by the weight of the words in them, see
+index.TEXT_WEIGHTS, times how rare the words are in the table.
+"""
+import heapq
+import math
+import sys
+
+from index import tokenize
+
+# The number of results printed by the command
+RESULTS = 20
+
+
+def parse_query(query):
+    """
+    Splits a query into the words to look up.
+    Args:
+        query (str): The query as typed.
+    Returns:
+        (list of tuple): The normalized words and whether each one is a
+            prefix.
+    """
+    terms = []
+    for chunk in query.split():
+        words = tokenize(chunk)
+        terms.extend((word, False) for word in words)
+        if words and chunk.endswith('*'):
+            terms[-1] = (terms[-1][0], True)
+    if terms and not query[-1:].isspace():
+        terms[-1] = (terms[-1][0], True)
+    return terms
+
+
+def _order(item):
+    """Sorts (doc_id, score) pairs by decreasing score, then by id"""
+    return -item[1], item[0]
+
+
+def rank(table, query, limit=None):
+    """
+    Returns the ids of the cards matching a query, best first.
+
+    Only the text index of the table is read, no document is loaded.
+    Args:
+        table (Table): A table with a text index, see text_postings.
+        query (str): The query, see parse_query.
+        limit (int, optional): The maximum number of results.
+    Returns:
+        (list of tuple): The (doc_id, score) of the matching cards.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return []
+    postings = [table.text_postings(word, prefix) for word, prefix in terms]
+    # Intersecting from the rarest word keeps the candidate set small
+    postings.sort(key=len)
+    total = len(table)
+    scores = None
+    for weights in postings:
+        idf = math.log(1 + total / max(len(weights), 1))
+        if scores is None:
+            scores = {doc_id: weight * idf
+                      for doc_id, weight in weights.items()}
+        else:
+            scores = {doc_id: score + weights[doc_id] * idf
+                      for doc_id, score in scores.items()
+                      if doc_id in weights}
+        if not scores:
+            return []
+    if limit is None:
+        return sorted(scores.items(), key=_order)
+    return heapq.nsmallest(limit, scores.items(), key=_order)
+
+
+def search(table, query, limit=None):
+    """
+    Yields the cards matching a query, best first.
+
+    The results are ranked up front but each document is only read when
+    it is yielded, so showing the first page of a large result is cheap.
+    Args:
+        table (Table): A table with a text index, see text_postings.
+        query (str): The query, see parse_query.
+        limit (int, optional): The maximum number of results.
+    Returns:
+        (generator of Document): The matching cards.
+    """
+    ranked = rank(table, query, limit)
+    return table.documents(doc_id for doc_id, _ in ranked)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print(__doc__.strip().splitlines()[2])
+        sys.exit(1)
+
+    from storage import open_or_create_db
+    db = open_or_create_db(sys.argv[1])
+    table = db.table(sys.argv[2])
+    for doc_id, score in rank(table, ' '.join(sys.argv[3:]), RESULTS):
+        for document in table.documents([doc_id]):
+            print("%6.2f  %s -> %s" % (score, document['question'],
+                                       document['answer']))
+    db.close()
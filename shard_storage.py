@@ -0,0 +1,496 @@
+"""
+Due-date sharded storage for the card tables.
+
+Usage: python shard_storage.py <source> <target.pfcshards> [day|week]
+                               [table ...]
+    Copies tables, all of them by default, into a sharded database.
+
+A sharded database is a directory holding a manifest and, for each table,
+one TinyDB file per next_time bucket of a day or a week:
+    manifest.json           the bucket size and the next doc_id of each
+                            table
+    <table>/<bucket>.json   the cards whose next_time falls in the bucket,
+                            named after the ISO date the bucket starts on
+    <table>/undated.json    the cards without a next_time
+Looking up the due cards only opens the buckets starting before now, so a
+review session reads the cards due today and not the whole table. A card
+whose next_time moves to another bucket moves to its file, keeping its
+doc_id. Buckets left empty are deleted when the database is closed.
+"""
+import json
+import os
+import sys
+import threading
+from datetime import timedelta
+from itertools import groupby
+
+from tinydb.table import Document
+
+from atomic_file import atomic_write
+from metrics import timed
+from tinydb_storage import open_tinydb
+
+MANIFEST = 'manifest.json'
+BUCKETS = ('day', 'week')
+# The bucket of the cards without a next_time, sorted after every date
+UNDATED = 'undated'
+SHARD_SUFFIX = '.json'
+
+
+def bucket_key(when, bucket='day'):
+    """
+    Returns the name of the bucket holding a next_time.
+    Args:
+        when (datetime): The next_time, None for undated cards.
+        bucket (str, optional): The size of the buckets, see BUCKETS.
+    Returns:
+        (str): The ISO date the bucket starts on, or UNDATED.
+    """
+    if when is None:
+        return UNDATED
+    day = when.date()
+    if bucket == 'week':
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+class ShardedTable:
+    """
+    A card table split in one TinyDB file per next_time bucket.
+
+    The table implements the parts of the TinyDB table interface used by
+    pfc, like SQLiteTable. Shards are opened on first use. The shard of a
+    card is looked up among the shards already read, the others are only
+    read when the card is not found there. Calls are timed as shards.*
+    metrics, the table.* metrics of the table count the calls to each
+    shard.
+
+    Attributes:
+        _db (ShardedDatabase): The database holding the table.
+        _name (str):           The name of the table.
+        _directory (str):      The directory of the shard files.
+        _shards (dict):        The opened shard databases by bucket.
+        _locations (dict):     The bucket of every known doc_id.
+        _located (set):        The buckets whose doc_ids are all known.
+    """
+
+    def __init__(self, db, name):
+        """
+        Constructor.
+        Args:
+            db (ShardedDatabase): The database holding the table.
+            name (str): The name of the table.
+        """
+        self._db = db
+        self._name = name
+        self._directory = os.path.join(db.path, name)
+        os.makedirs(self._directory, exist_ok=True)
+        self._shards = {}
+        self._locations = {}
+        self._located = set()
+        self._lock = db.lock
+
+    @property
+    def name(self):
+        return self._name
+
+    def buckets(self):
+        """
+        Returns the buckets holding cards of the table, oldest first.
+        """
+        with self._lock:
+            names = {name[:-len(SHARD_SUFFIX)]
+                     for name in os.listdir(self._directory)
+                     if name.endswith(SHARD_SUFFIX)}
+            return sorted(names | set(self._shards))
+
+    def _shard(self, bucket):
+        """Returns the table of a bucket, opening its file if needed"""
+        with self._lock:
+            shard = self._shards.get(bucket)
+            if shard is None:
+                shard = self._shards[bucket] = open_tinydb(
+                    os.path.join(self._directory, bucket + SHARD_SUFFIX),
+                    self._db.durability, self._db.max_pending)
+            return shard.table(self._name)
+
+    def _bucket_of(self, document):
+        return bucket_key(document.get('next_time'), self._db.bucket)
+
+    def _locate(self, doc_id):
+        """Returns the bucket of a card, None if it is not in the table"""
+        with self._lock:
+            bucket = self._locations.get(doc_id)
+            if bucket is not None:
+                return bucket
+            # The shards already in memory are read first
+            unread = sorted(self.buckets(),
+                            key=lambda name: name not in self._shards)
+            for bucket in unread:
+                if bucket in self._located:
+                    continue
+                for document in self._shard(bucket):
+                    self._locations[document.doc_id] = bucket
+                self._located.add(bucket)
+                if doc_id in self._locations:
+                    return bucket
+            return None
+
+    def _group(self, doc_ids):
+        """Groups doc_ids by bucket, dropping the ones not in the table"""
+        groups = {}
+        for doc_id in doc_ids:
+            bucket = self._locate(doc_id)
+            if bucket is not None:
+                groups.setdefault(bucket, []).append(doc_id)
+        return groups
+
+    def _next_id(self):
+        """Returns the next free doc_id, scanning the shards if unknown"""
+        next_id = self._db.next_id(self._name)
+        if next_id is None:
+            next_id = max((document.doc_id for document in self),
+                          default=0) + 1
+        return next_id
+
+    def _store(self, documents):
+        """Inserts Documents in the shards of their buckets"""
+        by_bucket = {}
+        for document in documents:
+            by_bucket.setdefault(self._bucket_of(document),
+                                 []).append(document)
+        for bucket, shard_documents in by_bucket.items():
+            self._shard(bucket).insert_multiple(shard_documents)
+            for document in shard_documents:
+                self._locations[document.doc_id] = bucket
+
+    def _rebucket(self, bucket, doc_ids):
+        """Moves the given cards of a shard that left its bucket"""
+        shard = self._shard(bucket)
+        moving = [Document(dict(document), document.doc_id)
+                  for document in shard.documents(doc_ids)
+                  if self._bucket_of(document) != bucket]
+        if moving:
+            shard.remove(doc_ids=[document.doc_id for document in moving])
+            self._store(moving)
+
+    def insert(self, document):
+        return self.insert_multiple([document])[0]
+
+    @timed('shards.write', per_table=True)
+    def insert_multiple(self, documents):
+        """
+        Inserts documents, keeping the doc_id of Document objects like
+        TinyDB does.
+        """
+        with self._lock:
+            next_id = self._next_id()
+            stored = []
+            for document in documents:
+                doc_id = getattr(document, 'doc_id', None)
+                if doc_id is None:
+                    doc_id = next_id
+                elif doc_id < next_id and self._locate(doc_id) is not None:
+                    raise ValueError("Document with ID %d already exists"
+                                     % doc_id)
+                next_id = max(next_id, doc_id + 1)
+                stored.append(Document(dict(document), doc_id))
+            # The manifest is written first, so a crash never reuses an id
+            self._db.set_next_id(self._name, next_id)
+            self._store(stored)
+            return [document.doc_id for document in stored]
+
+    @timed('shards.write', per_table=True)
+    def update(self, fields, cond=None, doc_ids=None):
+        with self._lock:
+            if doc_ids is not None:
+                groups = self._group(doc_ids).items()
+            else:
+                groups = [(bucket, None) for bucket in self.buckets()]
+            updated = []
+            for bucket, bucket_ids in groups:
+                shard_updated = self._shard(bucket).update(fields, cond,
+                                                           bucket_ids)
+                updated += shard_updated
+                if callable(fields) or 'next_time' in fields:
+                    self._rebucket(bucket, shard_updated)
+            return updated
+
+    @timed('shards.write', per_table=True)
+    def update_documents(self, updates):
+        """
+        Sets different fields on several cards with one write per shard,
+        see IndexedTable.update_documents.
+        """
+        with self._lock:
+            updated = []
+            for bucket, bucket_ids in self._group(updates).items():
+                shard_updated = self._shard(bucket).update_documents(
+                    {doc_id: updates[doc_id] for doc_id in bucket_ids})
+                updated += shard_updated
+                if any('next_time' in updates[doc_id]
+                       for doc_id in shard_updated):
+                    self._rebucket(bucket, shard_updated)
+            return updated
+
+    @timed('shards.write', per_table=True)
+    def remove(self, cond=None, doc_ids=None):
+        with self._lock:
+            if doc_ids is not None:
+                groups = self._group(doc_ids).items()
+            else:
+                groups = [(bucket, None) for bucket in self.buckets()]
+            removed = []
+            for bucket, bucket_ids in groups:
+                removed += self._shard(bucket).remove(cond, bucket_ids)
+            for doc_id in removed:
+                self._locations.pop(doc_id, None)
+            return removed
+
+    def truncate(self):
+        with self._lock:
+            for bucket in self.buckets():
+                self._shard(bucket).truncate()
+            self._locations.clear()
+
+    def get(self, doc_id):
+        """
+        Returns the document with the given id, None if it is missing.
+        """
+        return next(iter(self.documents([doc_id])), None)
+
+    def search(self, cond):
+        return [document for document in self if cond(document)]
+
+    def all(self):
+        return list(self)
+
+    def due(self, now):
+        """
+        Returns the documents whose next_time is not after the given time.
+        Args:
+            now (datetime): The reference time.
+        Returns:
+            (list of Document): The due documents in next_time order.
+        """
+        return list(self.documents(self.due_ids(now)))
+
+    @timed('shards.due_ids', per_table=True)
+    def due_ids(self, now):
+        """
+        Returns the ids of the documents due at the given time.
+
+        Only the shards of the buckets starting before now are opened.
+        The buckets do not overlap, so their due ids, each in next_time
+        order, are in next_time order once put one after another.
+        Args:
+            now (datetime): The reference time.
+        Returns:
+            (list of int): The ids in next_time order.
+        """
+        current = bucket_key(now, self._db.bucket)
+        doc_ids = []
+        with self._lock:
+            for bucket in self.buckets():
+                if bucket > current:
+                    break
+                bucket_ids = self._shard(bucket).due_ids(now)
+                for doc_id in bucket_ids:
+                    self._locations[doc_id] = bucket
+                doc_ids += bucket_ids
+        return doc_ids
+
+    def content_ids(self, key):
+        """
+        Returns the ids of the cards with the given content key, reading
+        every shard.
+        """
+        return sorted(doc_id for bucket in self.buckets()
+                      for doc_id in self._shard(bucket).content_ids(key))
+
+    def text_postings(self, word, prefix=False):
+        """
+        Returns the weight of a word in the cards holding it, reading every
+        shard, see IndexedTable.text_postings.
+        """
+        postings = {}
+        for bucket in self.buckets():
+            postings.update(self._shard(bucket).text_postings(word, prefix))
+        return postings
+
+    @timed('shards.documents', per_table=True)
+    def documents(self, doc_ids):
+        """
+        Yields the documents with the given ids, skipping missing ones.
+        """
+        # Runs of ids in the same bucket are read with one call
+        for bucket, run in groupby(doc_ids, self._locate):
+            if bucket is not None:
+                yield from self._shard(bucket).documents(list(run))
+
+    def __len__(self):
+        return sum(len(self._shard(bucket)) for bucket in self.buckets())
+
+    def __iter__(self):
+        for bucket in self.buckets():
+            yield from self._shard(bucket)
+
+    def flush(self):
+        """
+            Writes the pending changes of the opened shards to disk.
+        """
+        with self._lock:
+            for shard in self._shards.values():
+                shard.flush()
+
+    def close(self):
+        """
+            Closes the opened shards, deleting the ones left empty.
+        """
+        with self._lock:
+            for bucket, shard in self._shards.items():
+                empty = len(shard.table(self._name)) == 0
+                shard.close()
+                if empty:
+                    path = os.path.join(self._directory,
+                                        bucket + SHARD_SUFFIX)
+                    # The shard and the index files next to it
+                    for name in os.listdir(self._directory):
+                        if name == os.path.basename(path) or \
+                                name.startswith(os.path.basename(path) + '.'):
+                            os.remove(os.path.join(self._directory, name))
+            self._shards.clear()
+            self._locations.clear()
+            self._located.clear()
+
+
+class ShardedDatabase:
+    """
+    A directory of card tables sharded by next_time bucket.
+
+    Attributes:
+        path (str):          The directory of the database.
+        bucket (str):        The size of the buckets, see BUCKETS.
+        durability (float):  The write-behind durability of the shards.
+        max_pending (int):   The write-behind max_pending of the shards.
+        lock (RLock):        Held while the shards or the manifest change.
+    """
+
+    def __init__(self, path, durability=1.0, max_pending=1000, bucket=None):
+        """
+        Constructor.
+        Args:
+            path (str): The directory, created if needed.
+            durability (float, optional): See storage.open_or_create_db.
+            max_pending (int, optional): See storage.open_or_create_db.
+            bucket (str, optional): The size of the buckets of a new
+                database, 'day' by default. An existing database keeps the
+                size it was created with.
+        """
+        self.path = path
+        self.durability = durability
+        self.max_pending = max_pending
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._manifest = {'bucket': bucket or 'day', 'tables': {}}
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                self._manifest = json.load(manifest_file)
+            if bucket is not None and bucket != self._manifest['bucket']:
+                raise ValueError("The database uses %s buckets, not %s"
+                                 % (self._manifest['bucket'], bucket))
+        else:
+            self._write_manifest()
+        if self._manifest['bucket'] not in BUCKETS:
+            raise ValueError("Unknown bucket %r" % self._manifest['bucket'])
+        self.bucket = self._manifest['bucket']
+        self._tables = {}
+
+    def _write_manifest(self):
+        atomic_write(os.path.join(self.path, MANIFEST),
+                     json.dumps(self._manifest))
+
+    def next_id(self, name):
+        """
+        Returns the next free doc_id of a table, None if it is unknown.
+        """
+        with self.lock:
+            return self._manifest['tables'].get(name, {}).get('next_id')
+
+    def set_next_id(self, name, next_id):
+        """
+        Records the next free doc_id of a table in the manifest.
+        """
+        with self.lock:
+            if self.next_id(name) != next_id:
+                self._manifest['tables'].setdefault(name, {})['next_id'] = \
+                    next_id
+                self._write_manifest()
+
+    def table(self, name):
+        """
+        Returns the table with the given name, creating it if needed.
+        """
+        with self.lock:
+            if name not in self._tables:
+                self._tables[name] = ShardedTable(self, name)
+            return self._tables[name]
+
+    def tables(self):
+        """
+        Returns the names of the tables in the database.
+        """
+        return {name for name in os.listdir(self.path)
+                if os.path.isdir(os.path.join(self.path, name))}
+
+    def flush(self):
+        """
+            Writes the pending changes to disk.
+        """
+        for table in list(self._tables.values()):
+            table.flush()
+
+    def close(self):
+        for table in list(self._tables.values()):
+            table.close()
+        self._tables.clear()
+
+
+def copy_table(source, target):
+    """
+    Copies the cards of a table into a sharded table, keeping their ids.
+    Args:
+        source (Table): The table to copy.
+        target (ShardedTable): The table to copy into.
+    Returns:
+        (int): The number of cards copied.
+    """
+    documents = [Document(dict(document), document.doc_id)
+                 for document in source]
+    target.insert_multiple(documents)
+    return len(documents)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    bucket = None
+    if len(args) > 2 and args[2] in BUCKETS:
+        bucket = args.pop(2)
+    if len(args) < 2:
+        print('\n'.join(__doc__.strip().splitlines()[2:4]))
+        sys.exit(1)
+
+    from storage import open_or_create_db
+    source = open_or_create_db(args[0])
+    target = ShardedDatabase(args[1], bucket=bucket)
+    for name in args[2:] or sorted(source.tables()):
+        table = target.table(name)
+        if len(table):
+            print("%s: already holds %d cards, skipped" % (name, len(table)))
+            continue
+        count = copy_table(source.table(name), table)
+        print("%s: %d cards in %d buckets" % (name, count,
+                                              len(table.buckets())))
+    target.close()
+    source.close()
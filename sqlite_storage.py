@@ -0,0 +1,503 @@
+"""
+SQLite storage backend for the card tables
+"""
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+from card_store import Document
+from index import (DATE_TAG, ContentIndex, TextIndex, content_key,
+                   text_weights, time_key)
+from metrics import timed
+from writebehind import WriteBehind
+
+
+def encode_value(value):
+    """
+    Encodes a document value for the JSON column, datetimes are tagged
+    like the TinyDB serializer does, see index.DATE_TAG.
+    """
+    if isinstance(value, datetime):
+        return DATE_TAG + time_key(value)
+    return value
+
+
+def decode_value(value):
+    """Decodes a value read from the JSON column"""
+    if isinstance(value, str) and value.startswith(DATE_TAG):
+        return datetime.fromisoformat(value[len(DATE_TAG):])
+    return value
+
+
+class SQLiteTable:
+    """
+    A card table stored in one SQLite table.
+
+    The table implements the parts of the TinyDB table interface used by
+    pfc. The next_time field is kept in its own indexed column and the rest
+    of the document is stored as JSON. All statements are built once per
+    table so sqlite3 reuses its prepared statements.
+
+    Once content_ids was called the content key of every document is also
+    kept in a "hash_<table>" table, and once text_postings was called the
+    weight of each of its words in a "words_<table>" table. Both are
+    updated in the same transactions as the documents.
+    """
+
+    def __init__(self, db, name):
+        """
+        Constructor.
+        Args:
+            db (SQLiteDatabase): The database holding the table.
+            name (str): The name of the deck table.
+        """
+        self._db = db
+        self._name = name
+        sql_name = '"deck_%s"' % name.replace('"', '""')
+        index_name = '"deck_%s_next_time"' % name.replace('"', '""')
+        self._create = [
+            'CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, '
+            'next_time TEXT, doc TEXT NOT NULL)' % sql_name,
+            'CREATE INDEX IF NOT EXISTS %s ON %s (next_time)'
+            % (index_name, sql_name),
+        ]
+        self._insert_sql = ('INSERT INTO %s (id, next_time, doc) '
+                            'VALUES (?, ?, ?)' % sql_name)
+        self._update_sql = ('UPDATE %s SET next_time = ?, doc = ? '
+                            'WHERE id = ?' % sql_name)
+        self._delete_sql = 'DELETE FROM %s WHERE id = ?' % sql_name
+        self._select_sql = 'SELECT id, next_time, doc FROM %s' % sql_name
+        self._get_sql = self._select_sql + ' WHERE id = ?'
+        self._due_sql = (self._select_sql + ' WHERE next_time <= ? '
+                         'ORDER BY next_time, id')
+        self._due_ids_sql = ('SELECT id FROM %s WHERE next_time <= ? '
+                             'ORDER BY next_time, id' % sql_name)
+        self._next_times_sql = ('SELECT next_time FROM %s '
+                                'WHERE next_time IS NOT NULL' % sql_name)
+        self._count_sql = 'SELECT COUNT(*) FROM %s' % sql_name
+        self._truncate_sql = 'DELETE FROM %s' % sql_name
+        hash_name = '"hash_%s"' % name.replace('"', '""')
+        self._create_hash = [
+            'CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, '
+            'hash TEXT NOT NULL)' % hash_name,
+            'CREATE INDEX IF NOT EXISTS "hash_%s_hash" ON %s (hash)'
+            % (name.replace('"', '""'), hash_name),
+        ]
+        self._hash_set_sql = ('INSERT OR REPLACE INTO %s (id, hash) '
+                              'VALUES (?, ?)' % hash_name)
+        self._hash_delete_sql = 'DELETE FROM %s WHERE id = ?' % hash_name
+        self._hash_find_sql = ('SELECT id FROM %s WHERE hash = ? ORDER BY id'
+                               % hash_name)
+        self._hash_truncate_sql = 'DELETE FROM %s' % hash_name
+        words_name = '"words_%s"' % name.replace('"', '""')
+        self._create_words = [
+            'CREATE TABLE IF NOT EXISTS %s (token TEXT NOT NULL, '
+            'id INTEGER NOT NULL, weight REAL NOT NULL)' % words_name,
+            'CREATE INDEX IF NOT EXISTS "words_%s_token" ON %s (token)'
+            % (name.replace('"', '""'), words_name),
+            'CREATE INDEX IF NOT EXISTS "words_%s_id" ON %s (id)'
+            % (name.replace('"', '""'), words_name),
+        ]
+        self._words_insert_sql = ('INSERT INTO %s (token, id, weight) '
+                                  'VALUES (?, ?, ?)' % words_name)
+        self._words_delete_sql = 'DELETE FROM %s WHERE id = ?' % words_name
+        self._words_find_sql = ('SELECT id, weight FROM %s WHERE token = ?'
+                                % words_name)
+        self._words_prefix_sql = ('SELECT id, SUM(weight) FROM %s '
+                                  'WHERE token >= ? AND token < ? '
+                                  'GROUP BY id' % words_name)
+        self._words_truncate_sql = 'DELETE FROM %s' % words_name
+        with self._db.transaction() as connection:
+            for statement in self._create:
+                connection.execute(statement)
+        existing = {row[0] for row in self._db.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name IN (?, ?)", ('hash_%s' % name, 'words_%s' % name))}
+        self._hashed = 'hash_%s' % name in existing
+        self._worded = 'words_%s' % name in existing
+
+    @property
+    def name(self):
+        return self._name
+
+    def _row(self, document, doc_id=None):
+        """Converts a document to the (id, next_time, doc) row"""
+        fields = {key: encode_value(value)
+                  for key, value in document.items() if key != 'next_time'}
+        next_time = document.get('next_time')
+        if next_time is not None:
+            next_time = time_key(next_time)
+        return (doc_id, next_time, json.dumps(fields))
+
+    def _document(self, row):
+        """Converts an (id, next_time, doc) row to a Document"""
+        doc_id, next_time, doc = row
+        fields = {key: decode_value(value)
+                  for key, value in json.loads(doc).items()}
+        if next_time is not None:
+            fields['next_time'] = datetime.fromisoformat(next_time)
+        return Document(fields, doc_id)
+
+    def _index_documents(self, connection, entries, fields=None):
+        """
+        Writes the (doc_id, document) entries to the hash and words tables
+        in use, only to those depending on one of the given fields if any
+        are given.
+        """
+        def touched(index_fields):
+            return fields is None or any(field in fields
+                                         for field in index_fields)
+
+        if self._hashed and touched(ContentIndex.FIELDS):
+            connection.executemany(self._hash_set_sql,
+                                   self._hash_rows(entries))
+        if self._worded and touched(TextIndex.FIELDS):
+            connection.executemany(self._words_delete_sql,
+                                   [(doc_id,) for doc_id, _ in entries])
+            connection.executemany(self._words_insert_sql,
+                                   self._word_rows(entries))
+
+    @staticmethod
+    def _hash_rows(entries):
+        """Returns the (id, hash) rows of (doc_id, document) pairs"""
+        return [(doc_id, content_key(document.get('question'),
+                                     document.get('answer')))
+                for doc_id, document in entries]
+
+    @staticmethod
+    def _word_rows(entries):
+        """Returns the (token, id, weight) rows of (doc_id, document) pairs"""
+        return [(word, doc_id, weight) for doc_id, document in entries
+                for word, weight in text_weights(document).items()]
+
+    def insert(self, document):
+        """
+        Inserts a document.
+        Args:
+            document (dict): The document to insert.
+        Returns:
+            (int): The id of the inserted document.
+        """
+        return self.insert_multiple([document])[0]
+
+    @timed('table.write', per_table=True)
+    def insert_multiple(self, documents):
+        """
+        Inserts several documents in a single transaction.
+        Args:
+            documents (iterable of dict): The documents to insert.
+        Returns:
+            (list of int): The ids of the inserted documents.
+        """
+        doc_ids = []
+        with self._db.transaction() as connection:
+            for document in documents:
+                row = self._row(document, getattr(document, 'doc_id', None))
+                cursor = connection.execute(self._insert_sql, row)
+                doc_ids.append(cursor.lastrowid)
+                if self._hashed or self._worded:
+                    self._index_documents(connection,
+                                          [(cursor.lastrowid, document)])
+        return doc_ids
+
+    @timed('table.write', per_table=True)
+    def update(self, fields, cond=None, doc_ids=None):
+        """
+        Updates the matching documents.
+        Args:
+            fields (dict or callable): The fields to set, or a function
+                that modifies a document in place.
+            cond (Query, optional): The documents to update.
+            doc_ids (list of int, optional): The ids of the documents.
+        Returns:
+            (list of int): The ids of the updated documents.
+        """
+        if doc_ids is not None:
+            documents = [self.get(doc_id=doc_id) for doc_id in doc_ids]
+            documents = [doc for doc in documents if doc is not None]
+        elif cond is not None:
+            documents = self.search(cond)
+        else:
+            documents = self.all()
+        rows = []
+        for document in documents:
+            if callable(fields):
+                fields(document)
+            else:
+                document.update(fields)
+            _, next_time, doc = self._row(document)
+            rows.append((next_time, doc, document.doc_id))
+        with self._db.transaction() as connection:
+            connection.executemany(self._update_sql, rows)
+            self._index_documents(
+                connection,
+                [(document.doc_id, document) for document in documents],
+                None if callable(fields) else fields)
+        return [document.doc_id for document in documents]
+
+    @timed('table.write', per_table=True)
+    def update_documents(self, updates):
+        """
+        Sets different fields on several documents in one transaction.
+        Args:
+            updates (dict): The fields to set by doc_id.
+        Returns:
+            (list of int): The ids of the updated documents.
+        """
+        documents = list(self.documents(updates))
+        touched = set()
+        rows = []
+        for document in documents:
+            fields = updates[document.doc_id]
+            document.update(fields)
+            touched.update(fields)
+            _, next_time, doc = self._row(document)
+            rows.append((next_time, doc, document.doc_id))
+        with self._db.transaction() as connection:
+            connection.executemany(self._update_sql, rows)
+            self._index_documents(
+                connection,
+                [(document.doc_id, document) for document in documents],
+                touched)
+        return [document.doc_id for document in documents]
+
+    @timed('table.write', per_table=True)
+    def remove(self, cond=None, doc_ids=None):
+        """
+        Removes the matching documents.
+        Args:
+            cond (Query, optional): The documents to remove.
+            doc_ids (list of int, optional): The ids of the documents.
+        Returns:
+            (list of int): The ids of the removed documents.
+        """
+        if doc_ids is None:
+            doc_ids = [document.doc_id for document in self.search(cond)]
+        with self._db.transaction() as connection:
+            rows = [(doc_id,) for doc_id in doc_ids]
+            connection.executemany(self._delete_sql, rows)
+            if self._hashed:
+                connection.executemany(self._hash_delete_sql, rows)
+            if self._worded:
+                connection.executemany(self._words_delete_sql, rows)
+        return list(doc_ids)
+
+    def truncate(self):
+        """
+            Removes all the documents of the table.
+        """
+        with self._db.transaction() as connection:
+            connection.execute(self._truncate_sql)
+            if self._hashed:
+                connection.execute(self._hash_truncate_sql)
+            if self._worded:
+                connection.execute(self._words_truncate_sql)
+
+    @timed('storage.read', per_table=True)
+    def get(self, doc_id):
+        """
+        Returns the document with the given id, None if there is none.
+        """
+        row = self._db.connection.execute(self._get_sql, (doc_id,)).fetchone()
+        if row is None:
+            return None
+        return self._document(row)
+
+    def search(self, cond):
+        """
+        Returns the documents matching a TinyDB query or predicate.
+        """
+        return [document for document in self if cond(document)]
+
+    def all(self):
+        return list(self)
+
+    def due(self, now):
+        """
+        Returns the documents whose next_time is not after the given time.
+        Args:
+            now (datetime): The reference time.
+        Returns:
+            (list of Document): The due documents in next_time order.
+        """
+        cursor = self._db.connection.execute(self._due_sql, (time_key(now),))
+        return [self._document(row) for row in cursor]
+
+    @timed('table.due_ids', per_table=True)
+    def due_ids(self, now):
+        """
+        Returns the ids of the documents due at the given time.
+        Args:
+            now (datetime): The reference time.
+        Returns:
+            (list of int): The ids in next_time order.
+        """
+        cursor = self._db.connection.execute(self._due_ids_sql,
+                                             (time_key(now),))
+        return [row[0] for row in cursor]
+
+    def next_times(self):
+        """
+        Returns the next_time column as a NumPy datetime64 array.
+
+        Only the indexed column is read, no document is decoded.
+        """
+        import numpy as np
+        cursor = self._db.connection.execute(self._next_times_sql)
+        return np.array([row[0] for row in cursor], dtype='datetime64[s]')
+
+    def content_ids(self, key):
+        """
+        Returns the ids of the documents with the given content.
+
+        The first call fills the hash table of the table, from then on
+        every write keeps it up to date.
+        Args:
+            key (str): The content key, see index.content_key.
+        Returns:
+            (list of int): The ids of the documents with that content.
+        """
+        if not self._hashed:
+            with self._db.transaction() as connection:
+                for statement in self._create_hash:
+                    connection.execute(statement)
+                connection.executemany(self._hash_set_sql, self._hash_rows(
+                    (document.doc_id, document) for document in self))
+            self._hashed = True
+        cursor = self._db.connection.execute(self._hash_find_sql, (key,))
+        return [row[0] for row in cursor]
+
+    def text_postings(self, word, prefix=False):
+        """
+        Returns the weight of a word in the documents holding it.
+
+        The first call fills the words table of the table, from then on
+        every write keeps it up to date.
+        Args:
+            word (str): A normalized word, see index.tokenize.
+            prefix (bool, optional): True also matches the words starting
+                with word, adding up their weights.
+        Returns:
+            (dict): The weight of the word by doc_id.
+        """
+        if not self._worded:
+            with self._db.transaction() as connection:
+                for statement in self._create_words:
+                    connection.execute(statement)
+                connection.executemany(self._words_insert_sql, self._word_rows(
+                    (document.doc_id, document) for document in self))
+            self._worded = True
+        if prefix:
+            # No word starting with the prefix sorts after this bound
+            cursor = self._db.connection.execute(
+                self._words_prefix_sql, (word, word + '\U0010ffff'))
+        else:
+            cursor = self._db.connection.execute(self._words_find_sql,
+                                                 (word,))
+        return dict(cursor.fetchall())
+
+    @timed('table.documents', per_table=True)
+    def documents(self, doc_ids):
+        """
+        Yields the documents with the given ids, skipping missing ones.
+        """
+        for doc_id in doc_ids:
+            document = self.get(doc_id)
+            if document is not None:
+                yield document
+
+    def __len__(self):
+        return self._db.connection.execute(self._count_sql).fetchone()[0]
+
+    def __iter__(self):
+        for row in self._db.connection.execute(self._select_sql):
+            yield self._document(row)
+
+
+class SQLiteDatabase:
+    """
+    A card database stored in a SQLite file in WAL mode.
+
+    Each deck is stored in its own SQLite table named "deck_<table>".
+    Writes are grouped in a transaction that is committed following a
+    WriteBehind policy.
+    """
+
+    def __init__(self, path, durability=1.0, max_pending=1000):
+        """
+        Constructor.
+        Args:
+            path (str): The path to the SQLite file.
+            durability (float, optional): The longest time in seconds a
+                write may stay uncommitted, see WriteBehind.
+            max_pending (int, optional): The number of writes that
+                triggers a commit.
+        """
+        self._path = path
+        # Transactions are handled by hand, and the WriteBehind timer
+        # commits from its own thread
+        self.connection = sqlite3.connect(path, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self._tables = {}
+        self._write_behind = WriteBehind(self._commit, durability,
+                                         max_pending)
+        self.lock = self._write_behind.lock
+
+    @property
+    def pending(self):
+        return self._write_behind.pending
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the writes of the block in the open write-behind transaction.
+
+        A failing block only rolls back its own writes.
+        """
+        with self.lock:
+            if not self.connection.in_transaction:
+                self.connection.execute('BEGIN')
+            self.connection.execute('SAVEPOINT pfc_write')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK TO pfc_write')
+                self.connection.execute('RELEASE pfc_write')
+                raise
+            self.connection.execute('RELEASE pfc_write')
+            self._write_behind.written()
+
+    @timed('storage.write')
+    def _commit(self):
+        if self.connection.in_transaction:
+            self.connection.execute('COMMIT')
+
+    def flush(self):
+        """
+            Commits the pending writes.
+        """
+        self._write_behind.flush()
+
+    def table(self, name):
+        """
+        Returns the table with the given name, creating it if needed.
+        """
+        if name not in self._tables:
+            self._tables[name] = SQLiteTable(self, name)
+        return self._tables[name]
+
+    def tables(self):
+        """
+        Returns the names of the deck tables in the database.
+        """
+        cursor = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name LIKE 'deck\\_%' ESCAPE '\\'")
+        return {row[0][len('deck_'):] for row in cursor}
+
+    def close(self):
+        self._write_behind.close()
+        self.connection.close()
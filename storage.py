@@ -0,0 +1,41 @@
+"""
+Storage backends for the card tables
+"""
+import os
+
+from metrics import timed
+
+# Files with these extensions are opened with the SQLite backend
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+# Files with this extension are read-only packs built by pack.py
+PACK_EXTENSION = '.pfcpack'
+# Directories with this extension hold tables sharded by next_time
+SHARDED_EXTENSION = '.pfcshards'
+
+
+@timed('storage.open_or_create_db')
+def open_or_create_db(path, durability=1.0, max_pending=1000):
+    """Get a database object for the recipy database.
+        This opens the DB, creating it if it doesn't exist. SQLite files,
+        packs and sharded directories are recognised by their extension,
+        anything else is a TinyDB JSON file. All kinds of database hand
+        out tables with the same interface.
+
+        Writes are buffered in memory and flushed after max_pending
+        writes, after durability seconds, on flush() and at exit. A
+        durability of 0 writes every change through, None only flushes
+        on flush() and at exit.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    # Backends are imported on demand, so e.g. a pack never loads TinyDB
+    if extension in SQLITE_EXTENSIONS:
+        from sqlite_storage import SQLiteDatabase
+        return SQLiteDatabase(path, durability, max_pending)
+    if extension == PACK_EXTENSION:
+        from pack import PackDatabase
+        return PackDatabase(path)
+    if extension == SHARDED_EXTENSION:
+        from shard_storage import ShardedDatabase
+        return ShardedDatabase(path, durability, max_pending)
+    from tinydb_storage import open_tinydb
+    return open_tinydb(path, durability, max_pending)
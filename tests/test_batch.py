@@ -0,0 +1,57 @@
+"""
+Tests that the vectorized scheduler matches the scalar one.
+"""
+import numpy as np
+
+from batch import sm2_batch, state_batch
+from scheduler import MAX_INTERVAL, sm2, state_from_history
+
+
+def random_histories(count, longest, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(0, longest + 1, size=count)
+    values = rng.integers(0, 6, size=int(lengths.sum()))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    histories = [values[offsets[i]:offsets[i+1]].tolist()
+                 for i in range(count)]
+    return values, offsets, histories
+
+
+def test_sm2_batch_equals_sm2():
+    values, offsets, histories = random_histories(2000, 40)
+    expected = np.array([sm2(history) for history in histories])
+    assert np.array_equal(sm2_batch(values, offsets=offsets), expected)
+
+
+def test_state_batch_equals_state_from_history():
+    values, offsets, histories = random_histories(500, 60, seed=1)
+    score, streak = state_batch(values, offsets=offsets)
+    states = [state_from_history(history) for history in histories]
+    assert np.array_equal(score, [state.score for state in states])
+    assert np.array_equal(streak, [state.streak for state in states])
+
+
+def test_state_batch_with_a_few_long_histories():
+    values, offsets, histories = random_histories(50, 3, seed=2)
+    longest = np.random.default_rng(3).integers(0, 6, size=(3, 500))
+    values = np.concatenate((longest.reshape(-1), values))
+    offsets = np.concatenate(([0, 500, 1000], offsets + 1500))
+    histories = longest.tolist() + histories
+    score, streak = state_batch(values, offsets=offsets)
+    states = [state_from_history(history) for history in histories]
+    assert np.array_equal(score, [state.score for state in states])
+    assert np.array_equal(streak, [state.streak for state in states])
+
+
+def test_padded_histories_equal_ragged_histories():
+    padded = np.array([[5, 4, 0], [3, 3, 3], [1, 0, 0]])
+    lengths = np.array([2, 3, 1])
+    values, offsets = np.array([5, 4, 3, 3, 3, 1]), np.array([0, 2, 5, 6])
+    assert np.array_equal(sm2_batch(padded, lengths),
+                          sm2_batch(values, offsets=offsets))
+
+
+def test_long_streaks_are_capped_like_sm2():
+    history = [5]*400
+    assert sm2(history) == MAX_INTERVAL
+    assert sm2_batch(np.array([history]))[0] == MAX_INTERVAL
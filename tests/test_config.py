@@ -0,0 +1,23 @@
+"""
+Tests of the config file cache.
+"""
+from config import Config
+
+
+def test_read_config_returns_a_copy(tmp_path):
+    (tmp_path / 'deck.ini').write_text("[deck]\nX = 1\n")
+    config = Config('ini', str(tmp_path))
+    first = config.read_config('deck.ini')
+    first['deck']['X'] = '2'
+    assert config.read_config('deck.ini')['deck']['X'] == '1'
+
+
+def test_write_config_keeps_comments(tmp_path):
+    (tmp_path / 'deck.conf').write_text("# Deck\nA=1\nB\n")
+    config = Config('shell', str(tmp_path))
+    options = config.read_config('deck.conf')
+    options['']['A'] = '3'
+    config.write_config('deck.conf', options)
+    assert (tmp_path / 'deck.conf').read_text() == "# Deck\nA=3\nB\n"
+    assert config.read_config('deck.conf') == {'': {'A': '3', 'B': None}}
+    assert not config.changed('deck.conf')
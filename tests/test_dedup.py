@@ -0,0 +1,59 @@
+"""
+Tests of the duplicate policies of the card inserts.
+"""
+from datetime import datetime
+
+import pytest
+
+from dedup import DuplicateCard, insert_multiple_unique, insert_unique
+from storage import open_or_create_db
+
+NOW = datetime(2026, 1, 1)
+
+
+def card(question, answer, hint=None, history=()):
+    return {'question': question, 'answer': answer, 'hint': hint,
+            'next_time': NOW, 'history': list(history)}
+
+
+@pytest.fixture(params=['deck.json', 'deck.sqlite'])
+def table(tmp_path, request):
+    db = open_or_create_db(str(tmp_path / request.param))
+    table = db.table('t')
+    table.insert(card('Capital of France?', 'Paris', history=[5]))
+    yield table
+    db.close()
+
+
+def test_reject_raises_on_normalized_duplicates(table):
+    with pytest.raises(DuplicateCard) as error:
+        insert_unique(table, card('capital of  FRANCE?', 'paris'))
+    assert error.value.doc_id == 1
+    assert len(table) == 1
+
+
+def test_merge_fills_empty_fields_only(table):
+    doc_id, inserted = insert_unique(
+        table, card('Capital of France?', 'Paris', 'Seine', []), 'merge')
+    assert (doc_id, inserted) == (1, False)
+    document = table.get(doc_id=1)
+    assert document['hint'] == 'Seine' and document['history'] == [5]
+
+
+def test_upsert_keeps_the_review_state(table):
+    insert_unique(table, card('Capital of France?', 'Paris', 'Seine', []),
+                  'upsert')
+    insert_unique(table, card('Capital of France?', 'Paris', 'Louvre', []),
+                  'upsert')
+    document = table.get(doc_id=1)
+    assert document['hint'] == 'Louvre' and document['history'] == [5]
+
+
+def test_batch_keeps_the_first_of_its_duplicates(table):
+    result = insert_multiple_unique(table, [
+        card('Capital of Spain?', 'Madrid'),
+        card('capital of spain?', 'madrid', 'Prado'),
+        card('Capital of France?', 'Paris')], 'merge')
+    assert len(result.inserted) == 1
+    assert [doc_id for _, doc_id in result.duplicates] == [None, 1]
+    assert table.get(doc_id=result.inserted[0])['hint'] == 'Prado'
@@ -0,0 +1,64 @@
+"""
+Tests of the due index of the TinyDB tables.
+"""
+import json
+from datetime import datetime, timedelta
+
+from index import DueIndex
+from tinydb_storage import file_signature, open_tinydb
+
+NOW = datetime(2026, 1, 1)
+
+
+def make_deck(path, cards):
+    db = open_tinydb(path, durability=None)
+    db.table('t').insert_multiple(
+        {'question': str(day), 'answer': 'a', 'hint': None,
+         'next_time': NOW + timedelta(days=day), 'history': []}
+        for day in cards)
+    db.close()
+
+
+def test_due_ids_in_next_time_order(tmp_path):
+    path = str(tmp_path / 'deck.json')
+    make_deck(path, [3, -2, 0, -5, 7])
+    db = open_tinydb(path)
+    assert db.table('t').due_ids(NOW) == [4, 2, 3]
+    db.close()
+
+
+def test_due_ids_trusts_a_valid_sidecar(tmp_path):
+    path = str(tmp_path / 'deck.json')
+    make_deck(path, [-1, 1])
+    db = open_tinydb(path)
+    db.table('t').due_ids(NOW)
+    db.close()
+
+    db = open_tinydb(path)
+    assert db.table('t').due_ids(NOW) == [1]
+    # The documents were not read to answer
+    assert db.storage.cache is None
+    db.close()
+
+
+def test_stale_sidecar_is_rebuilt_on_a_missing_document(tmp_path):
+    path = str(tmp_path / 'deck.json')
+    make_deck(path, [-1, 1])
+    # An index pointing to a document that is not in the file, under the
+    # signature of the file
+    index = DueIndex(path + '.t.due')
+    index.rebuild([])
+    index.add(9, NOW - timedelta(days=3))
+    index.add(1, NOW - timedelta(days=1))
+    index.save(file_signature(path))
+
+    db = open_tinydb(path)
+    table = db.table('t')
+    assert table.due_ids(NOW) == [9, 1]
+    assert [document.doc_id for document in table.documents([9, 1])] == [1]
+    assert table.due_ids(NOW) == [1]
+    db.close()
+    with open(path + '.t.due') as index_file:
+        assert json.load(index_file)['entries'] == [
+            [(NOW - timedelta(days=1)).isoformat(), 1],
+            [(NOW + timedelta(days=1)).isoformat(), 2]]
@@ -0,0 +1,41 @@
+"""
+Tests of the review journal applied to every kind of table.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from journal import JournalApplier, ReviewJournal
+from scheduler import sm2
+from storage import open_or_create_db
+
+NOW = datetime(2026, 1, 1)
+
+
+@pytest.mark.parametrize('name', ['deck.json', 'deck.sqlite',
+                                  'deck.pfcshards'])
+def test_reviews_are_applied_in_one_batch(tmp_path, name):
+    db = open_or_create_db(str(tmp_path / name))
+    table = db.table('t')
+    doc_ids = table.insert_multiple(
+        {'question': str(number), 'answer': 'a', 'hint': None,
+         'next_time': NOW, 'history': []} for number in range(5))
+    journal = ReviewJournal(str(tmp_path / 'reviews.journal'))
+    applier = JournalApplier(journal, table, db.flush)
+    journal.append(doc_ids[0], 5, NOW)
+    journal.append(doc_ids[1], 1, NOW)
+    journal.append(doc_ids[0], 4, NOW + timedelta(days=1))
+    table.remove(doc_ids=[doc_ids[1]])
+    assert applier.apply() == 3
+    card = table.get(doc_id=doc_ids[0])
+    assert card['history'] == [5, 4]
+    # The backends keep whole seconds
+    expected = NOW + timedelta(days=1 + sm2([5, 4]))
+    assert abs(card['next_time'] - expected) < timedelta(seconds=1)
+    assert table.get(doc_id=doc_ids[2])['history'] == []
+    # Records already applied are not applied again
+    assert applier.apply() == 0
+    assert table.get(doc_id=doc_ids[0])['history'] == [5, 4]
+    applier.close()
+    journal.close()
+    db.close()
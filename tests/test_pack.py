@@ -0,0 +1,44 @@
+"""
+Tests of the read-only deck packs.
+"""
+from datetime import datetime
+
+from pack import PackDatabase, build
+from search import rank
+from tinydb_storage import open_tinydb
+
+
+def make_pack(tmp_path):
+    db = open_tinydb(str(tmp_path / 'deck.json'), durability=None)
+    table = db.table('t')
+    table.insert_multiple(
+        {'question': question, 'answer': answer, 'hint': hint,
+         'next_time': datetime(2026, 1, day), 'history': []}
+        for day, (question, answer, hint) in enumerate([
+            ('capital of france', 'paris', None),
+            ('capital of spain', 'madrid', ''),
+            ('paris hilton', 'heiress', 'hotels')], 1))
+    path = str(tmp_path / 'deck.pfcpack')
+    build(table, path)
+    db.close()
+    return path
+
+
+def test_hints_keep_none(tmp_path):
+    pack = PackDatabase(make_pack(tmp_path))
+    table = pack.table('t')
+    assert [table.hint(row) for row in range(3)] == [None, '', 'hotels']
+    assert [document['hint'] for document in table.documents(range(3))] \
+        == [None, '', 'hotels']
+    pack.close()
+
+
+def test_search_builds_and_reuses_the_text_index(tmp_path):
+    path = make_pack(tmp_path)
+    pack = PackDatabase(path)
+    ranked = rank(pack.table('t'), 'paris')
+    assert sorted(doc_id for doc_id, _ in ranked) == [0, 2]
+    pack.close()
+    pack = PackDatabase(path)
+    assert rank(pack.table('t'), 'paris') == ranked
+    pack.close()
@@ -0,0 +1,25 @@
+"""
+Tests of the review queue.
+"""
+import pytest
+
+from review_queue import ReviewQueue
+
+
+def test_requeued_cards_come_back_after_their_offset():
+    queue = ReviewQueue('abcd')
+    assert queue.popleft() == 'a'
+    queue.requeue('a', 1)
+    assert [queue.popleft() for _ in range(4)] == ['b', 'a', 'c', 'd']
+
+
+def test_shuffle_keeps_the_cards():
+    queue = ReviewQueue(range(100))
+    queue.shuffle()
+    assert sorted(queue.popleft() for _ in range(100)) == list(range(100))
+
+
+def test_empty_queue_raises():
+    queue = ReviewQueue()
+    with pytest.raises(IndexError):
+        queue.popleft()
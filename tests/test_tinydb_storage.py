@@ -0,0 +1,96 @@
+"""
+Tests of the TinyDB backend shared by several processes.
+
+Each database object keeps its own cache, like a separate process would.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from tinydb_storage import ConcurrentWriteError, open_tinydb
+
+NOW = datetime(2026, 1, 1)
+
+
+def card(question, days=-1):
+    return {'question': question, 'answer': 'a', 'hint': None,
+            'next_time': NOW + timedelta(days=days), 'history': []}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'deck.json')
+    db = open_tinydb(path, durability=None)
+    db.table('t').insert(card('first'))
+    db.close()
+    return path
+
+
+def test_stale_cache_is_reloaded(path):
+    first = open_tinydb(path, durability=None)
+    assert first.table('t').due_ids(NOW) == [1]
+
+    second = open_tinydb(path, durability=None)
+    second.table('t').insert(card('second'))
+    second.close()
+
+    first.table('t').insert(card('third'))
+    first.close()
+
+    third = open_tinydb(path, durability=None)
+    table = third.table('t')
+    assert sorted(document['question'] for document in table) \
+        == ['first', 'second', 'third']
+    assert table.due_ids(NOW) == [1, 2, 3]
+    third.close()
+
+
+def test_pending_writes_are_merged(path):
+    first = open_tinydb(path, durability=None)
+    first.table('t').update({'next_time': NOW + timedelta(days=5)},
+                            doc_ids=[1])
+
+    second = open_tinydb(path, durability=None)
+    second.table('t').insert(card('second'))
+    second.close()
+
+    first.close()
+    third = open_tinydb(path, durability=None)
+    table = third.table('t')
+    assert len(table) == 2
+    assert table.due_ids(NOW) == [2]
+    assert table.due_ids(NOW + timedelta(days=6)) == [2, 1]
+    third.close()
+
+
+def test_conflicting_inserts_raise(path):
+    first = open_tinydb(path, durability=None)
+    first.table('t').insert(card('mine'))
+
+    second = open_tinydb(path, durability=None)
+    second.table('t').insert(card('theirs'))
+    second.close()
+
+    with pytest.raises(ConcurrentWriteError):
+        first.close()
+    # The other card is still in the file
+    third = open_tinydb(path, durability=None)
+    assert [document['question'] for document in third.table('t')] \
+        == ['first', 'theirs']
+    third.close()
+
+
+def test_index_is_not_saved_for_other_data(path):
+    first = open_tinydb(path, durability=None)
+    assert first.table('t').due_ids(NOW) == [1]
+
+    second = open_tinydb(path, durability=None)
+    second.table('t').insert(card('second'))
+    second.close()
+
+    # The stale process rebuilds its index from the data in the file
+    assert first.table('t').due_ids(NOW) == [1, 2]
+    first.close()
+    third = open_tinydb(path, durability=None)
+    assert third.table('t').due_ids(NOW) == [1, 2]
+    third.close()
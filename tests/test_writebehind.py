@@ -0,0 +1,37 @@
+"""
+Tests of the write-behind flush policy.
+"""
+import pytest
+
+from writebehind import WriteBehind
+
+
+def test_flushes_at_max_pending():
+    flushes = []
+    write_behind = WriteBehind(lambda: flushes.append(1), None, 3)
+    write_behind.written(2)
+    assert flushes == [] and write_behind.pending == 2
+    write_behind.written()
+    assert flushes == [1] and write_behind.pending == 0
+    write_behind.close()
+
+
+def test_durability_zero_writes_through():
+    flushes = []
+    write_behind = WriteBehind(lambda: flushes.append(1), 0)
+    write_behind.written()
+    assert flushes == [1]
+    write_behind.close()
+
+
+def test_failed_flush_keeps_the_writes_pending():
+    def fail():
+        raise OSError("disk full")
+
+    write_behind = WriteBehind(fail, None)
+    write_behind.written(2)
+    with pytest.raises(OSError):
+        write_behind.flush()
+    assert write_behind.pending == 2
+    with pytest.raises(OSError):
+        write_behind.close()
@@ -0,0 +1,573 @@
+"""
+TinyDB storage backend for the card tables
+"""
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from index import (DATE_SERIALIZER, ContentIndex, DueIndex, TextIndex,
+                   time_key)
+from metrics import timed
+from writebehind import WriteBehind
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from tinydb import TinyDB
+from tinydb.middlewares import Middleware
+from tinydb.storages import JSONStorage
+from tinydb.table import Table
+from tinydb_serialization import Serializer, SerializationMiddleware
+
+
+class ConcurrentWriteError(RuntimeError):
+    """
+    Raised when another process inserted a document with the same id as
+    one waiting to be written.
+    """
+
+
+def file_signature(path):
+    """
+    Returns the (mtime, size) signature of a file, None if it is missing.
+    """
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _snapshot(data):
+    """Copies the tables of a database down to the documents"""
+    return {name: {doc_id: dict(document)
+                   for doc_id, document in table.items()}
+            for name, table in (data or {}).items()}
+
+
+def _merge(base, ours, theirs):
+    """
+    Applies the documents changed in memory since base on top of the data
+    another process wrote to the file since.
+    Args:
+        base (dict): The data as it was last read or written.
+        ours (dict): The data in memory.
+        theirs (dict): The data now in the file.
+    Returns:
+        (dict): The merged data.
+    Raises:
+        ConcurrentWriteError: If both sides inserted different documents
+            with the same id.
+    """
+    merged = theirs or {}
+    for name in set(base) | set(ours):
+        if name not in ours:
+            merged.pop(name, None)
+            continue
+        base_table = base.get(name, {})
+        our_table = ours[name]
+        their_table = merged.setdefault(name, {})
+        for doc_id in set(base_table) | set(our_table):
+            document = our_table.get(doc_id)
+            if document == base_table.get(doc_id):
+                continue
+            if document is None:
+                their_table.pop(doc_id, None)
+            elif doc_id not in base_table and \
+                    their_table.get(doc_id, document) != document:
+                raise ConcurrentWriteError(
+                    "Document %s of table %s was also inserted by another "
+                    "process" % (doc_id, name))
+            else:
+                their_table[doc_id] = document
+    return merged
+
+
+class DateTimeSerializer(Serializer):
+    OBJ_CLASS = datetime  # The class this serializer handles
+
+    def encode(self, obj):
+        # Same text as strftime('%Y-%m-%dT%H:%M:%S'), without the format
+        # string parsing
+        return time_key(obj)
+
+    def decode(self, s):
+        # fromisoformat is implemented in C and reads the strings written
+        # by older versions, strptime was the bulk of the load time
+        return datetime.fromisoformat(s)
+
+
+class FastJSONStorage(JSONStorage):
+    """
+    A JSONStorage that uses orjson when it is installed.
+
+    Without orjson it behaves exactly like JSONStorage.
+    """
+
+    def __init__(self, path, **kwargs):
+        if orjson is not None:
+            kwargs.setdefault('access_mode', 'rb+')
+        super().__init__(path, **kwargs)
+
+    @timed('storage.read')
+    def read(self):
+        if orjson is None:
+            return super().read()
+        self._handle.seek(0, os.SEEK_END)
+        if not self._handle.tell():
+            return None
+        self._handle.seek(0)
+        return orjson.loads(self._handle.read())
+
+    @timed('storage.write')
+    def write(self, data):
+        if orjson is None:
+            return super().write(data)
+        self._handle.seek(0)
+        self._handle.write(orjson.dumps(data))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.truncate()
+
+
+class IndexedTable(Table):
+    """
+    A TinyDB table that keeps a sorted next_time index next to it.
+
+    Every write done through the table also updates the index, so
+    looking up the due cards is a binary search instead of a full scan.
+    The index rebuilds itself when the database file was changed behind
+    its back. With a write-behind storage the index file is only written
+    after the data reached the database file.
+
+    A content index of the questions and answers and a text index of
+    their words are kept the same way once they were used, or if their
+    file exists, see content_ids and text_postings.
+    """
+
+    def __init__(self, storage, name, db_path=None, index_path=None,
+                 content_path=None, text_path=None, **kwargs):
+        super().__init__(storage, name, **kwargs)
+        self._db_path = db_path
+        self._due_index = DueIndex(index_path)
+        self._content_path = content_path
+        self._content_index = None
+        if content_path is not None and os.path.exists(content_path):
+            self._content_index = ContentIndex(content_path)
+        self._text_path = text_path
+        self._text_index = None
+        if text_path is not None and os.path.exists(text_path):
+            self._text_index = TextIndex(text_path)
+        self._index_dirty = False
+        self._index_synced = False
+        self._writing = False
+        self._lock = getattr(storage, 'lock', None) or threading.RLock()
+        if hasattr(storage, 'add_flush_hook'):
+            storage.add_flush_hook(self._flushed)
+            storage.add_reload_hook(self._reloaded)
+
+    def _signature(self):
+        """Returns the (mtime, size) signature of the database file"""
+        if self._db_path is None:
+            return ['memory']
+        return file_signature(self._db_path)
+
+    def _data_signature(self):
+        """
+        Returns the signature of the file the data in memory was read from
+        or written to, which may be older than the file.
+        """
+        return getattr(self._storage, 'signature', None) or self._signature()
+
+    def _pending(self):
+        """Returns True if the storage holds writes not on disk yet"""
+        return bool(getattr(self._storage, 'pending', 0))
+
+    def _indexes(self):
+        """Returns the indexes maintained by the table"""
+        return [self._due_index] + self._document_indexes()
+
+    def _document_indexes(self, fields=None):
+        """
+        Returns the maintained indexes built from whole documents, only
+        those depending on one of the given fields if any are given.
+        """
+        return [index for index in (self._content_index, self._text_index)
+                if index is not None and (fields is None or any(
+                    field in fields for field in index.FIELDS))]
+
+    def _save_index(self):
+        """Writes the indexes if they changed or the database file did"""
+        if not self._index_synced:
+            return
+        signature = self._data_signature()
+        for index in self._indexes():
+            # Invalidated indexes are rebuilt by the next lookup
+            if index.signature is not None and (
+                    self._index_dirty or index.signature != signature):
+                index.save(signature)
+        self._index_dirty = False
+
+    def _flushed(self):
+        """Called by a write-behind storage after writing to disk"""
+        if not self._writing:
+            self._save_index()
+
+    def _reloaded(self):
+        """
+        Called by a write-behind storage when another process changed the
+        file, the documents in memory were replaced.
+        """
+        self._next_id = None
+        self.clear_cache()
+        for index in self._indexes():
+            index.invalidate()
+
+    def _sync_index(self):
+        """Rebuilds the indexes that are out of sync with the table"""
+        signature = self._signature()
+        if not all(index.valid(signature) for index in self._indexes()):
+            # Reading reloads data the file has moved past, and the indexes
+            # are saved under the signature of the data they are built from
+            self._read_table()
+            signature = self._data_signature()
+            for index in self._indexes():
+                if not index.valid(signature):
+                    index.rebuild(self)
+                    index.save(signature, write=False)
+                    self._index_dirty = True
+        self._index_synced = True
+        if self._index_dirty and not self._pending():
+            self._save_index()
+
+    @contextmanager
+    def _indexed_write(self):
+        """Wraps a write to the table and the matching index changes"""
+        with self._lock:
+            # Reads the changes of other processes before choosing ids
+            self._read_table()
+            self._sync_index()
+            self._writing = True
+            try:
+                yield
+            finally:
+                self._writing = False
+            self._index_dirty = True
+            if not self._pending():
+                self._save_index()
+
+    @timed('table.write', per_table=True)
+    def insert(self, document):
+        with self._indexed_write():
+            doc_id = super().insert(document)
+            if 'next_time' in document:
+                self._due_index.add(doc_id, document['next_time'])
+            for index in self._document_indexes():
+                index.add(doc_id, document)
+        return doc_id
+
+    @timed('table.write', per_table=True)
+    def insert_multiple(self, documents):
+        with self._indexed_write():
+            documents = list(documents)
+            doc_ids = super().insert_multiple(documents)
+            for doc_id, document in zip(doc_ids, documents):
+                if 'next_time' in document:
+                    self._due_index.add(doc_id, document['next_time'])
+                for index in self._document_indexes():
+                    index.add(doc_id, document)
+        return doc_ids
+
+    @timed('table.write', per_table=True)
+    def update(self, fields, cond=None, doc_ids=None):
+        with self._indexed_write():
+            updated = super().update(fields, cond, doc_ids)
+            if callable(fields):
+                # We cannot know which fields were touched
+                for index in self._indexes():
+                    index.invalidate()
+                return updated
+            if 'next_time' in fields:
+                for doc_id in updated:
+                    self._due_index.add(doc_id, fields['next_time'])
+            indexes = self._document_indexes(fields)
+            if indexes:
+                table = self._read_table()
+                for doc_id in updated:
+                    for index in indexes:
+                        index.add(doc_id, table[str(doc_id)])
+        return updated
+
+    @timed('table.write', per_table=True)
+    def update_documents(self, updates):
+        """
+        Sets different fields on several documents with one write.
+        Args:
+            updates (dict): The fields to set by doc_id.
+        Returns:
+            (list of int): The ids of the updated documents.
+        """
+        updated = []
+
+        def updater(table):
+            for doc_id, fields in updates.items():
+                if doc_id in table:
+                    table[doc_id].update(fields)
+                    updated.append(doc_id)
+
+        with self._indexed_write():
+            self._update_table(updater)
+            table = self._read_table()
+            for doc_id in updated:
+                fields = updates[doc_id]
+                if 'next_time' in fields:
+                    self._due_index.add(doc_id, fields['next_time'])
+                for index in self._document_indexes(fields):
+                    index.add(doc_id, table[str(doc_id)])
+        return updated
+
+    def update_multiple(self, updates):
+        with self._indexed_write():
+            updated = super().update_multiple(updates)
+            for index in self._indexes():
+                index.invalidate()
+        return updated
+
+    @timed('table.write', per_table=True)
+    def remove(self, cond=None, doc_ids=None):
+        with self._indexed_write():
+            removed = super().remove(cond, doc_ids)
+            for doc_id in removed:
+                for index in self._indexes():
+                    index.remove(doc_id)
+        return removed
+
+    def truncate(self):
+        with self._indexed_write():
+            super().truncate()
+            for index in self._indexes():
+                index.invalidate()
+
+    @timed('table.due_ids', per_table=True)
+    def due_ids(self, now):
+        """
+        Returns the ids of the documents due at the given time.
+        Args:
+            now (datetime): The reference time.
+        Returns:
+            (list of int): The ids in next_time order.
+        """
+        with self._lock:
+            self._sync_index()
+            return self._due_index.due(now)
+
+    def content_ids(self, key):
+        """
+        Returns the ids of the documents with the given content.
+
+        The first call builds the content index of the table, from then
+        on every write through the table keeps it up to date.
+        Args:
+            key (str): The content key, see index.content_key.
+        Returns:
+            (list of int): The ids of the documents with that content.
+        """
+        with self._lock:
+            if self._content_index is None:
+                self._content_index = ContentIndex(self._content_path)
+            self._sync_index()
+            return self._content_index.find(key)
+
+    def text_postings(self, word, prefix=False):
+        """
+        Returns the weight of a word in the documents holding it.
+
+        The first call builds the text index of the table, from then on
+        every write through the table keeps it up to date.
+        Args:
+            word (str): A normalized word, see index.tokenize.
+            prefix (bool, optional): True also matches the words starting
+                with word.
+        Returns:
+            (dict): The weight of the word by doc_id.
+        """
+        with self._lock:
+            if self._text_index is None:
+                self._text_index = TextIndex(self._text_path)
+            self._sync_index()
+            return self._text_index.postings(word, prefix)
+
+    @timed('table.documents', per_table=True)
+    def documents(self, doc_ids):
+        """
+        Yields the documents with the given ids, skipping missing ones.
+
+        due_ids trusts the due index when the database file still has its
+        signature, without reading the documents. A due id missing here
+        means the index was stale after all, the next lookup rebuilds it.
+        """
+        table = self._read_table()
+        for doc_id in doc_ids:
+            document = table.get(str(doc_id))
+            if document is not None:
+                yield self.document_class(document,
+                                          self.document_id_class(doc_id))
+            elif doc_id in self._due_index:
+                self._due_index.invalidate()
+
+    def due(self, now):
+        """
+        Returns the documents whose next_time is not after the given time.
+        Args:
+            now (datetime): The reference time.
+        Returns:
+            (list of Document): The due documents in next_time order.
+        """
+        return list(self.documents(self.due_ids(now)))
+
+
+class WriteBehindMiddleware(Middleware):
+    """
+    Keeps the database in memory and writes it back in batches.
+
+    Reads are served from memory once the file was read, as long as the
+    file keeps the signature it had then. When another process changed
+    it, reads without pending writes reload it, and pending writes are
+    merged into it document by document instead of overwriting it.
+    Writes replace the data in memory and are written to the wrapped
+    storage following a WriteBehind policy.
+
+    Attributes:
+        cache (dict):      The data in memory.
+        signature (list):  The signature of the file when the cache was
+                           last read from or written to it.
+        lock (RLock):      Held while the cache is read, changed or
+                           written.
+    """
+
+    def __init__(self, storage_cls, durability=1.0, max_pending=1000):
+        super().__init__(storage_cls)
+        self.cache = None
+        self.signature = None
+        self._path = None
+        self._base = None
+        self._flush_hooks = []
+        self._reload_hooks = []
+        self._write_behind = WriteBehind(self._write_through, durability,
+                                         max_pending)
+        self.lock = self._write_behind.lock
+
+    def __call__(self, *args, **kwargs):
+        # TinyDB creates the storage with the path of the database file
+        self._path = args[0] if args else kwargs.get('path')
+        return super().__call__(*args, **kwargs)
+
+    @property
+    def pending(self):
+        return self._write_behind.pending
+
+    def add_flush_hook(self, hook):
+        """
+        Registers a function to call after each write to disk.
+        """
+        self._flush_hooks.append(hook)
+
+    def add_reload_hook(self, hook):
+        """
+        Registers a function to call when the cache was replaced by the
+        changes of another process.
+        """
+        self._reload_hooks.append(hook)
+
+    def _changed(self):
+        """Returns True if the file changed since the cache was synced"""
+        return file_signature(self._path) != self.signature
+
+    def _synced(self):
+        """Records that the cache matches the file"""
+        self.signature = file_signature(self._path)
+        # Keeps the documents as they are in the file, to merge from
+        self._base = _snapshot(self.cache)
+
+    def read(self):
+        with self.lock:
+            if self.cache is None or (not self.pending and self._changed()):
+                reload = self.cache is not None
+                self.cache = self.storage.read()
+                self._synced()
+                if reload:
+                    for hook in self._reload_hooks:
+                        hook()
+            return self.cache
+
+    def write(self, data):
+        with self.lock:
+            self.cache = data
+            self._write_behind.written()
+
+    def _write_through(self):
+        if self.signature is not None and self._changed():
+            self.cache = _merge(self._base, self.cache or {},
+                                self.storage.read())
+            for hook in self._reload_hooks:
+                hook()
+        self.storage.write(self.cache)
+        self._synced()
+        for hook in self._flush_hooks:
+            hook()
+
+    def flush(self):
+        """
+            Writes the pending changes to disk.
+        """
+        self._write_behind.flush()
+
+    def close(self):
+        self._write_behind.close()
+        self.storage.close()
+
+
+class DeckDB(TinyDB):
+    """
+    A TinyDB database whose tables maintain a due index.
+
+    The index of a table is stored in a "<path>.<table>.due" file, its
+    content index, if any, in "<path>.<table>.hash" and its text index in
+    "<path>.<table>.words".
+    """
+    table_class = IndexedTable
+
+    def __init__(self, path, **kwargs):
+        self._path = path
+        super().__init__(path, **kwargs)
+
+    def table(self, name, **kwargs):
+        if name not in self._tables:
+            kwargs.setdefault('db_path', self._path)
+            kwargs.setdefault('index_path', '%s.%s.due' % (self._path, name))
+            kwargs.setdefault('content_path',
+                              '%s.%s.hash' % (self._path, name))
+            kwargs.setdefault('text_path', '%s.%s.words' % (self._path, name))
+        return super().table(name, **kwargs)
+
+    def flush(self):
+        """
+            Writes the pending changes to disk.
+        """
+        if hasattr(self.storage, 'flush'):
+            self.storage.flush()
+
+
+def open_tinydb(path, durability=1.0, max_pending=1000):
+    """Get a TinyDB database object, see storage.open_or_create_db"""
+    serialization = SerializationMiddleware(FastJSONStorage)
+    serialization.register_serializer(DateTimeSerializer(),
+                                     DATE_SERIALIZER)
+    # if not os.path.exists(os.path.dirname(path)):
+    #     os.mkdir(os.path.dirname(path))
+    db = DeckDB(path, storage=WriteBehindMiddleware(serialization,
+                                                    durability, max_pending))
+    return db
@@ -0,0 +1,86 @@
+"""
+Write-behind policy shared by the storage backends
+"""
+import atexit
+import threading
+
+
+class WriteBehind:
+    """
+    Decides when writes buffered in memory are flushed to disk.
+
+    Writes are flushed when max_pending of them have accumulated, when the
+    oldest one has waited durability seconds, on an explicit flush() and
+    when the interpreter exits. A crash therefore loses at most the last
+    durability seconds of writes.
+
+    Attributes:
+        lock (RLock):         Held while the buffer is modified or flushed.
+        durability (float):   The longest time in seconds a write may stay in
+                              memory. 0 writes through, None waits for
+                              flush() or the interpreter exit.
+        max_pending (int):    The number of writes that triggers a flush.
+    """
+
+    def __init__(self, flush, durability=1.0, max_pending=1000):
+        """
+        Constructor.
+        Args:
+            flush (callable): Writes the buffered data to disk.
+            durability (float, optional): See the class attributes.
+            max_pending (int, optional): See the class attributes.
+        """
+        if durability is not None and durability < 0:
+            raise ValueError("durability must be positive or None")
+        self.lock = threading.RLock()
+        self.durability = durability
+        self.max_pending = max_pending
+        self.__flush = flush
+        self.__pending = 0
+        self.__timer = None
+        atexit.register(self.flush)
+
+    @property
+    def pending(self):
+        return self.__pending
+
+    def written(self, count=1):
+        """
+        Records buffered writes and flushes them if a threshold is reached.
+        Args:
+            count (int, optional): The number of writes buffered.
+        """
+        with self.lock:
+            self.__pending += count
+            if self.durability == 0 or self.__pending >= self.max_pending:
+                self.flush()
+            elif self.durability is not None and self.__timer is None:
+                self.__timer = threading.Timer(self.durability, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def flush(self):
+        """
+            Writes the buffered data to disk, if there is any. The writes
+            stay pending if that fails.
+        """
+        with self.lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if self.__pending:
+                pending, self.__pending = self.__pending, 0
+                try:
+                    self.__flush()
+                except BaseException:
+                    self.__pending += pending
+                    raise
+
+    def close(self):
+        """
+            Flushes the buffered data and stops flushing at exit.
+        """
+        try:
+            self.flush()
+        finally:
+            atexit.unregister(self.flush)